@@ -0,0 +1,218 @@
+"""
+Approximate access counts of the files of a
+:class:`~queued_storage.backends.QueuedStorage`, to find the files which
+are actually requested. If a storage has an ``access_sample_rate`` (see
+:attr:`~queued_storage.conf.settings.QUEUED_STORAGE_ACCESS_SAMPLE_RATE`),
+that share of the calls of its ``open`` and ``url`` methods is counted::
+
+    storage = QueuedS3BotoStorage(access_sample_rate=0.01)
+    storage.hot_files(10)  # [('popular.jpg', 1200), ...]
+
+Each process counts in memory, in a
+:class:`~queued_storage.access.CountMinSketch` which needs the same
+memory however many files are counted, and keeps track of the most
+accessed files only. Every
+:attr:`~queued_storage.conf.settings.QUEUED_STORAGE_ACCESS_FLUSH_INTERVAL`
+seconds their counts are added to the ones in the cache in the background,
+with a couple of requests for all of them. The counts expire
+:attr:`~queued_storage.conf.settings.QUEUED_STORAGE_ACCESS_TIMEOUT`
+seconds after the last access.
+
+The most accessed files are downloaded first when warming the local
+copies (see :meth:`~queued_storage.backends.QueuedStorage.warm`), and the
+:func:`~queued_storage.tiering.rarely_accessed` policy moves files nobody
+requests to colder tiers.
+"""
+import hashlib
+import heapq
+import random
+import struct
+import threading
+import time
+from array import array
+
+from django.core.cache import cache
+from django.utils.http import urlquote
+
+from .conf import settings
+
+
+class CountMinSketch(object):
+    """
+    Approximate counts of any number of keys in ``depth`` rows of
+    ``width`` counters. Estimates are never too low, and too high by at
+    most about ``2 / width`` of the total count with a probability of
+    ``1 - 0.5 ** depth``.
+
+    :param width: the number of counters per row
+    :type width: int
+    :param depth: the number of rows
+    :type depth: int
+    """
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.clear()
+
+    def clear(self):
+        """
+        Resets all counts to zero.
+        """
+        self.rows = [array('L', [0]) * self.width for _ in range(self.depth)]
+
+    def _indexes(self, key):
+        digest = hashlib.md5(key.encode('utf-8')).digest()
+        first, second = struct.unpack('<QQ', digest)
+        # Derives the hashes of all rows from two (Kirsch-Mitzenmacher).
+        return [(first + row * second) % self.width
+                for row in range(self.depth)]
+
+    def add(self, key, count=1):
+        """
+        Adds to the count of the given key and returns its new estimate.
+        """
+        estimate = None
+        for row, index in zip(self.rows, self._indexes(key)):
+            row[index] += count
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+        return estimate
+
+    def estimate(self, key):
+        """
+        Returns the estimated count of the given key.
+        """
+        return min(row[index]
+                   for row, index in zip(self.rows, self._indexes(key)))
+
+
+class AccessTracker(object):
+    """
+    Counts a sample of the accesses of files in memory and adds the counts
+    of the most accessed ones to the counts in the cache periodically, see
+    :mod:`~queued_storage.access`.
+
+    :param cache_prefix: the cache key prefix of the storage
+    :type cache_prefix: str
+    :param sample_rate: the share of accesses to count, between 0 and 1
+    :type sample_rate: float
+    :param size: how many of the most accessed files to keep track of
+                 (default see
+                 :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_ACCESS_HOT_SIZE`)
+    :type size: int
+    :param flush_interval: the number of seconds between flushes (default
+        see :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_ACCESS_FLUSH_INTERVAL`)
+    :type flush_interval: float
+    """
+    def __init__(self, cache_prefix, sample_rate, size=None,
+                 flush_interval=None):
+        self.cache_prefix = cache_prefix
+        self.sample_rate = sample_rate
+        self.size = size or settings.QUEUED_STORAGE_ACCESS_HOT_SIZE
+        if flush_interval is None:
+            flush_interval = settings.QUEUED_STORAGE_ACCESS_FLUSH_INTERVAL
+        self.flush_interval = flush_interval
+        self.sketch = CountMinSketch()
+        # The estimated counts of the most accessed files since the last
+        # flush, and the lowest of them.
+        self._candidates = {}
+        self._floor = 0
+        self._lock = threading.Lock()
+        self._flushing = False
+        self._last_flush = time.time()
+
+    def record(self, name):
+        """
+        Counts an access of the file with the given name, if it's sampled,
+        and starts flushing the counts in a background thread if it's time.
+
+        :param name: file name
+        :type name: str
+        """
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        with self._lock:
+            estimate = self.sketch.add(name)
+            candidates = self._candidates
+            if name in candidates or len(candidates) < self.size:
+                candidates[name] = estimate
+            elif estimate > self._floor:
+                del candidates[min(candidates, key=candidates.get)]
+                candidates[name] = estimate
+                self._floor = min(candidates.values())
+            due = (not self._flushing and
+                   time.time() - self._last_flush >= self.flush_interval)
+            if due:
+                self._flushing = True
+        if due:
+            flusher = threading.Thread(target=self.flush)
+            flusher.daemon = True
+            flusher.start()
+
+    def flush(self):
+        """
+        Adds the counts of the most accessed files since the last flush,
+        scaled by the sample rate, to their counts in the cache and updates
+        the cached list of the most accessed files.
+        """
+        with self._lock:
+            candidates, self._candidates = self._candidates, {}
+            self._floor = 0
+            self.sketch.clear()
+            self._last_flush = time.time()
+        try:
+            if not candidates:
+                return
+            timeout = settings.QUEUED_STORAGE_ACCESS_TIMEOUT
+            keys = dict((self.get_access_key(name), name)
+                        for name in candidates)
+            counts = cache.get_many(list(keys))
+            for key, name in keys.items():
+                counts[key] = counts.get(key, 0) + max(
+                    1, int(round(candidates[name] / float(self.sample_rate))))
+            cache.set_many(counts, timeout)
+            hot = dict(cache.get(self.get_hot_key()) or [])
+            hot.update((name, counts[key]) for key, name in keys.items())
+            cache.set(self.get_hot_key(),
+                      heapq.nlargest(self.size, hot.items(),
+                                     key=lambda item: item[1]),
+                      timeout)
+        finally:
+            self._flushing = False
+
+    def get_count(self, name):
+        """
+        Returns the approximate number of accesses of the file with the
+        given name which have been flushed.
+
+        :rtype: int
+        """
+        return cache.get(self.get_access_key(name), 0)
+
+    def get_counts(self, names):
+        """
+        Returns the approximate numbers of accesses of the files with the
+        given names which have been flushed, by name.
+
+        :rtype: dict
+        """
+        keys = dict((self.get_access_key(name), name) for name in names)
+        counts = cache.get_many(list(keys))
+        return dict((name, counts.get(key, 0)) for key, name in keys.items())
+
+    def hot(self, limit=None):
+        """
+        Returns the most accessed files as ``(name, count)`` pairs, the
+        most accessed first.
+
+        :param limit: the maximum number of files
+        :type limit: int
+        :rtype: list
+        """
+        return list(cache.get(self.get_hot_key()) or [])[:limit]
+
+    def get_access_key(self, name):
+        return '%s_access:%s' % (self.cache_prefix, urlquote(name))
+
+    def get_hot_key(self):
+        return '%s_access_hot' % self.cache_prefix
@@ -1,16 +1,34 @@
+import io
+import itertools
+import os
+import posixpath
 import six
+import time
 
 from packaging import version
 
 import django
 
+from django.apps import apps
 from django.core.cache import cache
-from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import (FieldDoesNotExist, ImproperlyConfigured,
+                                    SuspiciousFileOperation)
+from django.core.files.base import File
+from django.utils import timezone
+from django.utils.crypto import get_random_string
 from django.utils.functional import SimpleLazyObject
 from django.utils.http import urlquote
 
+from .access import AccessTracker
 from .conf import settings
-from .utils import import_attribute
+from .files import (STAT_FIELDS, RangedFile, delete_files, get_file_stat,
+                    get_range_reader, iter_listdir, open_mapped)
+from .journal import get_journal
+from .signed_urls import URLCache, get_url_lifetime
+from .tiering import match_policy
+from .utils import (LRUIndex, gcs_uri, get_backend, get_deletion_key,
+                    get_in_flight_key, get_migration_key, get_stat_key,
+                    import_attribute)
 
 DJANGO_VERSION = django.get_version()
 
@@ -44,6 +62,27 @@ class QueuedStorage(object):
     :type delayed: bool
     :param task: Celery task to use for the transfer
     :type task: str
+    :param transforms: transforms to apply to the files during the transfer
+    :type transforms: list
+    :param local_cache_size: the maximum size in bytes of the local copies
+                             of transferred files kept for reading
+    :type local_cache_size: int
+    :param journal: the path of the journal to record pending transfers in
+    :type journal: str
+    :param executor: executor to run the tasks with
+    :type executor: str
+    :param previous_remote: remote storage class the files are being
+                            migrated from
+    :type previous_remote: str
+    :param previous_remote_options: options of the previous remote storage
+                                    class
+    :type previous_remote_options: dict
+    :param tiers: colder storage tiers after the remote storage
+    :type tiers: list
+    :param access_sample_rate: the share of file accesses to count
+    :type access_sample_rate: float
+    :param url_cache_size: the maximum number of signed URLs kept in memory
+    :type url_cache_size: int
     """
     #: The local storage class to use. A dotted path (e.g.
     #: ``'django.core.files.storage.FileSystemStorage'``).
@@ -59,11 +98,45 @@ class QueuedStorage(object):
     #: The options of the remote storage class, defined as a dictionary.
     remote_options = None
 
+    #: The remote storage class the files are being migrated from to the
+    #: remote storage, see :mod:`~queued_storage.migration`. A dotted path.
+    #: Files which haven't been migrated yet are read from it.
+    previous_remote = None
+
+    #: The options of the previous remote storage class, defined as a
+    #: dictionary.
+    previous_remote_options = None
+
+    #: Colder storage tiers the files of the remote storage are moved to
+    #: over time, see :mod:`~queued_storage.tiering`. A list of
+    #: ``(storage class, options, policy)`` triples, from the warmest to
+    #: the coldest tier.
+    tiers = None
+
     #: The Celery task class to use to transfer files from the local
     #: to the remote storage. A dotted path (e.g.
     #: ``'queued_storage.tasks.Transfer'``).
     task = 'queued_storage.tasks.Transfer'
 
+    #: The Celery task class to use to transfer many files at once with
+    #: :meth:`~queued_storage.backends.QueuedStorage.transfer_many`.
+    #: A dotted path.
+    batch_task = 'queued_storage.tasks.TransferBatch'
+
+    #: The Celery task class to use to delete files from the remote storage
+    #: with :meth:`~queued_storage.backends.QueuedStorage.delete_many`.
+    #: A dotted path.
+    delete_task = 'queued_storage.tasks.DeleteFiles'
+
+    #: The Celery task class to use to copy files from the previous to the
+    #: current remote storage, see :mod:`~queued_storage.migration`.
+    #: A dotted path.
+    migrate_task = 'queued_storage.tasks.MigrateBatch'
+
+    #: The Celery task class to use to move files to colder tiers, see
+    #: :mod:`~queued_storage.tiering`. A dotted path.
+    demote_task = 'queued_storage.tasks.DemoteBatch'
+
     #: If set to ``True`` the backend will *not* transfer files to the remote
     #: location automatically, but instead requires manual intervention by the
     #: user with the :meth:`~queued_storage.backends.QueuedStorage.transfer`
@@ -75,9 +148,56 @@ class QueuedStorage(object):
     #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_CACHE_PREFIX`)
     cache_prefix = settings.QUEUED_STORAGE_CACHE_PREFIX
 
+    #: The transforms the content of the files is streamed through on its
+    #: way to the remote storage, after the ones of the task. Dotted paths
+    #: or ``(dotted path, options)`` pairs, see
+    #: :mod:`~queued_storage.transforms`.
+    transforms = None
+
+    #: If set, files which have been transferred are read from local copies
+    #: instead of the remote storage. Missing copies are downloaded when the
+    #: files are opened for reading, and the least recently read ones are
+    #: deleted again when their total size exceeds this number of bytes
+    #: (default see
+    #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_LOCAL_CACHE_SIZE`).
+    #: Each process only counts the copies it read, the copies of all
+    #: processes using the same local storage directory are counted
+    #: periodically in the background, see
+    #: :meth:`~queued_storage.backends.QueuedStorage.scan_local_cache`.
+    local_cache_size = settings.QUEUED_STORAGE_LOCAL_CACHE_SIZE
+
+    #: If set, saving a file appends the transfer to the
+    #: :mod:`~queued_storage.journal` with this path instead of queuing
+    #: the task right away (default see
+    #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_JOURNAL`).
+    journal = settings.QUEUED_STORAGE_JOURNAL
+
+    #: If set, this share of the calls of
+    #: :meth:`~queued_storage.backends.QueuedStorage.open` and
+    #: :meth:`~queued_storage.backends.QueuedStorage.url` is counted to
+    #: find the most accessed files, see :mod:`~queued_storage.access`
+    #: (default see
+    #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_ACCESS_SAMPLE_RATE`).
+    access_sample_rate = settings.QUEUED_STORAGE_ACCESS_SAMPLE_RATE
+
+    #: The maximum number of signed URLs of remote files kept in memory,
+    #: see :mod:`~queued_storage.signed_urls` (default see
+    #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_URL_CACHE_SIZE`).
+    #: Signed URLs aren't cached if it's ``0``.
+    url_cache_size = settings.QUEUED_STORAGE_URL_CACHE_SIZE
+
+    #: The executor to run the tasks with. A dotted path, see
+    #: :mod:`~queued_storage.executors` (default see
+    #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_EXECUTOR`).
+    executor = settings.QUEUED_STORAGE_EXECUTOR
+
     def __init__(self, local=None, remote=None,
                  local_options=None, remote_options=None,
-                 cache_prefix=None, delayed=None, task=None):
+                 cache_prefix=None, delayed=None, task=None,
+                 transforms=None, local_cache_size=None, journal=None,
+                 executor=None, previous_remote=None,
+                 previous_remote_options=None, tiers=None,
+                 access_sample_rate=None, url_cache_size=None):
 
         self.local_path = local or self.local
         self.local_options = local_options or self.local_options or {}
@@ -89,12 +209,69 @@ class QueuedStorage(object):
         self.remote = self._load_backend(backend=self.remote_path,
                                          options=self.remote_options)
 
-        self.task = self._load_backend(backend=task or self.task,
+        self.previous_remote_path = previous_remote or self.previous_remote
+        self.previous_remote_options = (previous_remote_options or
+                                        self.previous_remote_options or {})
+        self.previous_remote = None
+        if self.previous_remote_path:
+            self.previous_remote = self._load_backend(
+                backend=self.previous_remote_path,
+                options=self.previous_remote_options)
+
+        # The local storage is the tier 0, the remote storage the tier 1.
+        tiers = tiers or self.tiers or []
+        self.tier_config = [(self.local_path, self.local_options, None),
+                            (self.remote_path, self.remote_options, None)]
+        self.tiers = [self.local, self.remote]
+        for tier_path, tier_options, policy in tiers:
+            tier_options = tier_options or {}
+            self.tier_config.append((tier_path, tier_options, policy))
+            self.tiers.append(self._load_backend(backend=tier_path,
+                                                 options=tier_options))
+
+        self.task_path = task or self.task
+        self.task = self._load_backend(backend=self.task_path,
                                        handler=import_attribute)
+        self.batch_task_path = self.batch_task
+        self.batch_task = self._load_backend(backend=self.batch_task_path,
+                                             handler=import_attribute)
+        self.delete_task = self._load_backend(backend=self.delete_task,
+                                              handler=import_attribute)
+        self.migrate_task = self._load_backend(backend=self.migrate_task,
+                                               handler=import_attribute)
+        self.demote_task = self._load_backend(backend=self.demote_task,
+                                              handler=import_attribute)
+        self.executor_path = executor or self.executor
+        self.executor = self._load_backend(backend=self.executor_path,
+                                           handler=get_backend)
         if delayed is not None:
             self.delayed = delayed
         if cache_prefix is not None:
             self.cache_prefix = cache_prefix
+        if transforms is not None:
+            self.transforms = transforms
+        if local_cache_size is not None:
+            self.local_cache_size = local_cache_size
+        if journal is not None:
+            self.journal = journal
+        # Labels of the QueuedFileFields tracking the transfer state of
+        # their files which use this storage, see QueuedFileField.
+        self.state_fields = []
+        # The local copies of transferred files, see scan_local_cache.
+        self.local_cache = None
+        if self.local_cache_size:
+            self.local_cache = LRUIndex(self.local_cache_size)
+        if access_sample_rate is not None:
+            self.access_sample_rate = access_sample_rate
+        self.access_tracker = None
+        if self.access_sample_rate:
+            self.access_tracker = AccessTracker(self.cache_prefix,
+                                                self.access_sample_rate)
+        if url_cache_size is not None:
+            self.url_cache_size = url_cache_size
+        self.url_cache = None
+        if self.url_cache_size:
+            self.url_cache = URLCache(self.url_cache_size)
 
     def _load_backend(self, backend=None, options=None, handler=LazyBackend):
         if backend is None:  # pragma: no cover
@@ -114,10 +291,17 @@ class QueuedStorage(object):
         with the given name (either local or remote). This method is
         used in most of the storage API methods.
 
+        During a migration remote files are looked up in the remote storage
+        first and in the previous remote storage if they haven't been
+        migrated yet, and files in colder tiers in those, see
+        :meth:`~queued_storage.backends.QueuedStorage.get_storage_many`.
+
         :param name: file name
         :type name: str
         :rtype: :class:`~django:django.core.files.storage.Storage`
         """
+        if self.previous_remote is not None or len(self.tiers) > 2:
+            return self.get_storage_many([name])[name]
         cache_result = cache.get(self.get_cache_key(name))
         if cache_result:
             return self.remote
@@ -127,6 +311,80 @@ class QueuedStorage(object):
         else:
             return self.local
 
+    def get_storage_many(self, names):
+        """
+        Returns a dictionary mapping the given file names to the storage
+        backend instances responsible for them, looking them all up in the
+        cache at once.
+
+        The cache keys hold the tiers of the files (``False`` for the local
+        storage, ``True`` for the remote storage and the numbers of the
+        colder :attr:`~queued_storage.backends.QueuedStorage.tiers` from 2
+        on). Files the cache doesn't know are looked for in the tiers from
+        the warmest to the coldest, once.
+
+        During a migration whether the remote files have been migrated is
+        looked up together with their cache keys. Files for which that's
+        unknown are looked for in the remote storage first and then in the
+        previous remote storage, once.
+
+        :param names: file names
+        :type names: iterable
+        :rtype: dict
+        """
+        keys = dict((self.get_cache_key(name), name) for name in names)
+        lookup = list(keys)
+        if self.previous_remote is not None:
+            lookup += [get_migration_key(cache_key) for cache_key in keys]
+        cache_results = cache.get_many(lookup)
+        storages, found = {}, {}
+        for cache_key, name in keys.items():
+            tier = cache_results.get(cache_key)
+            migration_key = get_migration_key(cache_key)
+            migrated = True
+            if self.previous_remote is not None:
+                migrated = cache_results.get(migration_key)
+            if tier is None:
+                tier, migrated = self.find_tier(name)
+                if tier:
+                    found[cache_key] = tier
+                if tier == 1 and self.previous_remote is not None:
+                    found[migration_key] = migrated
+            elif tier == 1 and migrated is None:
+                # Files gone from both are left to the remote storage.
+                migrated = (self.remote.exists(name) or
+                            not self.previous_remote.exists(name))
+                found[migration_key] = migrated
+            if tier == 1 and not migrated:
+                storages[name] = self.previous_remote
+            else:
+                storages[name] = self.tiers[tier or 0]
+        if found:
+            cache.set_many(found)
+        return storages
+
+    def find_tier(self, name):
+        """
+        Looks for the file with the given name in the remote storage, the
+        previous remote storage and the colder tiers, in this order.
+
+        :param name: file name
+        :type name: str
+        :returns: the tier (``False`` if the file isn't in any, ``True`` for
+                  the remote storage), and whether the file has been
+                  migrated from the previous remote storage
+        :rtype: tuple
+        """
+        if self.remote.exists(name):
+            return True, True
+        if (self.previous_remote is not None and
+                self.previous_remote.exists(name)):
+            return True, False
+        for tier in range(2, len(self.tiers)):
+            if self.tiers[tier].exists(name):
+                return tier, True
+        return False, True
+
     def get_cache_key(self, name):
         """
         Returns the cache key for the given file name.
@@ -157,7 +415,7 @@ class QueuedStorage(object):
         :type name: str
         :rtype: bool
         """
-        return self.get_storage(name) is self.remote
+        return self.get_storage(name) is not self.local
 
     def open(self, name, mode='rb'):
         """
@@ -169,58 +427,493 @@ class QueuedStorage(object):
         :type mode: str
         :rtype: :class:`~django:django.core.files.File`
         """
-        return self.get_storage(name).open(name, mode)
+        if self.access_tracker is not None:
+            self.access_tracker.record(name)
+        storage = self.get_storage(name)
+        if (storage is self.remote and self.local_cache is not None and
+                not set('wa+').intersection(mode)):
+            return self.open_cached(name, mode)
+        return storage.open(name, mode)
+
+    def open_mapped(self, name):
+        """
+        Opens the file with the given name for reading like
+        :meth:`~queued_storage.backends.QueuedStorage.open`, but
+        memory-mapped as long as it's still in a local storage with
+        filesystem paths. Its
+        :meth:`~queued_storage.files.MappedFile.buffers` are then
+        :class:`~python:memoryview` slices which can be hashed, written
+        or transferred without copying them.
 
-    def save(self, name, content, max_length=None):
+        :param name: file name
+        :type name: str
+        :rtype: :class:`~django:django.core.files.File`
+        """
+        if self.get_storage(name) is self.local:
+            return open_mapped(self.local, name)
+        return self.open(name)
+
+    def open_range(self, name, start=0, end=None, read_ahead=None):
+        """
+        Opens the bytes of the file with the given name from ``start`` up
+        to (not including) ``end`` for reading, without downloading the
+        whole file. Remote files are read with ranged requests of at least
+        ``read_ahead`` bytes as needed, local files directly. The returned
+        file is seekable, positions are relative to ``start``.
+
+        :param name: file name
+        :type name: str
+        :param start: the offset of the first byte
+        :type start: int
+        :param end: the offset after the last byte (default: end of file)
+        :type end: int
+        :param read_ahead: the minimum number of bytes per request (default
+            see :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_READ_AHEAD`)
+        :type read_ahead: int
+        :rtype: :class:`~django:django.core.files.File`
+        """
+        read_ahead = read_ahead or settings.QUEUED_STORAGE_READ_AHEAD
+        reader = get_range_reader(self.get_storage(name), name)
+        return File(io.BufferedReader(RangedFile(reader, start, end),
+                                      buffer_size=read_ahead), name=name)
+
+    def open_cached(self, name, mode='rb'):
+        """
+        Opens the local copy of the transferred file with the given name,
+        downloading it from the remote storage first if there is none, and
+        deletes the least recently read copies exceeding the
+        :attr:`~queued_storage.backends.QueuedStorage.local_cache_size`.
+
+        :param name: file name
+        :type name: str
+        :param mode: mode to open the file with
+        :type mode: str
+        :rtype: :class:`~django:django.core.files.File`
+        """
+        try:
+            if not self.local_cache.touch(name):
+                if not self.local.exists(name):
+                    self.download(name)
+                self.local_cache.touch(name, self.local.size(name))
+            content = self.local.open(name, mode)
+        except (IOError, OSError):
+            # E.g. evicted by another process in the meantime.
+            self.local_cache.discard(name)
+            return self.remote.open(name, mode)
+        self.mark_read(name)
+        self.evict(keep=name)
+        return content
+
+    def scan_local_cache(self):
+        """
+        Rebuilds the index of the local copies of transferred files from
+        the local storage directory and deletes the least recently read
+        ones exceeding the
+        :attr:`~queued_storage.backends.QueuedStorage.local_cache_size`,
+        so that the copies downloaded by other processes, or before a
+        restart, count too. The copies are ordered by their modification
+        time, which is updated whenever one is read. Local storages
+        without filesystem paths aren't scanned.
+
+        Stats every local file, so it's meant to run in the background,
+        e.g. with the ``evict_local_copies`` management command, not
+        while serving requests.
+        """
+        if self.local_cache is None:
+            return
+        try:
+            root = self.local.path('')
+        except NotImplementedError:
+            return
+        files = {}
+        for dir_path, dir_names, file_names in os.walk(root):
+            for file_name in file_names:
+                file_path = os.path.join(dir_path, file_name)
+                name = os.path.relpath(file_path, root).replace(os.sep, '/')
+                try:
+                    result = os.stat(file_path)
+                except OSError:
+                    continue
+                files[self.get_cache_key(name)] = (result.st_mtime, name,
+                                                   result.st_size)
+        # Local files which haven't been transferred aren't copies.
+        tiers = cache.get_many(list(files))
+        copies = sorted(entry for cache_key, entry in files.items()
+                        if tiers.get(cache_key))
+        self.local_cache.reset((name, size) for _, name, size in copies)
+        self.evict()
+
+    def mark_read(self, name):
+        """
+        Updates the modification time of the local copy of the file with
+        the given name, which orders the copies by their last read, see
+        :meth:`~queued_storage.backends.QueuedStorage.scan_local_cache`.
+
+        :param name: file name
+        :type name: str
+        """
+        try:
+            os.utime(self.local.path(name), None)
+        except (NotImplementedError, OSError):
+            pass
+
+    def download(self, name):
+        """
+        Copies the file with the given name from the remote to the local
+        storage.
+
+        :param name: file name
+        :type name: str
+        """
+        content = self.remote.open(name)
+        try:
+            saved_name = self.local.save(name, content)
+        finally:
+            content.close()
+        if saved_name != name:
+            # Another process was faster, use its copy.
+            self.local.delete(saved_name)
+
+    def warm(self, limit=None):
+        """
+        Downloads local copies of the most accessed remote files (see
+        :mod:`~queued_storage.access`), the most accessed first, until
+        their total size reaches the
+        :attr:`~queued_storage.backends.QueuedStorage.local_cache_size`.
+
+        :param limit: the maximum number of files to consider
+        :type limit: int
+        :returns: the number of downloaded files
+        :rtype: int
+        """
+        if self.local_cache is None or self.access_tracker is None:
+            return 0
+        self.scan_local_cache()
+        names = [name for name, _ in self.access_tracker.hot(limit)]
+        count = 0
+        storages = self.get_storage_many(names)
+        for name in names:
+            if self.local_cache.size >= self.local_cache.max_size:
+                break
+            if storages[name] is not self.remote or name in self.local_cache:
+                continue
+            try:
+                if not self.local.exists(name):
+                    self.download(name)
+                    count += 1
+                self.local_cache.touch(name, self.local.size(name))
+            except (IOError, OSError):
+                continue
+        return count
+
+    def hot_files(self, limit=None):
+        """
+        Returns the most accessed files as ``(name, count)`` pairs, the
+        most accessed first, see :mod:`~queued_storage.access`.
+
+        :param limit: the maximum number of files
+        :type limit: int
+        :rtype: list
+        """
+        if self.access_tracker is None:
+            return []
+        return self.access_tracker.hot(limit)
+
+    def evict(self, keep=None):
+        """
+        Deletes the least recently read local copies of transferred files
+        until their total size doesn't exceed the
+        :attr:`~queued_storage.backends.QueuedStorage.local_cache_size`.
+        Local files which haven't been transferred are never deleted.
+
+        :param keep: the name of a file not to delete
+        :type keep: str
+        """
+        for name in self.local_cache.pop_excess(keep=keep):
+            if cache.get(self.get_cache_key(name)):
+                self.local.delete(name)
+
+    def save(self, name, content, max_length=None, transfer=None):
         """
         Saves the given content with the given name using the local
         storage. If the :attr:`~queued_storage.backends.QueuedStorage.delayed`
-        attribute is ``True`` this will automatically call the
-        :meth:`~queued_storage.backends.QueuedStorage.transfer` method
-        queuing the transfer from local to remote storage.
+        attribute is ``False`` this will automatically queue the transfer
+        from local to remote storage, see
+        :meth:`~queued_storage.backends.QueuedStorage.queue_transfer`.
 
         :param name: file name
         :type name: str
         :param content: content of the file specified by name
         :type content: :class:`~django:django.core.files.File`
+        :param transfer: whether to queue the transfer (default: unless
+                         :attr:`~queued_storage.backends.QueuedStorage.delayed`)
+        :type transfer: bool
         :rtype: str
         """
-        cache_key = self.get_cache_key(name)
-        cache.set(cache_key, False)
-
         # Use a name that is available on both the local and remote storage
         # systems and save locally.
-        # name = self.get_available_name(name)
+        reserved_name = name = self.get_available_name(name,
+                                                       max_length=max_length)
+        cache_key = self.get_cache_key(name)
+        cache.set(cache_key, False)
+        cache.delete_many([get_stat_key(cache_key),
+                           get_migration_key(cache_key)])
+        if self.local_cache is not None:
+            # Not a copy anymore until transferred again.
+            self.local_cache.discard(name)
 
         try:
             name = self.local.save(name, content, max_length=max_length)
         except TypeError:
             # Django < 1.10
             name = self.local.save(name, content)
+        if name != reserved_name:
+            # Taken locally in the meantime.
+            cache_key = self.get_cache_key(name)
+            cache.set_many({cache_key: False,
+                            self.get_cache_key(reserved_name): None})
+        cache.delete(self.get_reservation_key(reserved_name))
+        self.invalidate_listings([name])
 
         # Pass on the cache key to prevent duplicate cache key creation,
         # we save the result in the storage to be able to test for it
-        if not self.delayed:
-            self.result = self.transfer(name, cache_key=cache_key)
+        if transfer is None:
+            transfer = not self.delayed
+        if transfer:
+            self.result = self.queue_transfer(name, cache_key=cache_key)
         return name
 
-    def transfer(self, name, cache_key=None):
+    def queue_transfer(self, name, cache_key=None, origin=None):
+        """
+        Queues the transfer of the file with the given name like saving it
+        does: appends it to the
+        :attr:`~queued_storage.backends.QueuedStorage.journal` if there is
+        one, otherwise calls the
+        :meth:`~queued_storage.backends.QueuedStorage.transfer` method.
+
+        :param name: file name
+        :type name: str
+        :param cache_key: the cache key to set after a successful task run
+        :type cache_key: str
+        :param origin: the model label, primary key and field name of the
+                       object the file belongs to
+        :type origin: list
+        :rtype: task result, or ``None`` if journaled or already queued
+        """
+        if cache_key is None:
+            cache_key = self.get_cache_key(name)
+        if self.journal:
+            get_journal(self.journal).append(name, cache_key,
+                                             self.get_journal_config())
+            return None
+        return self.transfer(name, cache_key=cache_key, origin=origin)
+
+    def transfer(self, name, cache_key=None, origin=None):
         """
         Transfers the file with the given name to the remote storage
-        backend by queuing the task.
+        backend by queuing the task, unless its transfer is already queued
+        (see :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_IN_FLIGHT_TIMEOUT`).
 
         :param name: file name
         :type name: str
         :param cache_key: the cache key to set after a successful task run
         :type cache_key: str
-        :rtype: task result
+        :param origin: the model label, primary key and field name of the
+                       object the file belongs to, passed on to the
+                       receivers of the ``file_transferred`` signal
+        :type origin: list
+        :rtype: task result, or ``None`` if the transfer is already queued
         """
         if cache_key is None:
             cache_key = self.get_cache_key(name)
+        in_flight_key = get_in_flight_key(cache_key)
+        if not cache.add(in_flight_key, True,
+                         settings.QUEUED_STORAGE_IN_FLIGHT_TIMEOUT):
+            return None
+
+        kwargs = self.get_task_kwargs()
+        if origin:
+            kwargs['origin'] = list(origin)
+        try:
+            return self.executor.submit(self.task,
+                                        [name, cache_key,
+                                         self.local_path, self.remote_path,
+                                         self.local_options,
+                                         self.remote_options],
+                                        kwargs)
+        except Exception:
+            # Nothing was queued, so the next attempt mustn't be skipped.
+            cache.delete(in_flight_key)
+            raise
+
+    def transfer_many(self, names, batch_size=None, callback=None):
+        """
+        Transfers the files with the given names to the remote storage
+        backend, queuing one
+        :attr:`~queued_storage.backends.QueuedStorage.batch_task` per
+        ``batch_size`` files. The names are consumed lazily, so they can be
+        a generator over any number of files. Files whose transfer is
+        already queued are skipped.
+
+        :param names: file names
+        :type names: iterable
+        :param batch_size: the number of files per task (default see
+            :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_BATCH_SIZE`)
+        :type batch_size: int
+        :param callback: called with the task result and the names after
+                         queuing each batch
+        :type callback: callable
+        :rtype: the number of queued files
+        """
+        batch_size = batch_size or settings.QUEUED_STORAGE_BATCH_SIZE
+        timeout = settings.QUEUED_STORAGE_IN_FLIGHT_TIMEOUT
+        items = ((name, self.get_cache_key(name)) for name in names)
+        items = ((name, cache_key) for name, cache_key in items
+                 if cache.add(get_in_flight_key(cache_key), True, timeout))
+        count = 0
+        while True:
+            batch = list(itertools.islice(items, batch_size))
+            if not batch:
+                return count
+            kwargs = self.get_task_kwargs()
+            kwargs['task'] = self.task_path
+            try:
+                result = self.executor.submit(
+                    self.batch_task,
+                    [[[name, cache_key] for name, cache_key in batch],
+                     self.local_path, self.remote_path,
+                     self.local_options, self.remote_options],
+                    kwargs)
+            except Exception:
+                cache.delete_many([get_in_flight_key(cache_key)
+                                   for _, cache_key in batch])
+                raise
+            count += len(batch)
+            if callback is not None:
+                callback(result, [name for name, _ in batch])
+
+    def demote(self, names, batch_size=None, server_side=True,
+               callback=None):
+        """
+        Moves the files with the given names to the coldest of the colder
+        :attr:`~queued_storage.backends.QueuedStorage.tiers` whose policy
+        they match (given their metadata, and their ``access_count`` if
+        accesses are counted), queuing one
+        :attr:`~queued_storage.backends.QueuedStorage.demote_task` per
+        ``batch_size`` files moving between the same tiers. Files which
+        are local, not migrated yet or in no colder tier's policy stay.
+
+        :param names: file names
+        :type names: iterable
+        :param batch_size: the number of files per task (default see
+            :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_BATCH_SIZE`)
+        :type batch_size: int
+        :param server_side: whether to copy server-side where possible, see
+                            :func:`~queued_storage.files.copy_file`
+        :type server_side: bool
+        :param callback: called with the task result and the names after
+                         queuing each batch
+        :type callback: callable
+        :rtype: the number of queued files
+        """
+        batch_size = batch_size or settings.QUEUED_STORAGE_BATCH_SIZE
+        names = list(names)
+        storages = self.get_storage_many(names)
+        tiers = dict((id(storage), tier)
+                     for tier, storage in enumerate(self.tiers))
+        # Files of the coldest tier can't move any further.
+        tiers = dict((name, tiers.get(id(storage))) for name, storage
+                     in storages.items()
+                     if 0 < tiers.get(id(storage), 0) < len(self.tiers) - 1)
+        moves = {}
+        stats = self.stat_many(tiers)
+        if self.access_tracker is not None:
+            for name, count in self.access_tracker.get_counts(stats).items():
+                stats[name] = dict(stats[name], access_count=count)
+        for name, stat in stats.items():
+            tier = tiers[name]
+            for target in range(len(self.tiers) - 1, tier, -1):
+                if match_policy(self.tier_config[target][2], name, stat):
+                    moves.setdefault((tier, target), []).append(name)
+                    break
+        count = 0
+        for (tier, target), tier_names in sorted(moves.items()):
+            source_path, source_options, _ = self.tier_config[tier]
+            target_path, target_options, _ = self.tier_config[target]
+            for start in range(0, len(tier_names), batch_size):
+                batch = tier_names[start:start + batch_size]
+                result = self.executor.submit(
+                    self.demote_task,
+                    [[[name, self.get_cache_key(name)] for name in batch],
+                     tier, source_path, source_options,
+                     target, target_path, target_options],
+                    {'server_side': server_side})
+                count += len(batch)
+                if callback is not None:
+                    callback(result, batch)
+        return count
+
+    def get_journal_config(self):
+        """
+        Returns how to queue the transfers recorded in the journal, see
+        :func:`~queued_storage.journal.drain_journal`.
 
-        return self.task.delay(name, cache_key,
-                               self.local_path, self.remote_path,
-                               self.local_options, self.remote_options)
+        :rtype: dict
+        """
+        kwargs = self.get_task_kwargs()
+        kwargs['task'] = self.task_path
+        return {
+            'storage': '%s.%s' % (type(self).__module__,
+                                  type(self).__name__),
+            'cache_prefix': self.cache_prefix,
+            'executor': self.executor_path,
+            'batch_task': self.batch_task_path,
+            'args': [self.local_path, self.remote_path,
+                     self.local_options, self.remote_options],
+            'kwargs': kwargs,
+        }
+
+    @classmethod
+    def from_journal_config(cls, config):
+        """
+        Returns a storage queuing transfers like the one which recorded
+        them in the journal with the given config, see
+        :meth:`~queued_storage.backends.QueuedStorage.get_journal_config`.
+
+        :param config: the config of journal entries
+        :type config: dict
+        :rtype: :class:`~queued_storage.backends.QueuedStorage`
+        """
+        local, remote, local_options, remote_options = config['args']
+        kwargs = config['kwargs']
+        storage = cls(local=local, remote=remote,
+                      local_options=local_options,
+                      remote_options=remote_options,
+                      cache_prefix=config.get('cache_prefix'),
+                      task=kwargs['task'],
+                      transforms=kwargs.get('transforms'),
+                      executor=config.get('executor'))
+        storage.batch_task_path = config['batch_task']
+        storage.batch_task = storage._load_backend(
+            backend=storage.batch_task_path, handler=import_attribute)
+        storage.state_fields = list(kwargs.get('state_fields', []))
+        return storage
+
+    def get_task_kwargs(self):
+        """
+        Returns the additional keyword arguments of the transfer tasks.
+
+        :rtype: dict
+        """
+        kwargs = {}
+        if self.executor_path != settings.QUEUED_STORAGE_EXECUTOR:
+            # To queue follow-up tasks, see Transfer.transferred.
+            kwargs['executor'] = self.executor_path
+        if self.transforms:
+            kwargs['transforms'] = list(self.transforms)
+        if self.state_fields:
+            kwargs['state_fields'] = list(self.state_fields)
+        return kwargs
 
     def get_valid_name(self, name):
         """
@@ -233,21 +926,100 @@ class QueuedStorage(object):
         """
         return self.get_storage(name).get_valid_name(name)
 
-    def get_available_name(self, name):
+    def get_available_name(self, name, max_length=None):
         """
         Returns a filename that's free on both the local and remote storage
         systems, and available for new content to be written to.
 
+        The name is reserved in the cache for
+        :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_RESERVATION_TIMEOUT`
+        seconds, so concurrent saves don't pick the same one. The remote
+        storage is only asked whether the given name exists if the cache
+        doesn't know it already (and not at all if the remote storage
+        overwrites files anyway). If it's taken, a random suffix is added
+        like Django does, which needs no further remote round trips.
+
         :param name: file name
         :type name: str
+        :param max_length: the maximum length of the filename
+        :type max_length: int
         :rtype: str
         """
-        local_available_name = self.local.get_available_name(name)
-        remote_available_name = self.remote.get_available_name(name)
+        dir_name, file_name = posixpath.split(name)
+        file_root, file_ext = posixpath.splitext(file_name)
+        probe = not getattr(self.remote, 'file_overwrite', False)
+        while max_length and len(name) > max_length or not self.reserve_name(name, probe):
+            # Random names can't be taken remotely unless reserved here.
+            probe = False
+            name = posixpath.join(dir_name, '%s_%s%s' % (
+                file_root, get_random_string(7), file_ext))
+            truncation = len(name) - max_length if max_length else 0
+            if truncation > 0:
+                file_root = file_root[:-truncation]
+                if not file_root:
+                    raise SuspiciousFileOperation(
+                        'Storage can not find an available filename for "%s". '
+                        'Please make sure that the corresponding file field '
+                        'allows sufficient "max_length".' % name)
+                name = posixpath.join(dir_name, '%s_%s%s' % (
+                    file_root, get_random_string(7), file_ext))
+        return name
 
-        if remote_available_name > local_available_name:
-            return remote_available_name
-        return local_available_name
+    def reserve_name(self, name, probe=True):
+        """
+        Reserves the given name for a new file if it's neither taken in the
+        local storage nor reserved already, and, according to the cache,
+        isn't taken in the remote storage, the previous remote storage or
+        the colder tiers. If the cache doesn't know the name and ``probe``
+        is ``True`` they're asked, see
+        :meth:`~queued_storage.backends.QueuedStorage.find_tier`. Only
+        names of files in the remote storage are reused if it overwrites
+        files.
+
+        :param name: file name
+        :type name: str
+        :param probe: whether to ask the remote storage if needed
+        :type probe: bool
+        :rtype: bool
+        """
+        if self.local.exists(name):
+            return False
+        reservation_key = self.get_reservation_key(name)
+        if not cache.add(reservation_key, True,
+                         settings.QUEUED_STORAGE_RESERVATION_TIMEOUT):
+            return False
+        cache_key = self.get_cache_key(name)
+        deletion_key = get_deletion_key(cache_key)
+        cached = cache.get_many([cache_key, deletion_key])
+        if cached.get(deletion_key):
+            # Still in the remote storage until the delete task has run.
+            cache.delete(reservation_key)
+            return False
+        taken = cached.get(cache_key)
+        if taken is None and probe:
+            taken, migrated = self.find_tier(name)
+            if taken:
+                found = {cache_key: taken}
+                if taken is True and self.previous_remote is not None:
+                    found[get_migration_key(cache_key)] = migrated
+                cache.set_many(found)
+        overwrite = (taken is True and
+                     getattr(self.remote, 'file_overwrite', False))
+        if taken and not overwrite:
+            cache.delete(reservation_key)
+            return False
+        return True
+
+    def get_reservation_key(self, name):
+        """
+        Returns the cache key reserving the given file name, see
+        :meth:`~queued_storage.backends.QueuedStorage.reserve_name`.
+
+        :param name: file name
+        :type name: str
+        :rtype: str
+        """
+        return '%s_reserved:%s' % (self.cache_prefix, urlquote(name))
 
     def path(self, name):
         """
@@ -268,7 +1040,71 @@ class QueuedStorage(object):
         :param name: file name
         :type name: str
         """
-        return self.get_storage(name).delete(name)
+        storage = self.get_storage(name)
+        if storage is not self.local and self.local_cache is not None:
+            self.local_cache.discard(name)
+            self.local.delete(name)
+        if storage is self.remote and self.previous_remote is not None:
+            # Don't leave the original behind to be migrated again.
+            delete_files(self.previous_remote, [name])
+        result = storage.delete(name)
+        cache_key = self.get_cache_key(name)
+        cache.delete_many([get_stat_key(cache_key),
+                           get_migration_key(cache_key)])
+        self.invalidate_listings([name])
+        return result
+
+    def delete_many(self, names, deferred=False):
+        """
+        Deletes the files with the given names from both the local and the
+        remote storage, with batch requests where the remote storage
+        supports them, and removes their cache keys.
+
+        If ``deferred`` is ``True`` the remote files are deleted by the
+        :attr:`~queued_storage.backends.QueuedStorage.delete_task` instead,
+        which is also queued for the files that couldn't be deleted right
+        away. Until it has run the files are considered to be deleted
+        already, but their names aren't reused. Files in colder tiers, and in the previous remote storage
+        during a migration, are always deleted right away.
+
+        :param names: file names
+        :type names: iterable
+        :param deferred: whether to delete the remote files with a task
+        :type deferred: bool
+        :rtype: task result or ``None``
+        """
+        names = list(names)
+        keys = dict((name, self.get_cache_key(name)) for name in names)
+        if self.local_cache is not None:
+            for name in names:
+                self.local_cache.discard(name)
+        delete_files(self.local, names)
+        for storage in self.tiers[2:]:
+            delete_files(storage, names)
+        if self.previous_remote is not None:
+            # Don't leave the originals behind to be migrated again.
+            delete_files(self.previous_remote, names)
+            cache.delete_many([get_migration_key(keys[name])
+                               for name in names])
+
+        if deferred:
+            failed = names
+        else:
+            failed = delete_files(self.remote, names)
+            deleted = set(names).difference(failed)
+            cache.delete_many([keys[name] for name in deleted])
+        cache.delete_many([get_stat_key(keys[name]) for name in names])
+        self.invalidate_listings(names)
+        if not failed:
+            return None
+        # Not in the local storage anymore, so they don't exist, but their
+        # names are taken until the delete task has run.
+        cache.set_many(dict((keys[name], False) for name in failed))
+        cache.set_many(dict((get_deletion_key(keys[name]), True)
+                            for name in failed), None)
+        return self.executor.submit(self.delete_task,
+                                    [[[name, keys[name]] for name in failed],
+                                     self.remote_path, self.remote_options])
 
     def exists(self, name):
         """
@@ -287,11 +1123,85 @@ class QueuedStorage(object):
         Lists the contents of the specified path, returning a 2-tuple of lists;
         the first item being directories, the second item being files.
 
+        The contents of the local and the remote storage are merged. The
+        listing is cached for
+        :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_LISTING_TIMEOUT`
+        seconds, or until a file is saved or deleted in the directory. To
+        list huge directories use
+        :meth:`~queued_storage.backends.QueuedStorage.iterdir` instead.
+
         :param name: file name
         :type name: str
         :rtype: tuple
         """
-        return self.get_storage(name).listdir(name)
+        cache_key = self.get_listing_key(name)
+        listing = cache.get(cache_key)
+        if listing is None:
+            dirs, files = set(), set()
+            for page_dirs, page_files in self.iterdir(name):
+                dirs.update(page_dirs)
+                files.update(page_files)
+            listing = (sorted(dirs), sorted(files))
+            cache.set(cache_key, listing,
+                      settings.QUEUED_STORAGE_LISTING_TIMEOUT)
+        return list(listing[0]), list(listing[1])
+
+    def iterdir(self, name, page_size=None):
+        """
+        Lists the contents of the specified path page by page, yielding
+        2-tuples of lists of directories and files; first the ones of the
+        local storage, then the ones of the remote storage, of the
+        previous remote storage during a migration and of the colder tiers
+        which aren't local, with paginated requests where the storages
+        support them (see :func:`~queued_storage.files.iter_listdir`).
+        Directories, and files being migrated or moved between tiers, may
+        be listed more than once. Nothing is cached.
+
+        :param name: file name
+        :type name: str
+        :param page_size: the maximum number of remote objects per page
+        :type page_size: int
+        """
+        local_dirs, local_files = set(), set()
+        for dirs, files in iter_listdir(self.local, name):
+            local_dirs.update(dirs)
+            local_files.update(files)
+            yield dirs, files
+        storages = self.tiers[1:]
+        if self.previous_remote is not None:
+            storages.insert(1, self.previous_remote)
+        for storage in storages:
+            for dirs, files in iter_listdir(storage, name, page_size):
+                dirs = [entry for entry in dirs if entry not in local_dirs]
+                files = [entry for entry in files if entry not in local_files]
+                if dirs or files:
+                    yield dirs, files
+
+    def get_listing_key(self, name):
+        """
+        Returns the cache key of the listing of the given directory.
+
+        :param name: directory name
+        :type name: str
+        :rtype: str
+        """
+        return '%s_listing:%s' % (self.cache_prefix, urlquote(name.strip('/')))
+
+    def invalidate_listings(self, names):
+        """
+        Removes the cached listings of the directories containing the
+        files with the given names, and of their parent directories.
+
+        :param names: file names
+        :type names: iterable
+        """
+        keys = set()
+        for name in names:
+            name = name.strip('/')
+            while name:
+                name = posixpath.dirname(name)
+                keys.add(self.get_listing_key(name))
+        cache.delete_many(list(keys))
 
     def size(self, name):
         """
@@ -301,18 +1211,119 @@ class QueuedStorage(object):
         :type name: str
         :rtype: int
         """
-        return self.get_storage(name).size(name)
+        return self.stat_many([name], fields=['size'])[name]['size']
+
+    def stat(self, name):
+        """
+        Returns the metadata of the file with the given name, see
+        :meth:`~queued_storage.backends.QueuedStorage.stat_many`.
+
+        :param name: file name
+        :type name: str
+        :rtype: dict
+        """
+        return self.stat_many([name])[name]
+
+    def stat_many(self, names, fields=None):
+        """
+        Returns the size and the (timezone aware) modification, creation
+        and access times of the files with the given names, as
+        dictionaries with the ``size``, ``modified_time``,
+        ``created_time`` and ``accessed_time`` keys by name. Unknown
+        times are ``None``.
+
+        The metadata of remote files is cached next to their cache keys,
+        by the transfer task or on first use with a single request per
+        file (see :func:`~queued_storage.files.get_file_stat`), and looked
+        up for all files at once. Remote storages without such a request
+        are only asked for the missing values of the given ``fields``,
+        the dictionaries may lack the others. Files transferred by the
+        transfer task also have the ``checksum`` measured meanwhile.
+
+        :param names: file names
+        :type names: iterable
+        :param fields: the keys needed (default: all of
+            :data:`~queued_storage.files.STAT_FIELDS`)
+        :type fields: iterable
+        :rtype: dict
+        """
+        fields = list(fields or STAT_FIELDS)
+        stats, keys = {}, {}
+        storages = self.get_storage_many(names)
+        for name, storage in storages.items():
+            if storage is not self.local:
+                keys[get_stat_key(self.get_cache_key(name))] = name
+            else:
+                stats[name] = get_file_stat(self.local, name)
+        cached = cache.get_many(list(keys))
+        found = {}
+        for stat_key, name in keys.items():
+            stat = cached.get(stat_key) or {}
+            missing = [key for key in fields if key not in stat]
+            if missing:
+                stat = dict(stat, **get_file_stat(storages[name], name,
+                                                  missing))
+                found[stat_key] = stat
+            stats[name] = stat
+        if found:
+            cache.set_many(found)
+        return stats
+
+    def _get_time(self, name, key):
+        value = self.stat_many([name], fields=[key])[name][key]
+        if value is None:
+            return getattr(self.get_storage(name), 'get_' + key)(name)
+        if not settings.USE_TZ:
+            return timezone.make_naive(value)
+        return value
 
     def url(self, name):
         """
         Returns an absolute URL where the file's contents can be accessed
         directly by a Web browser.
 
+        Signed URLs of remote files are reused until shortly before they
+        expire, see :mod:`~queued_storage.signed_urls`.
+
+        :param name: file name
+        :type name: str
+        :rtype: str
+        """
+        if self.access_tracker is not None:
+            self.access_tracker.record(name)
+        storage = self.get_storage(name)
+        lifetime = None
+        if self.url_cache is not None and storage is not self.local:
+            lifetime = get_url_lifetime(storage)
+        if not lifetime:
+            return storage.url(name)
+        url_key = self.get_url_key(name, storage)
+        url = self.url_cache.get(url_key)
+        if url is None:
+            expires = time.time() + lifetime
+            url = storage.url(name)
+            self.url_cache.set(
+                url_key, url,
+                expires - settings.QUEUED_STORAGE_URL_EXPIRY_MARGIN)
+        return url
+
+    def get_url_key(self, name, storage):
+        """
+        Returns the cache key of the signed URL of the file with the given
+        name in the given storage, see :mod:`~queued_storage.signed_urls`.
+
         :param name: file name
         :type name: str
+        :param storage: the storage of the file
+        :type storage: :class:`~django:django.core.files.storage.Storage`
         :rtype: str
         """
-        return self.get_storage(name).url(name)
+        if storage is self.previous_remote:
+            tier = 'previous'
+        else:
+            tier = [index for index, tier_storage in enumerate(self.tiers)
+                    if tier_storage is storage][0]
+        return '%s_url:%s:%s' % (self.cache_prefix, tier, urlquote(name))
 
     def accessed_time(self, name):
         """
@@ -357,7 +1368,7 @@ class QueuedStorage(object):
         :type name: str
         :rtype: :class:`~python:datetime.datetime`
         """
-        return self.get_storage(name).get_accessed_time(name)
+        return self._get_time(name, 'accessed_time')
 
     def get_created_time(self, name):
         """
@@ -369,8 +1380,7 @@ class QueuedStorage(object):
         :type name: str
         :rtype: :class:`~python:datetime.datetime`
         """
-
-        return self.get_storage(name).get_created_time(name)
+        return self._get_time(name, 'created_time')
 
     def get_modified_time(self, name):
         """
@@ -382,11 +1392,12 @@ class QueuedStorage(object):
         :type name: str
         :rtype: :class:`~python:datetime.datetime`
         """
-
-        return self.get_storage(name).get_modified_time(name)
+        return self._get_time(name, 'modified_time')
 
     def generate_filename(self, filename):
-        return self.get_storage(filename).generate_filename(filename)
+        # New files are saved locally, there's no need to ask the remote
+        # storage whether it has this one.
+        return self.local.generate_filename(filename)
 
 
 if version.parse(DJANGO_VERSION) <= version.parse('1.7'):
@@ -415,6 +1426,40 @@ class QueuedS3BotoStorage(QueuedFileSystemStorage):
         super(QueuedS3BotoStorage, self).__init__(remote=remote, *args, **kwargs)
 
 
+class QueuedGCSStorage(QueuedFileSystemStorage):
+    """
+    A custom :class:`~queued_storage.backends.QueuedFileSystemStorage`
+    subclass which uses the ``GoogleCloudStorage`` storage of the
+    `django-storages <https://django-storages.readthedocs.io/>`_ app as
+    the remote storage.
+
+    Files are streamed from the local storage with resumable uploads in
+    chunks of :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_GCS_CHUNK_SIZE`
+    bytes (unless ``GS_BLOB_CHUNK_SIZE`` or the ``blob_chunk_size`` remote
+    option is set).
+    """
+    def __init__(self, remote='storages.backends.gcloud.GoogleCloudStorage', remote_options=None, *args, **kwargs):
+        remote_options = dict(remote_options or {})
+        if not getattr(settings, 'GS_BLOB_CHUNK_SIZE', None):
+            remote_options.setdefault('blob_chunk_size',
+                                      settings.QUEUED_STORAGE_GCS_CHUNK_SIZE)
+        super(QueuedGCSStorage, self).__init__(remote=remote, remote_options=remote_options, *args, **kwargs)
+
+    def uri(self, name):
+        """
+        Returns the ``gs://`` URI of the file with the given name in the
+        remote storage, e.g. to pass it on to other Google Cloud APIs.
+
+        :param name: file name
+        :type name: str
+        :rtype: str
+        """
+        location = getattr(self.remote, 'location', '')
+        if location:
+            name = posixpath.join(location, name)
+        return gcs_uri(self.remote.bucket_name, name)
+
+
 class QueuedCouchDBStorage(QueuedFileSystemStorage):
     """
     A custom :class:`~queued_storage.backends.QueuedFileSystemStorage`
@@ -490,3 +1535,35 @@ class QueuedSFTPStorage(QueuedFileSystemStorage):
     """
     def __init__(self, remote='storages.backends.sftpstorage.SFTPStorage', *args, **kwargs):
         super(QueuedSFTPStorage, self).__init__(remote=remote, *args, **kwargs)
+
+
+def get_queued_storage(path):
+    """
+    Returns the :class:`~queued_storage.backends.QueuedStorage` instance
+    with the given dotted path, or the one of the model field with the
+    given ``app_label.Model.field`` path.
+
+    :param path: dotted path
+    :type path: str
+    :rtype: :class:`~queued_storage.backends.QueuedStorage`
+    :raises: :class:`~python:ValueError` if the model has no file field
+             with the given name
+    """
+    storage = None
+    parts = path.split('.')
+    if len(parts) == 3:
+        try:
+            model = apps.get_model(parts[0], parts[1])
+        except LookupError:
+            pass
+        else:
+            try:
+                storage = model._meta.get_field(parts[2]).storage
+            except (FieldDoesNotExist, AttributeError):
+                raise ValueError("The model '%s.%s' has no file field '%s'." %
+                                 (parts[0], parts[1], parts[2]))
+    if storage is None:
+        storage = import_attribute(path)
+    if not isinstance(storage, QueuedStorage):
+        raise ImproperlyConfigured("'%s' isn't a queued storage." % path)
+    return storage
@@ -7,3 +7,32 @@ class QueuedStorageConf(AppConf):
     RETRIES = 5
     RETRY_DELAY = 60
     CACHE_PREFIX = 'queued_storage'
+    RESERVATION_TIMEOUT = 60
+    LISTING_TIMEOUT = 30
+    IN_FLIGHT_TIMEOUT = 60 * 60
+    LEASE_TIMEOUT = 60
+    MIGRATION_WORKERS = 8
+    ACCESS_SAMPLE_RATE = None
+    ACCESS_HOT_SIZE = 1000
+    ACCESS_FLUSH_INTERVAL = 60
+    ACCESS_TIMEOUT = 7 * 24 * 60 * 60
+    URL_CACHE_SIZE = 10000
+    URL_EXPIRY_MARGIN = 5 * 60
+    BATCH_SIZE = 100
+    SIGNAL_QUEUE = None
+    LOCAL_CACHE_SIZE = None
+    JOURNAL = None
+    EXECUTOR = 'queued_storage.executors.CeleryExecutor'
+    EXECUTOR_WORKERS = 4
+    READ_AHEAD = 256 * 1024
+    STREAMING_STORAGES = [
+        'django.core.files.storage.FileSystemStorage',
+        'storages.backends.gcloud.GoogleCloudStorage',
+        'storages.backends.s3boto3.S3Boto3Storage',
+    ]
+    SPOOL_MAX_SIZE = 10 * 1024 * 1024
+    GCS_CHUNK_SIZE = 8 * 1024 * 1024
+    GCS_UPLOAD_WORKERS = 8
+    SPEECH_LANGUAGE = 'en-US'
+    SPEECH_MAX_IN_FLIGHT = 10
+    SPEECH_POLL_INTERVAL = 10
@@ -0,0 +1,112 @@
+"""
+Executors run the transfer tasks queued by a
+:class:`~queued_storage.backends.QueuedStorage`. By default they're sent to
+Celery, but small deployments and test suites can run them without a
+broker, in a pool of threads or right away::
+
+    QueuedFileSystemStorage(
+        remote='storages.backends.gcloud.GoogleCloudStorage',
+        executor='queued_storage.executors.ThreadPoolExecutor')
+
+An executor has a single ``submit(task, args, kwargs)`` method, which
+returns an object with a ``get(timeout=None)`` method like Celery's task
+results. The instances are shared within a process, see
+:func:`~queued_storage.utils.get_backend`.
+"""
+import os
+import threading
+
+from django.db import close_old_connections
+from multiprocessing.pool import ThreadPool
+
+from .conf import settings
+
+
+def run_task(task, args=(), kwargs=None):
+    """
+    Runs the given Celery task (or plain function) in the current thread
+    and returns its return value, raising its exceptions. Retries are run
+    right away.
+    """
+    close_old_connections()
+    try:
+        kwargs = kwargs or {}
+        if hasattr(task, 'apply'):
+            return task.apply(args=args, kwargs=kwargs).get()
+        return task(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+class CeleryExecutor(object):
+    """
+    Queues the tasks with Celery.
+    """
+    def submit(self, task, args=(), kwargs=None):
+        return task.delay(*args, **(kwargs or {}))
+
+
+class SyncResult(object):
+
+    def __init__(self, value=None, exception=None):
+        self.value = value
+        self.exception = exception
+
+    def get(self, timeout=None):
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+
+class SyncExecutor(object):
+    """
+    Runs the tasks right away in the calling thread. Exceptions are raised
+    by the ``get`` method of the results, so saving a file doesn't fail if
+    its transfer does.
+    """
+    def submit(self, task, args=(), kwargs=None):
+        try:
+            return SyncResult(run_task(task, args, kwargs))
+        except Exception as e:
+            return SyncResult(exception=e)
+
+
+class ThreadPoolExecutor(object):
+    """
+    Runs the tasks in a pool of ``max_workers`` threads of the current
+    process (default see
+    :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_EXECUTOR_WORKERS`),
+    which is started on first use and again after a fork. Tasks which
+    are still queued when the process exits are lost.
+
+    :param max_workers: the number of threads
+    :type max_workers: int
+    """
+    def __init__(self, max_workers=None):
+        self.max_workers = (max_workers or
+                            settings.QUEUED_STORAGE_EXECUTOR_WORKERS)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ThreadPool(self.max_workers)
+                self._pid = os.getpid()
+            return self._pool
+
+    def submit(self, task, args=(), kwargs=None):
+        return self.pool.apply_async(run_task, (task, args, kwargs))
+
+    def join(self):
+        """
+        Waits until all submitted tasks are done and stops the threads.
+        The pool is started again by the next ``submit``.
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
@@ -1,4 +1,47 @@
+from django.apps import apps
+from django.db import models, transaction
+from django.db.models.signals import post_save
 from django.db.models.fields.files import FileField, FieldFile
+from django.utils.timezone import now
+
+#: The values of the companion state column of a
+#: :class:`~queued_storage.fields.QueuedFileField` with ``track_state``.
+LOCAL = 'local'
+REMOTE = 'remote'
+STATE_CHOICES = (
+    (LOCAL, 'local'),
+    (REMOTE, 'remote'),
+)
+
+
+def prefetch_storage_locations(instances, field_name):
+    """
+    Looks up the storage backends responsible for the files of the given
+    field of all given model instances with a single cache query, e.g.
+    for a page of objects to serialize:
+
+    .. code-block:: python
+
+        objects = prefetch_storage_locations(page.object_list, 'image')
+        urls = [obj.image.url for obj in objects]
+
+    :param instances: model instances
+    :type instances: list or :class:`~django:django.db.models.query.QuerySet`
+    :param field_name: name of the
+                       :class:`~queued_storage.fields.QueuedFileField`
+    :type field_name: str
+    :rtype: list of the given instances
+    """
+    instances = list(instances)
+    files = [getattr(instance, field_name) for instance in instances]
+    files = [field_file for field_file in files if field_file]
+    if files:
+        storage = files[0].storage
+        storages = storage.get_storage_many(
+            set(field_file.name for field_file in files))
+        for field_file in files:
+            field_file._location = (field_file.name, storages[field_file.name])
+    return instances
 
 
 class QueuedFieldFile(FieldFile):
@@ -6,12 +49,88 @@ class QueuedFieldFile(FieldFile):
     A custom :class:`~django.db.models.fields.files.FieldFile` which has an
     additional method to transfer the file to the remote storage using the
     backend's ``transfer`` method.
+
+    The storage backend responsible for the file (local or remote) and its
+    URL are looked up once and remembered for the lifetime of the instance,
+    see also :func:`~queued_storage.fields.prefetch_storage_locations`.
     """
+    _location = None
+    _url = None
+
+    def get_origin(self):
+        if self.instance.pk is None:
+            return None
+        return [self.instance._meta.label, self.instance.pk, self.field.name]
+
     def transfer(self):
         """
         Transfers the file using the storage backend.
         """
-        return self.storage.transfer(self.name)
+        self._location = self._url = None
+        return self.storage.transfer(self.name, origin=self.get_origin())
+
+    def queue_transfer(self):
+        """
+        Queues the transfer of the saved file like the storage backend
+        does when saving it, see
+        :meth:`~queued_storage.backends.QueuedStorage.queue_transfer`.
+        """
+        self._location = self._url = None
+        self.storage.result = self.storage.queue_transfer(
+            self.name, origin=self.get_origin())
+
+    def get_storage(self):
+        """
+        Returns the storage backend instance responsible for the file,
+        either local or remote. Trusts the companion state column if the
+        field tracks the transfer state, unless remote files may have
+        been demoted to colder tiers or not migrated yet.
+        """
+        if self._location is None or self._location[0] != self.name:
+            state = None
+            if self.field.track_state:
+                state = getattr(self.instance, self.field.state_name)
+            if state == LOCAL:
+                storage = self.storage.local
+            elif (state == REMOTE and
+                    len(getattr(self.storage, 'tiers', ())) <= 2 and
+                    getattr(self.storage, 'previous_remote', None) is None):
+                storage = self.storage.remote
+            else:
+                storage = self.storage.get_storage(self.name)
+            self._location = (self.name, storage)
+        return self._location[1]
+
+    def save(self, name, content, save=True):
+        if not self.field.track_state:
+            return super(QueuedFieldFile, self).save(name, content, save=save)
+        setattr(self.instance, self.field.state_name, LOCAL)
+        setattr(self.instance, self.field.transferred_at_name, None)
+        if not hasattr(self.storage, 'queue_transfer'):
+            return super(QueuedFieldFile, self).save(name, content, save=save)
+        # The transfer task updates the object by file name, so it's only
+        # queued once the object is saved, see QueuedFileField.
+        name = self.field.generate_filename(self.instance, name)
+        self.name = self.storage.save(name, content,
+                                      max_length=self.field.max_length,
+                                      transfer=False)
+        setattr(self.instance, self.field.name, self.name)
+        self._committed = True
+        if not self.storage.delayed:
+            self.instance.__dict__.setdefault(
+                '_pending_transfers', set()).add(self.field.name)
+        if save:
+            self.instance.save()
+    save.alters_data = True
+
+    @property
+    def url(self):
+        if not hasattr(self.storage, 'get_storage'):
+            return super(QueuedFieldFile, self).url
+        self._require_file()
+        if self._url is None or self._url[0] != self.name:
+            self._url = (self.name, self.get_storage().url(self.name))
+        return self._url[1]
 
 
 class QueuedFileField(FileField):
@@ -37,5 +156,167 @@ class QueuedFileField(FileField):
         my_obj.save()
         # Transfer to remote location:
         my_obj.image.transfer()
+
+    To transfer the files of many objects at once, e.g. a backlog of
+    files saved with a delayed storage, use
+    :meth:`~queued_storage.fields.QueuedFileField.transfer_queryset`:
+
+    .. code-block:: python
+
+        field = MyModel._meta.get_field('image')
+        field.transfer_queryset(MyModel.objects.filter(published=True))
+
+    With ``track_state=True`` the field adds two columns to the model,
+    ``<name>_state`` (``'local'``, ``'remote'`` or ``NULL`` if unknown)
+    and ``<name>_transferred_at``, which the transfer task updates with a
+    single ``UPDATE`` query when the file was transferred. Unless the
+    storage is ``delayed`` the transfer is queued only once the object
+    has been saved and the transaction committed. The location
+    of remote files is then known without asking the cache or the remote
+    storage, and objects can be filtered by their (indexed) state:
+
+    .. code-block:: python
+
+        class MyModel(models.Model):
+            image = QueuedFileField(storage=QueuedS3BotoStorage(),
+                                    track_state=True)
+
+        MyModel.objects.filter(image_state='local')
     """
     attr_class = QueuedFieldFile
+
+    def __init__(self, *args, **kwargs):
+        self.track_state = kwargs.pop('track_state', False)
+        super(QueuedFileField, self).__init__(*args, **kwargs)
+
+    @property
+    def storage(self):
+        return self._storage
+
+    @storage.setter
+    def storage(self, storage):
+        self._storage = storage
+        self.register_state_field()
+
+    @property
+    def state_name(self):
+        return '%s_state' % self.name
+
+    @property
+    def transferred_at_name(self):
+        return '%s_transferred_at' % self.name
+
+    def deconstruct(self):
+        # The companion columns end up in migrations by themselves.
+        name, path, args, kwargs = super(QueuedFileField, self).deconstruct()
+        kwargs.pop('track_state', None)
+        return name, path, args, kwargs
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super(QueuedFileField, self).contribute_to_class(cls, name, **kwargs)
+        if not self.track_state or cls._meta.abstract:
+            return
+        field_names = set(field.name for field in cls._meta.local_fields)
+        if self.state_name not in field_names:
+            cls.add_to_class(self.state_name, models.CharField(
+                max_length=10, choices=STATE_CHOICES, null=True,
+                editable=False, db_index=True))
+        if self.transferred_at_name not in field_names:
+            cls.add_to_class(self.transferred_at_name, models.DateTimeField(
+                null=True, editable=False))
+        self.register_state_field()
+        # Not only for this model, objects of its proxy models and of
+        # models inheriting from it are saved with their own class.
+        post_save.connect(self.queue_transfer, weak=False)
+
+    def queue_transfer(self, sender, instance, using=None, **kwargs):
+        """
+        Queues the transfer of a file saved with a storage backend which
+        isn't :attr:`~queued_storage.backends.QueuedStorage.delayed` once
+        the object it belongs to has been saved and the transaction
+        committed, so that the transfer task finds the object to update
+        its state.
+        """
+        if not issubclass(sender, self.model):
+            return
+        pending = instance.__dict__.get('_pending_transfers', ())
+        if self.name in pending:
+            pending.discard(self.name)
+            transaction.on_commit(getattr(instance, self.name).queue_transfer,
+                                  using=using)
+
+    def register_state_field(self):
+        """
+        Tells the storage backend to pass on the field to the transfer
+        task, see :func:`~queued_storage.fields.mark_transferred`.
+        """
+        if (self.track_state and hasattr(self, 'model') and
+                hasattr(self._storage, 'state_fields')):
+            label = '%s.%s' % (self.model._meta.label, self.name)
+            if label not in self._storage.state_fields:
+                self._storage.state_fields.append(label)
+
+    def mark_transferred(self, names):
+        """
+        Sets the state of the objects with the given file names to remote.
+
+        :param names: file names, as stored in the objects
+        :type names: list
+        :rtype: the number of updated objects
+        """
+        return self.model._default_manager.filter(**{
+            '%s__in' % self.attname: names,
+        }).update(**{
+            self.state_name: REMOTE,
+            self.transferred_at_name: now(),
+        })
+
+    def transfer_queryset(self, queryset, batch_size=None, progress=None):
+        """
+        Transfers the files of all objects in the given queryset using
+        the storage backend's
+        :meth:`~queued_storage.backends.QueuedStorage.transfer_many`
+        method. Only the distinct file names are fetched from the
+        database, streamed with a server-side iterator, so memory usage
+        doesn't grow with the number of objects.
+
+        :param queryset: the objects whose files to transfer
+        :type queryset: :class:`~django:django.db.models.query.QuerySet`
+        :param batch_size: the number of files per transfer task
+        :type batch_size: int
+        :param progress: called with the number of queued files after
+                         each batch
+        :type progress: callable
+        :rtype: the number of queued files
+        """
+        names = (queryset.exclude(**{'%s__isnull' % self.attname: True})
+                         .exclude(**{self.attname: ''})
+                         .order_by(self.attname)
+                         .values_list(self.attname, flat=True)
+                         .distinct()
+                         .iterator())
+        queued = [0]
+
+        def callback(result, batch):
+            queued[0] += len(batch)
+            if progress is not None:
+                progress(queued[0])
+
+        return self.storage.transfer_many(names, batch_size=batch_size,
+                                          callback=callback)
+
+
+def mark_transferred(state_fields, names):
+    """
+    Updates the companion state columns of the given fields for the files
+    with the given names after they were transferred.
+
+    :param state_fields: labels of the fields, e.g. ``'app.Model.field'``
+    :type state_fields: list
+    :param names: file names
+    :type names: list
+    """
+    for label in state_fields:
+        model_label, field_name = label.rsplit('.', 1)
+        field = apps.get_model(model_label)._meta.get_field(field_name)
+        field.mark_transferred(names)
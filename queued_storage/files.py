@@ -0,0 +1,530 @@
+"""
+File objects reading byte ranges of stored files on demand, see
+:meth:`~queued_storage.backends.QueuedStorage.open_range`. Only the bytes
+which are actually read are fetched: local files are read directly,
+Google Cloud Storage and Amazon S3 objects with ranged requests, other
+remote files by opening them with their storage.
+
+Local files can also be memory-mapped, see
+:meth:`~queued_storage.backends.QueuedStorage.open_mapped`, many files
+deleted at once with :func:`~queued_storage.files.delete_files` and
+directories listed page by page with
+:func:`~queued_storage.files.iter_listdir`. The metadata of a file is
+fetched at once with :func:`~queued_storage.files.get_file_stat`, and
+files are copied between storages with
+:func:`~queued_storage.files.copy_file`.
+"""
+import datetime
+import io
+import itertools
+import logging
+import mmap
+import os
+import posixpath
+
+from django.core.files.base import File
+from django.utils import timezone
+
+from .conf import settings
+
+logger = logging.getLogger(__name__)
+
+#: The keys of the dictionaries returned by
+#: :func:`~queued_storage.files.get_file_stat`.
+STAT_FIELDS = ('size', 'modified_time', 'created_time', 'accessed_time')
+
+
+class MappedFile(File):
+    """
+    A read-only file memory-mapping the local file with the given path.
+    It's read, chunked and iterated over like any other file, and its
+    :meth:`~queued_storage.files.MappedFile.buffers` are
+    :class:`~python:memoryview` slices of the mapping, so iterating over
+    them copies nothing. Empty files can't be mapped.
+    """
+    def __init__(self, path, name=None):
+        with open(path, 'rb') as fp:
+            # The mapping keeps its own file descriptor.
+            mapping = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        super(MappedFile, self).__init__(mapping, name=name or path)
+        self.size = len(mapping)
+        self.mode = 'rb'
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def buffers(self, chunk_size=None):
+        """
+        Yields the content in :class:`~python:memoryview` slices of the
+        mapping of up to ``chunk_size`` bytes, regardless of the current
+        position. They must be released before the file is closed.
+        """
+        chunk_size = chunk_size or self.DEFAULT_CHUNK_SIZE
+        view = memoryview(self.file)
+        for offset in range(0, len(view), chunk_size):
+            yield view[offset:offset + chunk_size]
+
+    def close(self):
+        try:
+            self.file.close()
+        except BufferError:
+            # Buffers are still referenced somewhere, the mapping is
+            # released together with the last one.
+            pass
+
+
+def open_mapped(storage, name):
+    """
+    Opens the file with the given name in the given storage for reading,
+    as a :class:`~queued_storage.files.MappedFile` if the storage is local
+    and the file isn't empty, otherwise with the storage itself.
+
+    :param storage: storage backend instance
+    :type storage: :class:`~django:django.core.files.storage.Storage`
+    :param name: file name
+    :type name: str
+    :rtype: :class:`~django:django.core.files.File`
+    """
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        return storage.open(name, 'rb')
+    if not os.path.getsize(path):
+        return storage.open(name, 'rb')
+    return MappedFile(path, name=name)
+
+
+class LocalRangeReader(object):
+    """
+    Reads byte ranges of the file with the given local filesystem path.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def size(self):
+        return os.path.getsize(self.path)
+
+    def read(self, start, end):
+        if self._file is None:
+            self._file = open(self.path, 'rb')
+        self._file.seek(start)
+        return self._file.read(end - start)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class StorageRangeReader(object):
+    """
+    Reads byte ranges of the file with the given name by opening it with
+    the given storage, which for many remote storages means the whole file
+    is downloaded first.
+    """
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+        self._file = None
+
+    def size(self):
+        return self.storage.size(self.name)
+
+    def read(self, start, end):
+        if self._file is None:
+            self._file = self.storage.open(self.name, 'rb')
+        self._file.seek(start)
+        return self._file.read(end - start)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class GCSRangeReader(StorageRangeReader):
+    """
+    Reads byte ranges of a Google Cloud Storage object with ranged
+    downloads.
+    """
+    def read(self, start, end):
+        name = get_object_name(self.storage, self.name)
+        # The end of the downloaded range is inclusive.
+        return self.storage.bucket.blob(name).download_as_bytes(
+            start=start, end=end - 1)
+
+
+class S3RangeReader(StorageRangeReader):
+    """
+    Reads byte ranges of an Amazon S3 object with ranged ``GET`` requests
+    (``boto3`` based storages only).
+    """
+    def read(self, start, end):
+        name = get_object_name(self.storage, self.name)
+        response = self.storage.bucket.Object(name).get(
+            Range='bytes=%d-%d' % (start, end - 1))
+        return response['Body'].read()
+
+
+def get_range_reader(storage, name):
+    """
+    Returns the cheapest range reader for the file with the given name in
+    the given storage.
+
+    :param storage: storage backend instance
+    :type storage: :class:`~django:django.core.files.storage.Storage`
+    :param name: file name
+    :type name: str
+    """
+    try:
+        return LocalRangeReader(storage.path(name))
+    except NotImplementedError:
+        pass
+    bucket = getattr(storage, 'bucket', None)
+    if hasattr(bucket, 'blob'):
+        return GCSRangeReader(storage, name)
+    if hasattr(bucket, 'Object'):
+        return S3RangeReader(storage, name)
+    return StorageRangeReader(storage, name)
+
+
+class RangedFile(io.RawIOBase):
+    """
+    A read-only, seekable file object reading the bytes from ``start`` up
+    to (not including) ``end`` of a file from the given range reader, as
+    returned by :func:`~queued_storage.files.get_range_reader`. Positions
+    are relative to ``start``. Each read is a single range request, so
+    it's meant to be wrapped in a :class:`~python:io.BufferedReader`,
+    whose buffer size determines the read-ahead.
+    """
+    def __init__(self, reader, start=0, end=None):
+        self.reader = reader
+        self.start = start
+        self._end = end
+        self._position = 0
+
+    @property
+    def end(self):
+        if self._end is None:
+            self._end = self.reader.size()
+        return self._end
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.end - self.start
+        if offset < 0:
+            raise ValueError("Negative seek position %d" % offset)
+        self._position = offset
+        return self._position
+
+    def _read(self, size):
+        start = self.start + self._position
+        end = self.end if size < 0 else min(self.end, start + size)
+        if end <= start:
+            return b''
+        data = self.reader.read(start, end)
+        self._position += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self._read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def readall(self):
+        # A single request for the rest instead of one per default buffer.
+        return self._read(-1)
+
+    def close(self):
+        if not self.closed:
+            self.reader.close()
+        super(RangedFile, self).close()
+
+
+def get_object_name(storage, name):
+    """
+    Returns the name of the object of the file with the given name in the
+    bucket of the given storage.
+    """
+    return posixpath.join(getattr(storage, 'location', ''), name)
+
+
+def delete_files(storage, names, batch_size=None):
+    """
+    Deletes the files with the given names from the given storage, with
+    batch requests of up to ``batch_size`` files for Google Cloud Storage
+    and (``boto3`` based) Amazon S3 storages, one by one otherwise.
+
+    :param storage: storage backend instance
+    :type storage: :class:`~django:django.core.files.storage.Storage`
+    :param names: file names
+    :type names: iterable
+    :param batch_size: the number of files per request (default see
+        :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_BATCH_SIZE`,
+        at most 1000)
+    :type batch_size: int
+    :returns: the names of the files which couldn't be deleted
+    :rtype: list
+    """
+    batch_size = min(batch_size or settings.QUEUED_STORAGE_BATCH_SIZE, 1000)
+    bucket = getattr(storage, 'bucket', None)
+    names = iter(names)
+    failed = []
+    while True:
+        batch = list(itertools.islice(names, batch_size))
+        if not batch:
+            return failed
+        objects = dict((get_object_name(storage, name), name)
+                       for name in batch)
+        if hasattr(bucket, 'delete_blobs'):
+            delete = _delete_blobs
+        elif hasattr(bucket, 'delete_objects'):
+            delete = _delete_objects
+        else:
+            for name in batch:
+                try:
+                    storage.delete(name)
+                except Exception as e:
+                    logger.error("Unable to delete '%s'." % name)
+                    logger.exception(e)
+                    failed.append(name)
+            continue
+        try:
+            failed.extend(objects[key] for key in delete(storage, objects))
+        except Exception as e:
+            logger.error("Unable to delete %d files." % len(batch))
+            logger.exception(e)
+            failed.extend(batch)
+
+
+def _delete_blobs(storage, objects):
+    # A single batch request, answered for each object in order.
+    keys = list(objects)
+    responses = _send_batch(storage.client,
+                           lambda: storage.bucket.delete_blobs(keys))
+    # Missing objects don't count as failures.
+    return [key for key, response in zip(keys, responses)
+            if response.status_code != 404 and
+            not 200 <= response.status_code < 300]
+
+
+def _delete_objects(storage, objects):
+    response = storage.bucket.delete_objects(Delete={
+        'Objects': [{'Key': key} for key in objects],
+        'Quiet': True,
+    })
+    return [error['Key'] for error in response.get('Errors', [])]
+
+
+class _BatchSent(Exception):
+    pass
+
+
+def _send_batch(client, make_requests):
+    """
+    Sends the requests made by calling ``make_requests`` with the given
+    Google Cloud Storage client as a single batch request and returns the
+    responses to them in order, whatever their status. Only failures of
+    the batch request itself raise an exception.
+
+    :param client: ``google.cloud.storage.Client`` instance
+    :param make_requests: makes the requests, e.g. deletes blobs
+    :type make_requests: callable
+    :rtype: list
+    """
+    batch = client.batch()
+    try:
+        with batch:
+            make_requests()
+            responses = batch.finish(raise_exception=False)
+            # Leaves the batch without sending it again.
+            raise _BatchSent()
+    except _BatchSent:
+        return responses
+
+
+def iter_listdir(storage, name, page_size=None):
+    """
+    Lists the contents of the given directory of the given storage page by
+    page, yielding ``(directories, files)`` tuples of lists. Google Cloud
+    Storage and (``boto3`` based) Amazon S3 storages are listed with
+    paginated requests of up to ``page_size`` objects, other storages all
+    at once. Missing directories are empty.
+
+    :param storage: storage backend instance
+    :type storage: :class:`~django:django.core.files.storage.Storage`
+    :param name: directory name
+    :type name: str
+    :param page_size: the number of objects per request (default: the
+                      maximum of the storage service)
+    :type page_size: int
+    """
+    bucket = getattr(storage, 'bucket', None)
+    prefix = get_object_name(storage, name).strip('/')
+    if prefix:
+        prefix += '/'
+    if hasattr(bucket, 'list_blobs'):
+        iterator = bucket.list_blobs(prefix=prefix, delimiter='/',
+                                     page_size=page_size)
+        for page in iterator.pages:
+            files = [blob.name[len(prefix):] for blob in page]
+            yield ([dir_prefix[len(prefix):].rstrip('/')
+                    for dir_prefix in page.prefixes], files)
+    elif hasattr(bucket, 'meta'):
+        paginator = bucket.meta.client.get_paginator('list_objects_v2')
+        kwargs = {'Bucket': bucket.name, 'Prefix': prefix, 'Delimiter': '/'}
+        if page_size:
+            kwargs['PaginationConfig'] = {'PageSize': page_size}
+        for page in paginator.paginate(**kwargs):
+            yield ([entry['Prefix'][len(prefix):].rstrip('/')
+                    for entry in page.get('CommonPrefixes', [])],
+                   [entry['Key'][len(prefix):]
+                    for entry in page.get('Contents', [])])
+    else:
+        try:
+            yield storage.listdir(name)
+        except (IOError, OSError):
+            return
+
+
+def _aware(value):
+    if value is not None and timezone.is_naive(value):
+        return timezone.make_aware(value)
+    return value
+
+
+def get_file_stat(storage, name, fields=None):
+    """
+    Returns the size and the (timezone aware) modification, creation and
+    access times of the file with the given name in the given storage as a
+    dictionary with the ``size``, ``modified_time``, ``created_time`` and
+    ``accessed_time`` keys. Unknown times are ``None``.
+
+    Local files are stat'ed once, Google Cloud Storage and (``boto3``
+    based) Amazon S3 objects are fetched with a single metadata request.
+    Other storages are asked for each value, so only for the given
+    ``fields`` if any; the dictionary lacks the keys of the others.
+
+    :param storage: storage backend instance
+    :type storage: :class:`~django:django.core.files.storage.Storage`
+    :param name: file name
+    :type name: str
+    :param fields: the keys to fetch from other storages (default: all
+        of :data:`~queued_storage.files.STAT_FIELDS`)
+    :type fields: iterable
+    :rtype: dict
+    """
+    try:
+        result = os.stat(storage.path(name))
+    except NotImplementedError:
+        pass
+    else:
+        def fromtimestamp(timestamp):
+            return datetime.datetime.fromtimestamp(timestamp, timezone.utc)
+        return {
+            'size': result.st_size,
+            'modified_time': fromtimestamp(result.st_mtime),
+            'created_time': fromtimestamp(result.st_ctime),
+            'accessed_time': fromtimestamp(result.st_atime),
+        }
+
+    bucket = getattr(storage, 'bucket', None)
+    if hasattr(bucket, 'get_blob'):
+        blob = bucket.get_blob(get_object_name(storage, name))
+        if blob is None:
+            raise IOError("File does not exist: %s" % name)
+        return {
+            'size': blob.size,
+            'modified_time': blob.updated,
+            'created_time': blob.time_created,
+            'accessed_time': None,
+        }
+    if hasattr(bucket, 'Object'):
+        obj = bucket.Object(get_object_name(storage, name))
+        obj.load()
+        return {
+            'size': obj.content_length,
+            'modified_time': obj.last_modified,
+            'created_time': None,
+            'accessed_time': None,
+        }
+
+    stat = {}
+    for key in STAT_FIELDS if fields is None else fields:
+        if key == 'size':
+            stat[key] = storage.size(name)
+            continue
+        try:
+            stat[key] = _aware(getattr(storage, 'get_' + key)(name))
+        except (AttributeError, NotImplementedError):
+            stat[key] = None
+    return stat
+
+
+def copy_file(source, target, name, server_side=True):
+    """
+    Copies the file with the given name from the given source to the
+    given target storage, replacing the file with that name in the target
+    storage if there is one.
+
+    Between Google Cloud Storage buckets and between (``boto3`` based)
+    Amazon S3 buckets the file is copied server-side if ``server_side``
+    is ``True``, which requires the credentials of the target storage to
+    be allowed to read the source bucket. Otherwise it's streamed with
+    ranged reads (see :func:`~queued_storage.files.get_range_reader`)
+    without downloading it completely first.
+
+    :param source: storage backend instance to copy from
+    :type source: :class:`~django:django.core.files.storage.Storage`
+    :param target: storage backend instance to copy to
+    :type target: :class:`~django:django.core.files.storage.Storage`
+    :param name: file name
+    :type name: str
+    :param server_side: whether to copy server-side where possible
+    :type server_side: bool
+    :returns: whether the file was copied server-side
+    :rtype: bool
+    """
+    source_bucket = getattr(source, 'bucket', None)
+    target_bucket = getattr(target, 'bucket', None)
+    if server_side:
+        source_name = get_object_name(source, name)
+        target_name = get_object_name(target, name)
+        if (hasattr(source_bucket, 'copy_blob') and
+                hasattr(target_bucket, 'copy_blob')):
+            source_bucket.copy_blob(source_bucket.blob(source_name),
+                                    target_bucket, target_name)
+            return True
+        if (hasattr(source_bucket, 'Object') and
+                hasattr(target_bucket, 'Object')):
+            target_bucket.Object(target_name).copy(
+                {'Bucket': source_bucket.name, 'Key': source_name})
+            return True
+
+    reader = get_range_reader(source, name)
+    content = File(io.BufferedReader(RangedFile(reader),
+                                     settings.QUEUED_STORAGE_READ_AHEAD),
+                   name=name)
+    content.size = reader.size()
+    try:
+        if target.exists(name):
+            target.delete(name)
+        saved = target.save(name, content)
+    finally:
+        content.close()
+    if saved != name:
+        raise IOError("'%s' was saved as '%s'." % (name, saved))
+    return False
@@ -0,0 +1,184 @@
+"""
+A local, append-only journal of pending transfers. If a
+:class:`~queued_storage.backends.QueuedStorage` has a ``journal`` (see
+:attr:`~queued_storage.conf.settings.QUEUED_STORAGE_JOURNAL`), saving a
+file only appends an entry to it instead of talking to the Celery broker,
+and the files are transferred once the journal is drained, e.g. with the
+``drain_transfer_journal`` management command::
+
+    python manage.py drain_transfer_journal --interval 5
+
+Draining queues the entries with
+:meth:`~queued_storage.backends.QueuedStorage.transfer_many` of their
+storages, so files whose transfer is already queued are skipped, and
+removes them only once they've been queued, so entries survive restarts of
+the web processes, the workers and the broker.
+
+The journal is a SQLite database in WAL mode, which is safe to share
+between the processes and threads of one host.
+"""
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .conf import settings
+from .utils import import_attribute
+
+
+class TransferJournal(object):
+    """
+    The journal of pending transfers in the SQLite database with the given
+    path. Every thread of a process uses its own connection.
+
+    :param path: the path of the database file
+    :type path: str
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # Durable unless the host loses power, and cheap to append to.
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS pending ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'name TEXT NOT NULL, '
+                'cache_key TEXT NOT NULL, '
+                'config TEXT NOT NULL, '
+                'created REAL NOT NULL)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def append(self, name, cache_key, config):
+        """
+        Appends an entry for the file with the given name.
+
+        :param name: file name
+        :type name: str
+        :param cache_key: the cache key to set after the transfer
+        :type cache_key: str
+        :param config: how to queue the transfer, see
+            :meth:`~queued_storage.backends.QueuedStorage.get_journal_config`
+        :type config: dict
+        """
+        self.connection.execute(
+            'INSERT INTO pending (name, cache_key, config, created) '
+            'VALUES (?, ?, ?, ?)',
+            (name, cache_key, json.dumps(config, sort_keys=True), time.time()))
+
+    def read(self, limit):
+        """
+        Returns the oldest entries as ``(id, name, cache key, config)``
+        tuples.
+
+        :param limit: the maximum number of entries
+        :type limit: int
+        :rtype: list
+        """
+        return self.connection.execute(
+            'SELECT id, name, cache_key, config FROM pending '
+            'ORDER BY id LIMIT ?', (limit,)).fetchall()
+
+    def remove(self, ids):
+        """
+        Removes the entries with the given ids.
+
+        :param ids: entry ids
+        :type ids: list
+        """
+        connection = self.connection
+        connection.execute('BEGIN')
+        connection.executemany('DELETE FROM pending WHERE id = ?',
+                               [(entry_id,) for entry_id in ids])
+        connection.execute('COMMIT')
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM pending').fetchone()[0]
+
+    def compact(self):
+        """
+        Moves the write-ahead log into the database and truncates it, and
+        shrinks the database file if there are no entries left.
+        """
+        connection = self.connection
+        connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        if not len(self):
+            connection.execute('VACUUM')
+
+
+_journals_lock = threading.Lock()
+_journals = {}
+
+
+def get_journal(path=None):
+    """
+    Returns the journal with the given path (default see
+    :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_JOURNAL`), shared
+    within the current process.
+
+    :rtype: :class:`~queued_storage.journal.TransferJournal`
+    """
+    path = path or settings.QUEUED_STORAGE_JOURNAL
+    with _journals_lock:
+        try:
+            return _journals[path]
+        except KeyError:
+            journal = _journals[path] = TransferJournal(path)
+            return journal
+
+
+def drain_journal(path=None, batch_size=None):
+    """
+    Queues the pending transfers of the journal with the given path with
+    :meth:`~queued_storage.backends.QueuedStorage.transfer_many` in batch
+    tasks of up to ``batch_size`` files, removes them from the journal once
+    queued (or found to be queued already) and compacts it. If queuing
+    fails, the remaining entries are kept and the exception is raised.
+
+    :param path: the path of the journal (default see
+        :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_JOURNAL`)
+    :type path: str
+    :param batch_size: the number of files per task (default see
+        :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_BATCH_SIZE`)
+    :type batch_size: int
+    :returns: the number of queued files
+    :rtype: int
+    """
+    journal = get_journal(path)
+    batch_size = batch_size or settings.QUEUED_STORAGE_BATCH_SIZE
+    storages = {}
+    count = 0
+    while True:
+        entries = journal.read(batch_size * 10)
+        if not entries:
+            break
+        entries.sort(key=lambda entry: entry[3])
+        for config, group in itertools.groupby(entries,
+                                               key=lambda entry: entry[3]):
+            storage = storages.get(config)
+            if storage is None:
+                options = json.loads(config)
+                storage_class = import_attribute(options.get(
+                    'storage', 'queued_storage.backends.QueuedStorage'))
+                storage = storages[config] = \
+                    storage_class.from_journal_config(options)
+            group = list(group)
+            for start in range(0, len(group), batch_size):
+                batch = group[start:start + batch_size]
+                count += storage.transfer_many(
+                    [name for _, name, _, _ in batch], batch_size)
+                journal.remove([entry[0] for entry in batch])
+    journal.compact()
+    return count
@@ -0,0 +1,103 @@
+"""
+Leases keep two workers from transferring the same file at the same time,
+e.g. when a task is redelivered or retried while the first attempt is
+still running. A lease is an entry in the Django cache which only its
+holder may renew or remove. The holder renews it from a background thread
+every third of its timeout (see
+:attr:`~queued_storage.conf.settings.QUEUED_STORAGE_LEASE_TIMEOUT`), so
+it's held as long as the transfer takes but expires soon after the worker
+dies::
+
+    with Lease(get_lease_key(cache_key)) as lease:
+        if lease.acquired:
+            transfer()
+
+The cache backend has to be shared by all workers, e.g. Memcached or
+Redis, for the leases to be exclusive.
+"""
+import logging
+import threading
+import uuid
+
+from django.core.cache import cache
+
+from .conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Lease(object):
+    """
+    A lease on the given cache key, held for ``timeout`` seconds after it
+    was acquired or renewed last.
+
+    :param key: the cache key of the lease
+    :type key: str
+    :param timeout: the timeout in seconds (default see
+        :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_LEASE_TIMEOUT`)
+    :type timeout: int
+    """
+    def __init__(self, key, timeout=None):
+        self.key = key
+        self.timeout = timeout or settings.QUEUED_STORAGE_LEASE_TIMEOUT
+        self.token = uuid.uuid4().hex
+        #: Whether the lease is held.
+        self.acquired = False
+        self._stopped = threading.Event()
+        self._heartbeat = None
+
+    def acquire(self):
+        """
+        Acquires the lease unless someone else holds it and starts renewing
+        it in the background.
+
+        :returns: whether the lease was acquired
+        :rtype: bool
+        """
+        if not self.acquired and cache.add(self.key, self.token, self.timeout):
+            self.acquired = True
+            self._stopped.clear()
+            self._heartbeat = threading.Thread(target=self._renew)
+            self._heartbeat.daemon = True
+            self._heartbeat.start()
+        return self.acquired
+
+    def renew(self):
+        """
+        Extends the lease by its timeout if it's still held.
+
+        :returns: whether the lease is still held
+        :rtype: bool
+        """
+        if cache.get(self.key) != self.token:
+            return False
+        touch = getattr(cache, 'touch', None)  # Django >= 2.1
+        if touch is None or not touch(self.key, self.timeout):
+            cache.set(self.key, self.token, self.timeout)
+        return True
+
+    def _renew(self):
+        while not self._stopped.wait(self.timeout / 3.0):
+            if not self.renew():
+                logger.warning("Lost the lease '%s'." % self.key)
+                return
+
+    def release(self):
+        """
+        Stops renewing the lease and removes it if it's still held.
+        """
+        if not self.acquired:
+            return
+        self._stopped.set()
+        self._heartbeat.join()
+        self._heartbeat = None
+        self.acquired = False
+        if cache.get(self.key) == self.token:
+            cache.delete(self.key)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,45 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from queued_storage.backends import get_queued_storage
+from queued_storage.conf import settings
+from queued_storage.tiering import demote_files
+
+
+class Command(BaseCommand):
+    help = ("Queues the moves of the files of a queued storage to the "
+            "colder storage tiers whose policies they match.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'storage',
+            help="The dotted path of the storage instance, or the "
+                 "app_label.Model.field using it.")
+        parser.add_argument(
+            '--directory', default='',
+            help="Only move the files in this directory.")
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=settings.QUEUED_STORAGE_BATCH_SIZE,
+            help="The number of files per task.")
+        parser.add_argument(
+            '--page-size', type=int, default=None,
+            help="The number of objects per listing request.")
+        parser.add_argument(
+            '--no-server-side', action='store_false', dest='server_side',
+            help="Stream the files even where they could be copied "
+                 "server-side.")
+
+    def handle(self, *args, **options):
+        try:
+            storage = get_queued_storage(options['storage'])
+        except (ImproperlyConfigured, ValueError) as e:
+            raise CommandError(e)
+        if len(storage.tiers) < 3:
+            raise CommandError("'%s' has no colder storage tiers." %
+                               options['storage'])
+        count = demote_files(storage, options['directory'],
+                             batch_size=options['batch_size'],
+                             server_side=options['server_side'],
+                             page_size=options['page_size'])
+        self.stdout.write("Queued the moves of %d files." % count)
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from queued_storage.conf import settings
+from queued_storage.journal import drain_journal
+
+
+class Command(BaseCommand):
+    help = ("Queues the transfers recorded in the journal of pending "
+            "transfers, once or periodically.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--journal', default=settings.QUEUED_STORAGE_JOURNAL,
+            help="The path of the journal (default: "
+                 "QUEUED_STORAGE_JOURNAL).")
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=settings.QUEUED_STORAGE_BATCH_SIZE,
+            help="The number of files per task.")
+        parser.add_argument(
+            '--interval', type=float, default=None,
+            help="Keep draining the journal every INTERVAL seconds.")
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                count = drain_journal(options['journal'],
+                                      options['batch_size'])
+            except Exception as e:
+                if options['interval'] is None:
+                    raise
+                # The broker is probably unreachable, try again later.
+                self.stderr.write("Unable to queue transfers: %s" % e)
+            else:
+                if count or options['verbosity'] > 1:
+                    self.stdout.write("Queued %d transfers." % count)
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,40 @@
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from queued_storage.backends import get_queued_storage
+
+
+class Command(BaseCommand):
+    help = ("Deletes the least recently read local copies of the "
+            "transferred files of a queued storage exceeding its local "
+            "cache size, counting the copies of all processes, once or "
+            "periodically.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'storage',
+            help="The dotted path of the storage instance, or the "
+                 "app_label.Model.field using it.")
+        parser.add_argument(
+            '--interval', type=float, default=None,
+            help="Keep evicting copies every INTERVAL seconds.")
+
+    def handle(self, *args, **options):
+        try:
+            storage = get_queued_storage(options['storage'])
+        except (ImproperlyConfigured, ValueError) as e:
+            raise CommandError(e)
+        if storage.local_cache is None:
+            raise CommandError("'%s' keeps no local copies." %
+                               options['storage'])
+        while True:
+            storage.scan_local_cache()
+            if options['verbosity'] > 1:
+                self.stdout.write("%d local copies of %d bytes." %
+                                  (len(storage.local_cache),
+                                   storage.local_cache.size))
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
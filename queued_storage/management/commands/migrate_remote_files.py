@@ -0,0 +1,67 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from queued_storage.backends import get_queued_storage
+from queued_storage.conf import settings
+from queued_storage.migration import migrate_files, verify_migration
+
+
+class Command(BaseCommand):
+    help = ("Queues the migration of the files of a queued storage from its "
+            "previous to its current remote storage.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'storage',
+            help="The dotted path of the storage instance, or the "
+                 "app_label.Model.field using it.")
+        parser.add_argument(
+            '--directory', default='',
+            help="Only migrate the files in this directory.")
+        parser.add_argument(
+            '--checkpoint', default=None,
+            help="The path of the file to save the progress in and to "
+                 "resume from.")
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=settings.QUEUED_STORAGE_BATCH_SIZE,
+            help="The number of files per task.")
+        parser.add_argument(
+            '--page-size', type=int, default=None,
+            help="The number of objects per listing request.")
+        parser.add_argument(
+            '--verify', action='store_true',
+            help="Once all tasks have run, queue the migration of the "
+                 "files which haven't been migrated again.")
+        parser.add_argument(
+            '--no-server-side', action='store_false', dest='server_side',
+            help="Stream the files even where they could be copied "
+                 "server-side.")
+
+    def handle(self, *args, **options):
+        try:
+            storage = get_queued_storage(options['storage'])
+        except (ImproperlyConfigured, ValueError) as e:
+            raise CommandError(e)
+        if storage.previous_remote is None:
+            raise CommandError("'%s' has no previous remote storage." %
+                               options['storage'])
+        if options['verify']:
+            count = verify_migration(storage, options['directory'],
+                                     batch_size=options['batch_size'],
+                                     server_side=options['server_side'],
+                                     page_size=options['page_size'])
+            if count:
+                self.stdout.write("Queued the migration of %d files again, "
+                                  "verify again once the tasks have run." %
+                                  count)
+            else:
+                self.stdout.write("All files have been migrated.")
+            return
+        count = migrate_files(storage, options['directory'],
+                              batch_size=options['batch_size'],
+                              checkpoint=options['checkpoint'],
+                              server_side=options['server_side'],
+                              page_size=options['page_size'])
+        self.stdout.write("Queued the migration of %d files, verify with "
+                          "--verify once the tasks have run." % count)
@@ -0,0 +1,225 @@
+"""
+Migrating the remote files of a
+:class:`~queued_storage.backends.QueuedStorage` to another remote storage,
+e.g. to another provider. Configure the new remote storage as ``remote``
+and the current one as ``previous_remote``::
+
+    media_storage = QueuedStorage(
+        local='django.core.files.storage.FileSystemStorage',
+        remote='storages.backends.gcloud.GoogleCloudStorage',
+        previous_remote='storages.backends.s3boto3.S3Boto3Storage')
+
+New files are transferred to the new remote storage right away, and
+files which haven't been migrated yet are read from the previous one (see
+:meth:`~queued_storage.backends.QueuedStorage.get_storage_many`). Then
+queue the migration of the existing files, e.g. with the
+``migrate_remote_files`` management command::
+
+    python manage.py migrate_remote_files myapp.storages.media_storage \\
+        --checkpoint /var/lib/myapp/migration.txt
+
+The files of the previous remote storage are listed page by page in
+lexicographic order and queued as
+:class:`~queued_storage.tasks.MigrateBatch` tasks. After each batch the
+name of its last file is written to the checkpoint file, so an
+interrupted migration resumes where it stopped when it's started again.
+
+The checkpoint only records which files have been queued, tasks may still
+fail after exhausting their retries. So once all tasks have run, verify
+the migration, which queues the migration of the files missing from the
+new remote storage again::
+
+    python manage.py migrate_remote_files myapp.storages.media_storage \
+        --verify
+
+The previous remote storage isn't changed; repeat the verification until
+it reports that all files have been migrated, then remove
+``previous_remote`` from the storage.
+"""
+import io
+import itertools
+import os
+import posixpath
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+
+from .conf import settings
+from .files import iter_listdir
+from .utils import get_migration_key
+
+
+def walk_files(storage, name='', after=None, page_size=None):
+    """
+    Yields the names of the files in the given directory of the given
+    storage and its subdirectories, in lexicographic order. Directories
+    are listed page by page, see :func:`~queued_storage.files.iter_listdir`.
+
+    :param storage: storage backend instance
+    :type storage: :class:`~django:django.core.files.storage.Storage`
+    :param name: directory name
+    :type name: str
+    :param after: only yield the names following this one, without
+                  listing the directories before it
+    :type after: str
+    :param page_size: the number of objects per listing request
+    :type page_size: int
+    """
+    for dirs, files in iter_listdir(storage, name, page_size):
+        # Directories sort like the names of the files they contain.
+        entries = sorted([(posixpath.join(name, entry) + '/', True)
+                          for entry in dirs] +
+                         [(posixpath.join(name, entry), False)
+                          for entry in files])
+        for path, is_dir in entries:
+            if not is_dir:
+                if after is None or path > after:
+                    yield path
+            elif after is None or path > after or after.startswith(path):
+                for file_name in walk_files(storage, path.rstrip('/'),
+                                            after, page_size):
+                    yield file_name
+
+
+def read_checkpoint(path):
+    """
+    Returns the name of the last queued file saved in the checkpoint file
+    with the given path, or ``None``.
+    """
+    try:
+        with io.open(path, encoding='utf-8') as fp:
+            return fp.read() or None
+    except (IOError, OSError):
+        return None
+
+
+def write_checkpoint(path, name):
+    """
+    Saves the name of the last queued file in the checkpoint file with the
+    given path, atomically.
+    """
+    temp_path = '%s.tmp' % path
+    with io.open(temp_path, 'w', encoding='utf-8') as fp:
+        fp.write(name)
+    getattr(os, 'replace', os.rename)(temp_path, path)
+
+
+def migrate_files(storage, name='', batch_size=None, checkpoint=None,
+                  server_side=True, page_size=None, callback=None):
+    """
+    Queues the migration of the files in the given directory of the
+    previous remote storage of the given storage to its remote storage,
+    with one :attr:`~queued_storage.backends.QueuedStorage.migrate_task`
+    per ``batch_size`` files.
+
+    :param storage: the storage whose files to migrate
+    :type storage: :class:`~queued_storage.backends.QueuedStorage`
+    :param name: directory name (default: all files)
+    :type name: str
+    :param batch_size: the number of files per task (default see
+        :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_BATCH_SIZE`)
+    :type batch_size: int
+    :param checkpoint: the path of the file to save the progress in and
+                       resume from
+    :type checkpoint: str
+    :param server_side: whether to copy server-side where possible, see
+                        :func:`~queued_storage.files.copy_file`
+    :type server_side: bool
+    :param page_size: the number of objects per listing request
+    :type page_size: int
+    :param callback: called with the task result and the names after
+                     queuing each batch
+    :type callback: callable
+    :returns: the number of queued files
+    :rtype: int
+    """
+    if storage.previous_remote is None:
+        raise ImproperlyConfigured("The storage '%s' has no previous remote "
+                                   "storage to migrate from." % storage)
+    batch_size = batch_size or settings.QUEUED_STORAGE_BATCH_SIZE
+    after = read_checkpoint(checkpoint) if checkpoint else None
+    names = walk_files(storage.previous_remote, name, after, page_size)
+    count = 0
+    while True:
+        batch = list(itertools.islice(names, batch_size))
+        if not batch:
+            return count
+        result = queue_migration(storage, batch, server_side)
+        if checkpoint:
+            write_checkpoint(checkpoint, batch[-1])
+        count += len(batch)
+        if callback is not None:
+            callback(result, batch)
+
+
+def verify_migration(storage, name='', batch_size=None, server_side=True,
+                     page_size=None, callback=None):
+    """
+    Queues the migration of the files in the given directory of the
+    previous remote storage of the given storage again which haven't been
+    migrated to its remote storage, e.g. because their task exhausted its
+    retries. Files the cache knows to be migrated aren't looked up in the
+    remote storage.
+
+    :param storage: the storage whose migration to verify
+    :type storage: :class:`~queued_storage.backends.QueuedStorage`
+    :param name: directory name (default: all files)
+    :type name: str
+    :param batch_size: the number of files per task (default see
+        :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_BATCH_SIZE`)
+    :type batch_size: int
+    :param server_side: whether to copy server-side where possible, see
+                        :func:`~queued_storage.files.copy_file`
+    :type server_side: bool
+    :param page_size: the number of objects per listing request
+    :type page_size: int
+    :param callback: called with the task result and the names after
+                     queuing each batch
+    :type callback: callable
+    :returns: the number of files queued again, ``0`` if all files have
+              been migrated
+    :rtype: int
+    """
+    if storage.previous_remote is None:
+        raise ImproperlyConfigured("The storage '%s' has no previous remote "
+                                   "storage to migrate from." % storage)
+    batch_size = batch_size or settings.QUEUED_STORAGE_BATCH_SIZE
+    names = walk_files(storage.previous_remote, name, None, page_size)
+    count = 0
+    while True:
+        batch = list(itertools.islice(names, batch_size))
+        if not batch:
+            return count
+        keys = dict((get_migration_key(storage.get_cache_key(file_name)),
+                     file_name) for file_name in batch)
+        migrated = cache.get_many(list(keys))
+        missing, found = [], {}
+        for key, file_name in sorted(keys.items(), key=lambda item: item[1]):
+            if migrated.get(key) is True:
+                continue
+            if storage.remote.exists(file_name):
+                found[key] = True
+            else:
+                missing.append(file_name)
+        if found:
+            cache.set_many(found)
+        if missing:
+            result = queue_migration(storage, missing, server_side)
+            count += len(missing)
+            if callback is not None:
+                callback(result, missing)
+
+
+def queue_migration(storage, names, server_side=True):
+    """
+    Queues one :attr:`~queued_storage.backends.QueuedStorage.migrate_task`
+    migrating the files with the given names.
+
+    :rtype: task result
+    """
+    return storage.executor.submit(
+        storage.migrate_task,
+        [[[name, storage.get_cache_key(name)] for name in names],
+         storage.previous_remote_path, storage.previous_remote_options,
+         storage.remote_path, storage.remote_options],
+        {'server_side': server_side})
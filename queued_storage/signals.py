@@ -17,18 +17,98 @@ the ``file_transferred`` signal::
 
 
     @receiver(file_transferred)
-    def log_file_transferred(sender, name, local, remote, **kwargs):
-        remote_url = remote.url(name)
-        TransferLogEntry.objects.create(name=name, remote_url=remote_url, transfer_date=now())
+    def log_file_transferred(sender, name, local, remote, url, size, **kwargs):
+        TransferLogEntry.objects.create(name=name, remote_url=url, size=size,
+                                        transfer_date=now())
 
     # Alternatively, you can also use the signal's connect method to connect:
     file_transferred.connect(log_file_transferred)
 
-Note that this signal does **NOT** have access to the calling Model or even
-the FileField instance that it relates to, only the name of the file.
-As a result, this signal is somewhat limited and may only be of use if you
-have a very specific usage of django-queued-storage.
+Besides the name of the file and the storage backends the signal provides
+what the task already knows about the transfer, so receivers don't need
+to query the remote storage again:
+
+- ``size``: the number of transferred bytes
+- ``checksum``: the MD5 checksum of the transferred bytes, e.g.
+  ``'md5:9b4e...'``
+- ``content_type``: the content type guessed from the file name
+- ``elapsed``: the duration of the transfer in seconds
+- ``url``: the URL of the file in the remote storage
+- ``instance`` and ``field``: the model instance and the
+  :class:`~queued_storage.fields.QueuedFileField` if the transfer was
+  started with :meth:`~queued_storage.fields.QueuedFieldFile.transfer`,
+  otherwise ``None``. The instance is fetched from the database lazily,
+  when it's first accessed.
+
+For every task run there's also a ``files_transferred`` signal providing
+the list of names of all files transferred by it, e.g. all files of a
+batch queued with
+:meth:`~queued_storage.backends.QueuedStorage.transfer_many`. Receivers
+of it can handle many files at once, e.g. create all log entries with a
+single query::
+
+    from queued_storage.signals import files_transferred
+
+
+    @receiver(files_transferred)
+    def log_files_transferred(sender, names, local, remote, details, **kwargs):
+        TransferLogEntry.objects.bulk_create([
+            TransferLogEntry(name=name, remote_url=details[name]['url'],
+                             transfer_date=now())
+            for name in names])
+
+Its ``details`` argument maps the names to dictionaries of the additional
+arguments of the ``file_transferred`` signal, apart from ``instance``
+and ``field``.
+
+Connect to either of the two signals, not both.
+
+The signals are sent by the transfer task in the worker right after the
+transfer. To take the receivers off that path, set
+:attr:`~queued_storage.conf.settings.QUEUED_STORAGE_SIGNAL_QUEUE` to the
+name of a Celery queue; the signals are then sent by the
+:class:`~queued_storage.tasks.SendTransferSignals` task consumed from it.
 """
+from django.apps import apps
 from django.dispatch import Signal
+from django.utils.functional import SimpleLazyObject
+
+file_transferred = Signal(providing_args=[
+    "name", "local", "remote", "size", "checksum", "content_type",
+    "elapsed", "url", "instance", "field"])
+
+files_transferred = Signal(providing_args=["names", "local", "remote",
+                                           "details"])
+
+
+def get_origin(origin):
+    """
+    Returns the model instance (lazily) and field for the given
+    ``[model label, primary key, field name]`` list.
+    """
+    if not origin:
+        return None, None
+    model_label, pk, field_name = origin
+    model = apps.get_model(model_label)
+    instance = SimpleLazyObject(lambda: model._default_manager.get(pk=pk))
+    return instance, model._meta.get_field(field_name)
+
 
-file_transferred = Signal(providing_args=["name", "local", "remote"])
+def send_transfer_signals(sender, names, local, remote, details=None):
+    """
+    Sends the ``file_transferred`` signal for each of the files with the
+    given names and the ``files_transferred`` signal once.
+    """
+    details = dict((name, dict((details or {}).get(name) or {}))
+                   for name in names)
+    for name in names:
+        kwargs = dict(details[name])
+        kwargs['instance'], kwargs['field'] = get_origin(
+            kwargs.pop('origin', None))
+        file_transferred.send(sender=sender,
+                              name=name, local=local, remote=remote, **kwargs)
+    for detail in details.values():
+        detail.pop('origin', None)
+    files_transferred.send(sender=sender,
+                           names=names, local=local, remote=remote,
+                           details=details)
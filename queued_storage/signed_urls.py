@@ -0,0 +1,94 @@
+"""
+Signing a URL of a private Amazon S3 or Google Cloud Storage object costs
+an HMAC computation, and sometimes a credentials refresh, so
+:meth:`~queued_storage.backends.QueuedStorage.url` reuses the signed URLs
+of remote files until shortly before they expire (see
+:attr:`~queued_storage.conf.settings.QUEUED_STORAGE_URL_EXPIRY_MARGIN`).
+They're kept in memory, see
+:attr:`~queued_storage.conf.settings.QUEUED_STORAGE_URL_CACHE_SIZE`, and
+in the cache for the other processes.
+
+Unsigned URLs, e.g. of public buckets or local files, are cheap to build
+and not cached.
+"""
+import datetime
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+
+def get_url_lifetime(storage):
+    """
+    Returns how many seconds the URLs of the given storage stay valid, or
+    ``None`` if they don't expire or it's unknown. Only (``boto3`` based)
+    Amazon S3 and Google Cloud Storage storages sign their URLs.
+
+    :param storage: storage backend instance
+    :type storage: :class:`~django:django.core.files.storage.Storage`
+    :rtype: float
+    """
+    if hasattr(storage, 'querystring_expire'):
+        # Amazon S3
+        if not getattr(storage, 'querystring_auth', True):
+            return None
+        return storage.querystring_expire
+    lifetime = getattr(storage, 'expiration', None)
+    # Google Cloud Storage, older versions sign unless objects are public.
+    if (lifetime is None or not getattr(storage, 'querystring_auth', True) or
+            getattr(storage, 'default_acl', None) == 'publicRead'):
+        return None
+    if isinstance(lifetime, datetime.timedelta):
+        lifetime = lifetime.total_seconds()
+    return lifetime
+
+
+class URLCache(object):
+    """
+    A thread-safe, in-memory cache of the URLs with the given cache keys
+    until the given times, which falls back to the Django cache. The
+    least recently used URLs are dropped from memory beyond ``max_size``.
+
+    :param max_size: the maximum number of URLs in memory
+    :type max_size: int
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the URL with the given cache key unless it's expired,
+        otherwise ``None``.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[1] > now:
+                self._entries[key] = entry
+                return entry[0]
+        entry = cache.get(key)
+        if entry is None or entry[1] <= now:
+            return None
+        self._remember(key, entry)
+        return entry[0]
+
+    def set(self, key, url, expires):
+        """
+        Caches the given URL with the given cache key until the given
+        time, a Unix timestamp.
+        """
+        timeout = int(expires - time.time())
+        if timeout <= 0:
+            return
+        self._remember(key, (url, expires))
+        cache.set(key, (url, expires), timeout)
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
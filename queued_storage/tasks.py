@@ -1,7 +1,12 @@
 import os
 import io
+import mimetypes
+import time
+from multiprocessing.pool import ThreadPool
 
 from django.core.cache import cache
+from django.core.files.base import ContentFile
+from celery.exceptions import MaxRetriesExceededError
 from celery.task import Task
 
 import logging
@@ -19,12 +24,103 @@ except ImportError:
 
 
 from .conf import settings
-from .signals import file_transferred
-from .utils import import_attribute
+from .fields import mark_transferred
+from .leases import Lease
+from .files import (copy_file, delete_files, get_file_stat, get_object_name,
+                    open_mapped)
+from .signals import send_transfer_signals
+from .transcription import (RecognitionScheduler, get_recognition_config,
+                            get_transcript, get_words, realign_punctuation)
+from .transforms import (apply_transforms, measure, measure_file, spool,
+                         streams_uploads)
+from .utils import (clean_text, gcs_uri, get_backend, get_deletion_key,
+                    get_in_flight_key, get_lease_key, get_migration_key,
+                    get_stat_key, import_attribute)
 
 logger = get_task_logger(name=__name__)
 
 
+def get_transfer_details(name, remote, stats, origin=None):
+    """
+    Returns what's known about the transferred file with the given name,
+    to be passed on to the receivers of the transfer signals.
+
+    :param stats: the statistics recorded by the ``transfer`` method
+    :type stats: dict
+    :param origin: the model label, primary key and field name of the
+                   object the transfer was started from
+    :type origin: list
+    :rtype: dict
+    """
+    try:
+        url = remote.url(name)
+    except Exception as e:
+        # E.g. signing the URL requires credentials the worker lacks,
+        # which shouldn't fail the transfer itself.
+        logger.warning("Unable to get the remote URL of '%s': %s" % (name, e))
+        url = None
+    return {
+        'size': stats.get('size'),
+        'checksum': stats.get('checksum'),
+        'content_type': mimetypes.guess_type(name)[0],
+        'elapsed': stats.get('elapsed'),
+        'url': url,
+        'origin': origin,
+    }
+
+
+def cache_file_stats(remote, names, measured=None):
+    """
+    Caches the metadata of the transferred files, see
+    :meth:`~queued_storage.backends.QueuedStorage.stat`, with the size and
+    checksum measured during their transfer. Remote storages without a
+    single metadata request (see :func:`~queued_storage.files.get_file_stat`)
+    aren't asked for the rest, it's fetched when needed.
+
+    :param names: the names of the files by cache key
+    :type names: dict
+    :param measured: the statistics recorded by the ``transfer`` method by
+                     cache key
+    :type measured: dict
+    """
+    measured = measured or {}
+    stats = {}
+    for cache_key, name in names.items():
+        known = dict((key, value)
+                     for key, value in measured.get(cache_key, {}).items()
+                     if key in ('size', 'checksum') and value is not None)
+        try:
+            stat = get_file_stat(remote, name,
+                                 [] if 'size' in known else None)
+        except Exception as e:
+            logger.warning("Unable to get the metadata of '%s': %s" %
+                           (name, e))
+            stat = {}
+        for key, value in known.items():
+            stat.setdefault(key, value)
+        if stat:
+            stats[get_stat_key(cache_key)] = stat
+    cache.set_many(stats)
+
+
+def dispatch_transfer_signals(sender, names, local, remote, backend_args,
+                              details=None):
+    """
+    Sends the transfer signals for the files with the given names right
+    away, or queues the :class:`~queued_storage.tasks.SendTransferSignals`
+    task if :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_SIGNAL_QUEUE`
+    is set.
+    """
+    queue = settings.QUEUED_STORAGE_SIGNAL_QUEUE
+    if queue:
+        sender_path = '%s.%s' % (sender.__module__, sender.__name__)
+        SendTransferSignals.apply_async(
+            args=[sender_path, names] + list(backend_args),
+            kwargs={'details': details}, queue=queue)
+    else:
+        send_transfer_signals(sender, names, local, remote, details)
+
+
 class Transfer(Task):
     """
     The default task. Transfers a file to a remote location.
@@ -62,6 +158,19 @@ class Transfer(Task):
                     notify(result)
                 return result
 
+    To transform the content of the files on the fly while they're
+    streamed to the remote storage, e.g. to convert audio files to FLAC,
+    list the dotted paths of :mod:`~queued_storage.transforms` in
+    :attr:`~queued_storage.tasks.Transfer.transforms`:
+
+    .. code-block:: python
+
+        class TranscodeAndTransfer(Transfer):
+            transforms = ['queued_storage.transforms.to_flac']
+
+    Remote storages which can't upload streams get the transformed content
+    spooled to a temporary file first, see
+    :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_STREAMING_STORAGES`.
     """
     #: The number of retries if unsuccessful (default: see
     #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_RETRIES`)
@@ -71,13 +180,19 @@ class Transfer(Task):
     #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_RETRY_DELAY`)
     default_retry_delay = settings.QUEUED_STORAGE_RETRY_DELAY
 
+    #: The transforms to apply to the file content during the transfer.
+    #: Dotted paths, see :mod:`~queued_storage.transforms`.
+    transforms = ()
+
     def run(self, name, cache_key,
             local_path, remote_path,
             local_options, remote_options, **kwargs):
         """
         The main work horse of the transfer task. Calls the transfer
         method with the local and remote storage backends as given
-        with the parameters.
+        with the parameters, holding a :class:`~queued_storage.leases.Lease`
+        on the file. If another worker holds it, the file is skipped and
+        ``None`` returned.
 
         :param name: name of the file to transfer
         :type name: str
@@ -93,24 +208,85 @@ class Transfer(Task):
         :type cache_key: str
         :rtype: task result
         """
-        local = import_attribute(local_path)(**local_options)
-        remote = import_attribute(remote_path)(**remote_options)
-        result = self.transfer(name, local, remote, **kwargs)
+        local = get_backend(local_path, local_options)
+        remote = get_backend(remote_path, remote_options)
+        stats = {}
+        with Lease(get_lease_key(cache_key)) as lease:
+            if not lease.acquired:
+                logger.info("'%s' is being transferred by another worker, "
+                            "skipping it." % name)
+                return None
+            result = self.transfer(name, local, remote, stats=stats, **kwargs)
 
         if result is True:
             cache.set(cache_key, True)
-            file_transferred.send(sender=self.__class__,
-                                  name=name, local=local, remote=remote)
+            cache.delete(get_in_flight_key(cache_key))
+            cache_file_stats(remote, {cache_key: name}, {cache_key: stats})
+            if kwargs.get('state_fields'):
+                mark_transferred(kwargs['state_fields'],
+                                 self.get_state_names([name]))
+            details = get_transfer_details(name, remote, stats,
+                                           kwargs.get('origin'))
+            dispatch_transfer_signals(self.__class__, [name], local, remote,
+                                      [local_path, remote_path,
+                                       local_options, remote_options],
+                                      {name: details})
+            self.transferred([name], local_path, remote_path,
+                             local_options, remote_options, **kwargs)
         elif result is False:
             args = [name, cache_key, local_path,
                     remote_path, local_options, remote_options]
-            self.retry(args=args, kwargs=kwargs)
+            try:
+                self.retry(args=args, kwargs=kwargs)
+            except MaxRetriesExceededError:
+                # Given up, the file may be queued again.
+                cache.delete(get_in_flight_key(cache_key))
+                raise
         else:
+            cache.delete(get_in_flight_key(cache_key))
             raise ValueError("Task '%s' did not return True/False but %s" %
                              (self.__class__, result))
         return result
 
-    def transfer(self, name, local, remote, **kwargs):
+    def transferred(self, names, local_path, remote_path,
+                    local_options, remote_options, executor=None, **kwargs):
+        """
+        Called with the names of the files transferred by this task, or by
+        a :class:`~queued_storage.tasks.TransferBatch` using it, e.g. to
+        queue follow-up tasks with the given executor of the storage (see
+        :mod:`~queued_storage.executors`). Does nothing by default.
+
+        :param names: names of the transferred files
+        :type names: list
+        :param executor: the executor of the storage. A dotted path.
+        :type executor: str
+        """
+
+    def get_clean_name(self, name):
+        """
+        Returns the name the file with the given name is transferred with,
+        the given one by default.
+        """
+        return name
+
+    def get_state_names(self, names):
+        """
+        Returns the names of the objects' files whose state to update after
+        the files with the given names were transferred, see
+        :func:`~queued_storage.fields.mark_transferred`: the given names
+        and the ones the files were transferred with, so the objects are
+        found whichever of them they store.
+
+        :param names: file names
+        :type names: iterable
+        :rtype: list
+        """
+        names = set(names)
+        return sorted(names.union(self.get_clean_name(name)
+                                  for name in names))
+
+    def transfer(self, name, local, remote, transforms=None, stats=None,
+                 **kwargs):
         """
         Transfers the file with the given name from the local to the remote
         storage backend.
@@ -118,12 +294,36 @@ class Transfer(Task):
         :param name: The name of the file to transfer
         :param local: The local storage backend instance
         :param remote: The remote storage backend instance
+        :param transforms: Transforms to apply after the ones of the task
+        :param stats: A dictionary to record the size, checksum and
+                      duration of the transfer in
         :returns: `True` when the transfer succeeded, `False` if not. Retries
                   the task when returning `False`
         :rtype: bool
         """
+        transforms = list(self.transforms) + list(transforms or [])
+        if stats is None:
+            stats = {}
+        started = time.time()
         try:
-            remote.save(name, local.open(name))
+            local_file = content = open_mapped(local, name)
+            try:
+                if transforms:
+                    content = apply_transforms(
+                        local_file, name,
+                        transforms + [(measure, {'stats': stats})])
+                    if not streams_uploads(remote):
+                        content = spool(content)
+                else:
+                    # Uploaded as is, so the remote storage can rewind it
+                    # and ask for its size.
+                    measure_file(local_file, stats)
+                remote.save(name, content)
+            finally:
+                if content is not local_file:
+                    content.close()
+                local_file.close()
+            stats['elapsed'] = time.time() - started
             return True
         except Exception as e:
             logger.error("Unable to save '%s' to remote storage. "
@@ -161,3 +361,447 @@ class TransferAndDelete(Transfer):
             local.delete(name)
         logging.info("Completed transfer of {0}".format(name))
         return result
+
+
+class TransferBatch(Task):
+    """
+    Transfers a batch of files with a single task, using the ``transfer``
+    method of the given transfer task class, e.g. to move a backlog of
+    files stored with a delayed storage, see
+    :meth:`~queued_storage.backends.QueuedStorage.transfer_many`.
+
+    Only the files which couldn't be transferred are retried.
+    """
+    #: The number of retries if unsuccessful (default: see
+    #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_RETRIES`)
+    max_retries = settings.QUEUED_STORAGE_RETRIES
+
+    #: The delay between each retry in seconds (default: see
+    #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_RETRY_DELAY`)
+    default_retry_delay = settings.QUEUED_STORAGE_RETRY_DELAY
+
+    def run(self, items, local_path, remote_path,
+            local_options, remote_options,
+            task='queued_storage.tasks.Transfer', **kwargs):
+        """
+        Transfers the files of the batch, skipping the ones another worker
+        holds a :class:`~queued_storage.leases.Lease` on.
+
+        :param items: ``[name, cache key]`` pairs of the files to transfer
+        :type items: list
+        :param local_path: local storage class to transfer from
+        :type local_path: str
+        :param remote_path: remote storage class to transfer to
+        :type remote_path: str
+        :param local_options: options of the local storage class
+        :type local_options: dict
+        :param remote_options: options of the remote storage class
+        :type remote_options: dict
+        :param task: the transfer task class to use
+        :type task: str
+        :rtype: the number of transferred files
+        """
+        local = get_backend(local_path, local_options)
+        remote = get_backend(remote_path, remote_options)
+        transfer = import_attribute(task)()
+
+        transferred, failed, details, measured = {}, [], {}, {}
+        for name, cache_key in items:
+            stats = {}
+            with Lease(get_lease_key(cache_key)) as lease:
+                if not lease.acquired:
+                    logger.info("'%s' is being transferred by another "
+                                "worker, skipping it." % name)
+                    continue
+                result = transfer.transfer(name, local, remote, stats=stats,
+                                           **kwargs)
+            if result is True:
+                transferred[cache_key] = name
+                measured[cache_key] = stats
+                details[name] = get_transfer_details(name, remote, stats)
+            elif result is False:
+                failed.append([name, cache_key])
+            else:
+                raise ValueError("Task '%s' did not return True/False but %s" %
+                                 (transfer.__class__, result))
+
+        cache.set_many(dict.fromkeys(transferred, True))
+        cache.delete_many([get_in_flight_key(cache_key)
+                           for cache_key in transferred])
+        cache_file_stats(remote, transferred, measured)
+        if transferred and kwargs.get('state_fields'):
+            mark_transferred(kwargs['state_fields'],
+                             transfer.get_state_names(transferred.values()))
+        if transferred:
+            dispatch_transfer_signals(transfer.__class__,
+                                      list(transferred.values()),
+                                      local, remote,
+                                      [local_path, remote_path,
+                                       local_options, remote_options],
+                                      details)
+            transfer.transferred(list(transferred.values()),
+                                 local_path, remote_path,
+                                 local_options, remote_options, **kwargs)
+        if failed:
+            kwargs['task'] = task
+            try:
+                self.retry(args=[failed, local_path, remote_path,
+                                 local_options, remote_options], kwargs=kwargs)
+            except MaxRetriesExceededError:
+                cache.delete_many([get_in_flight_key(cache_key)
+                                   for _, cache_key in failed])
+                raise
+        return len(transferred)
+
+
+class DeleteFiles(Task):
+    """
+    Deletes many files from a storage with batch requests where possible,
+    see :meth:`~queued_storage.backends.QueuedStorage.delete_many`, and
+    removes their cache keys afterwards, releasing their names. Only the
+    files which couldn't be deleted are retried.
+    """
+    #: The number of retries if unsuccessful (default: see
+    #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_RETRIES`)
+    max_retries = settings.QUEUED_STORAGE_RETRIES
+
+    #: The delay between each retry in seconds (default: see
+    #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_RETRY_DELAY`)
+    default_retry_delay = settings.QUEUED_STORAGE_RETRY_DELAY
+
+    def run(self, items, storage_path, storage_options, **kwargs):
+        """
+        :param items: ``[name, cache key]`` pairs of the files to delete
+        :type items: list
+        :param storage_path: storage class to delete the files from
+        :type storage_path: str
+        :param storage_options: options of the storage class
+        :type storage_options: dict
+        :rtype: the number of deleted files
+        """
+        storage = get_backend(storage_path, storage_options)
+        failed = set(delete_files(storage, [name for name, _ in items]))
+        deleted = [cache_key for name, cache_key in items
+                   if name not in failed]
+        # Only the keys set by delete_many, not the ones of new files.
+        current = cache.get_many(deleted)
+        cache.delete_many([cache_key for cache_key in deleted
+                           if current.get(cache_key) is False] +
+                          [get_deletion_key(cache_key)
+                           for cache_key in deleted])
+        if failed:
+            self.retry(args=[[[name, cache_key] for name, cache_key in items
+                              if name in failed],
+                             storage_path, storage_options], kwargs=kwargs)
+        return len(items) - len(failed)
+
+
+class MigrateBatch(Task):
+    """
+    Copies many files from the previous to the current remote storage of a
+    :class:`~queued_storage.backends.QueuedStorage`, see
+    :mod:`~queued_storage.migration`, in a pool of
+    :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_MIGRATION_WORKERS`
+    threads. Files which already exist in the current remote storage, e.g.
+    because they were saved again since, are skipped. Only the files which
+    couldn't be copied are retried, the ones still failing after that are
+    queued again by :func:`~queued_storage.migration.verify_migration`.
+    """
+    #: The number of retries if unsuccessful (default: see
+    #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_RETRIES`)
+    max_retries = settings.QUEUED_STORAGE_RETRIES
+
+    #: The delay between each retry in seconds (default: see
+    #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_RETRY_DELAY`)
+    default_retry_delay = settings.QUEUED_STORAGE_RETRY_DELAY
+
+    def run(self, items, source_path, source_options,
+            target_path, target_options, server_side=True, **kwargs):
+        """
+        :param items: ``[name, cache key]`` pairs of the files to copy
+        :type items: list
+        :param source_path: the previous remote storage class
+        :type source_path: str
+        :param source_options: options of the previous remote storage class
+        :type source_options: dict
+        :param target_path: the current remote storage class
+        :type target_path: str
+        :param target_options: options of the current remote storage class
+        :type target_options: dict
+        :param server_side: whether to copy server-side where possible, see
+                            :func:`~queued_storage.files.copy_file`
+        :type server_side: bool
+        :rtype: the number of migrated files
+        """
+        source = get_backend(source_path, source_options)
+        target = get_backend(target_path, target_options)
+
+        def migrate(item):
+            name, cache_key = item
+            # Transfers of new versions of the file hold the same lease.
+            with Lease(get_lease_key(cache_key)) as lease:
+                if not lease.acquired:
+                    return False
+                try:
+                    if not target.exists(name):
+                        copy_file(source, target, name, server_side)
+                    return True
+                except Exception as e:
+                    logger.error("Unable to migrate '%s'." % name)
+                    logger.exception(e)
+                    return False
+
+        pool = ThreadPool(max(1, min(len(items),
+                                     settings.QUEUED_STORAGE_MIGRATION_WORKERS)))
+        try:
+            results = pool.map(migrate, items)
+        finally:
+            pool.close()
+            pool.join()
+        migrated = [cache_key for (name, cache_key), result
+                    in zip(items, results) if result]
+        failed = [item for item, result in zip(items, results) if not result]
+        cache.set_many(dict((get_migration_key(cache_key), True)
+                            for cache_key in migrated))
+        if failed:
+            kwargs['server_side'] = server_side
+            self.retry(args=[failed, source_path, source_options,
+                             target_path, target_options], kwargs=kwargs)
+        return len(migrated)
+
+
+class DemoteBatch(Task):
+    """
+    Moves many files from one storage tier of a
+    :class:`~queued_storage.backends.QueuedStorage` to a colder one, see
+    :mod:`~queued_storage.tiering`. Each file is copied, its cache key set
+    to the new tier and then it's deleted from the old tier. Files which
+    aren't in the old tier anymore according to the cache, e.g. because
+    they were saved again since, are skipped. Only the files which
+    couldn't be moved are retried.
+    """
+    #: The number of retries if unsuccessful (default: see
+    #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_RETRIES`)
+    max_retries = settings.QUEUED_STORAGE_RETRIES
+
+    #: The delay between each retry in seconds (default: see
+    #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_RETRY_DELAY`)
+    default_retry_delay = settings.QUEUED_STORAGE_RETRY_DELAY
+
+    def run(self, items, tier, source_path, source_options,
+            target, target_path, target_options, server_side=True,
+            **kwargs):
+        """
+        :param items: ``[name, cache key]`` pairs of the files to move
+        :type items: list
+        :param tier: the tier to move the files from
+        :type tier: int
+        :param source_path: storage class of the tier
+        :type source_path: str
+        :param source_options: options of the storage class of the tier
+        :type source_options: dict
+        :param target: the tier to move the files to
+        :type target: int
+        :param target_path: storage class of the target tier
+        :type target_path: str
+        :param target_options: options of the storage class of the target
+                               tier
+        :type target_options: dict
+        :param server_side: whether to copy server-side where possible, see
+                            :func:`~queued_storage.files.copy_file`
+        :type server_side: bool
+        :rtype: the number of moved files
+        """
+        source = get_backend(source_path, source_options)
+        target_storage = get_backend(target_path, target_options)
+        moved, failed = [], []
+        for name, cache_key in items:
+            # Transfers of new versions of the file hold the same lease.
+            with Lease(get_lease_key(cache_key)) as lease:
+                if not lease.acquired:
+                    failed.append([name, cache_key])
+                    continue
+                current = cache.get(cache_key)
+                if current is not None and current != tier:
+                    continue
+                try:
+                    copy_file(source, target_storage, name, server_side)
+                except Exception as e:
+                    logger.error("Unable to move '%s' to the tier %d." %
+                                 (name, target))
+                    logger.exception(e)
+                    failed.append([name, cache_key])
+                    continue
+                cache.set(cache_key, target)
+                moved.append(cache_key)
+                # Still leased, so a new version can't be saved meanwhile.
+                try:
+                    source.delete(name)
+                except Exception as e:
+                    logger.error("Unable to delete '%s' from the tier %d." %
+                                 (name, tier))
+                    logger.exception(e)
+        cache.delete_many([get_stat_key(cache_key) for cache_key in moved])
+        if failed:
+            kwargs['server_side'] = server_side
+            self.retry(args=[failed, tier, source_path, source_options,
+                             target, target_path, target_options],
+                       kwargs=kwargs)
+        return len(moved)
+
+
+class SendTransferSignals(Task):
+    """
+    Sends the ``file_transferred`` and ``files_transferred`` signals for
+    files transferred by another task, see
+    :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_SIGNAL_QUEUE`.
+    """
+    def run(self, sender, names, local_path, remote_path,
+            local_options, remote_options, details=None, **kwargs):
+        """
+        :param sender: the transfer task class. A dotted path.
+        :type sender: str
+        :param names: names of the transferred files
+        :type names: list
+        :param details: what's known about the transferred files by name
+        :type details: dict
+        """
+        local = get_backend(local_path, local_options)
+        remote = get_backend(remote_path, remote_options)
+        send_transfer_signals(import_attribute(sender), names, local, remote,
+                              details)
+
+
+class Transcribe(Task):
+    """
+    Transcribes audio files that have been transferred to the remote
+    storage with the long running recognition of the Google Cloud Speech
+    API and saves the transcripts next to them in the remote storage,
+    replacing the ``audios/`` directory with ``texts/``. Existing
+    transcripts are replaced, so retries don't leave duplicates behind.
+
+    The files must be 16 kHz mono FLAC files, as transcoded by the
+    :data:`~queued_storage.transforms.to_flac` transform of
+    :class:`~queued_storage.tasks.TransferAndTranscribe`.
+
+    Many files can be passed at once, at most
+    :attr:`~queued_storage.tasks.Transcribe.max_in_flight` recognition
+    operations are running at the same time. Failed files are retried.
+    """
+    #: The number of retries if unsuccessful (default: see
+    #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_RETRIES`)
+    max_retries = settings.QUEUED_STORAGE_RETRIES
+
+    #: The delay between each retry in seconds (default: see
+    #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_RETRY_DELAY`)
+    default_retry_delay = settings.QUEUED_STORAGE_RETRY_DELAY
+
+    #: The speech client class to use. A dotted path.
+    speech_client = 'google.cloud.speech.SpeechClient'
+
+    #: The maximum number of running recognition operations (default: see
+    #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_SPEECH_MAX_IN_FLIGHT`)
+    max_in_flight = settings.QUEUED_STORAGE_SPEECH_MAX_IN_FLIGHT
+
+    #: The delay between polls of the running operations in seconds
+    #: (default: see
+    #: :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_SPEECH_POLL_INTERVAL`)
+    poll_interval = settings.QUEUED_STORAGE_SPEECH_POLL_INTERVAL
+
+    _client = None
+    _client_pid = None
+
+    def run(self, names, remote_path, remote_options, **kwargs):
+        """
+        Transcribes the files with the given names.
+
+        :param names: names of the audio files to transcribe
+        :type names: list
+        :param remote_path: remote storage class the files were transferred to
+        :type remote_path: str
+        :param remote_options: options of the remote storage class
+        :type remote_options: dict
+        :rtype: list of the names of the saved transcripts
+        """
+        remote = get_backend(remote_path, remote_options)
+        scheduler = RecognitionScheduler(self.get_client(),
+                                         max_in_flight=self.max_in_flight,
+                                         poll_interval=self.poll_interval)
+        requests = [(name, get_recognition_config(name),
+                     self.get_uri(name, remote)) for name in names]
+        text_names = []
+        for name, response in scheduler.run(requests):
+            text = self.format_transcript(get_transcript(response),
+                                          get_words(response))
+            text_name = self.generate_text_filename(name)
+            if remote.exists(text_name):
+                remote.delete(text_name)
+            text_names.append(
+                remote.save(text_name, ContentFile(text.encode('utf-8'))))
+
+        if scheduler.failed:
+            for name, error in scheduler.failed.items():
+                logger.error("Unable to transcribe '%s'. About to retry." %
+                             name)
+                logger.exception(error)
+            self.retry(args=[list(scheduler.failed), remote_path,
+                             remote_options], kwargs=kwargs)
+        return text_names
+
+    def get_client(self):
+        """
+        Returns the speech client of the current process.
+        """
+        if self._client_pid != os.getpid():
+            self._client = import_attribute(self.speech_client)()
+            self._client_pid = os.getpid()
+        return self._client
+
+    def get_uri(self, name, remote):
+        """
+        Returns the URI the speech API reads the audio file with the given
+        name from, the ``gs://`` URI for Cloud Storage remotes.
+        """
+        bucket_name = getattr(remote, 'bucket_name', None)
+        if bucket_name:
+            return gcs_uri(bucket_name, get_object_name(remote, name))
+        return remote.url(name)
+
+    def generate_text_filename(self, name):
+        """
+        Returns the name of the transcript of the audio file with the
+        given name.
+        """
+        root = name.replace("audios/", "texts/").rsplit('.', 1)[0]
+        return root + '.txt'
+
+    def format_transcript(self, transcript, words=None):
+        """
+        Realigns the punctuation of the given transcript with the given
+        recognized words, see
+        :func:`~queued_storage.transcription.realign_punctuation`.
+        """
+        return clean_text(realign_punctuation(transcript, words)).strip()
+
+
+class TransferAndTranscribe(TransferAndDelete):
+    """
+    A :class:`~queued_storage.tasks.TransferAndDelete` subclass which queues
+    the :class:`~queued_storage.tasks.Transcribe` task for the transferred
+    files with the executor of the storage, also when they're transferred
+    in batches. The files are transcoded to the 16 kHz mono FLAC the
+    recognition expects on their way to the remote storage.
+    """
+    #: The transforms to apply to the file content during the transfer,
+    #: which must end with transcoding to FLAC.
+    transforms = ['queued_storage.transforms.to_flac']
+
+    #: The task to transcribe the file with. A dotted path.
+    transcribe_task = 'queued_storage.tasks.Transcribe'
+
+    def transferred(self, names, local_path, remote_path,
+                    local_options, remote_options, executor=None, **kwargs):
+        executor = get_backend(executor or settings.QUEUED_STORAGE_EXECUTOR)
+        executor.submit(import_attribute(self.transcribe_task),
+                        [[self.get_clean_name(name) for name in names],
+                         remote_path, remote_options])
@@ -0,0 +1,148 @@
+"""
+Storage tiers keep recent files on fast storage and move older ones to
+cheaper storage. The local storage of a
+:class:`~queued_storage.backends.QueuedStorage` is the tier 0, its remote
+storage the tier 1, and colder tiers are added with the ``tiers``
+parameter, each with the policy deciding which files belong there::
+
+    QueuedStorage(
+        local='django.core.files.storage.FileSystemStorage',
+        remote='storages.backends.s3boto3.S3Boto3Storage',
+        remote_options={'bucket_name': 'media-hot'},
+        tiers=[
+            ('storages.backends.s3boto3.S3Boto3Storage',
+             {'bucket_name': 'media-warm'},
+             ('queued_storage.tiering.older_than', {'days': 30})),
+            ('storages.backends.s3boto3.S3Boto3Storage',
+             {'bucket_name': 'media-cold'},
+             [('queued_storage.tiering.older_than', {'days': 365}),
+              ('queued_storage.tiering.larger_than', {'size': 2 ** 20})]),
+        ])
+
+A policy is a callable (or its dotted path, optionally as a
+``(policy, options)`` pair like :mod:`~queued_storage.transforms`) which
+takes the file name and its metadata as returned by
+:meth:`~queued_storage.backends.QueuedStorage.stat` (plus its
+``access_count`` if accesses are counted) and returns whether
+the file belongs in the tier. A list of policies matches if all of them
+do.
+
+New files are always transferred to the remote storage. Files are moved
+to colder tiers by :meth:`~queued_storage.backends.QueuedStorage.demote`,
+e.g. periodically for all files with the ``demote_files`` management
+command::
+
+    python manage.py demote_files myapp.storages.media_storage
+
+The tier of each file is kept in its cache key, so finding the storage of
+a file is still a single cache lookup.
+"""
+import datetime
+import itertools
+
+import six
+from django.utils import timezone
+
+from .conf import settings
+from .migration import walk_files
+from .utils import import_attribute
+
+
+def _age(value, days=0, hours=0, seconds=0):
+    if value is None:
+        return False
+    limit = datetime.timedelta(days=days, hours=hours, seconds=seconds)
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.utc)
+    return datetime.datetime.now(timezone.utc) - value >= limit
+
+
+def older_than(name, stat, days=0, hours=0, seconds=0):
+    """
+    Matches files which were last modified at least the given time ago.
+    """
+    return _age(stat.get('modified_time'), days, hours, seconds)
+
+
+def idle_for(name, stat, days=0, hours=0, seconds=0):
+    """
+    Matches files which were last read at least the given time ago. Only
+    storages which record access times, e.g. local file systems, have
+    idle files.
+    """
+    return _age(stat.get('accessed_time'), days, hours, seconds)
+
+
+def larger_than(name, stat, size):
+    """
+    Matches files which are larger than the given number of bytes.
+    """
+    return stat.get('size') is not None and stat['size'] > size
+
+
+def rarely_accessed(name, stat, count=1):
+    """
+    Matches files which were accessed fewer than the given number of times
+    recently, see :mod:`~queued_storage.access`. Nothing matches if
+    accesses aren't counted.
+    """
+    return stat.get('access_count', count) < count
+
+
+def match_policy(policy, name, stat):
+    """
+    Returns whether the file with the given name and metadata matches the
+    given policy, see :mod:`~queued_storage.tiering`. Nothing matches no
+    policy.
+
+    :param policy: a policy, its dotted path, a ``(policy, options)`` pair
+                   or a list of these
+    :param name: file name
+    :type name: str
+    :param stat: the metadata of the file
+    :type stat: dict
+    :rtype: bool
+    """
+    if not policy:
+        return False
+    if isinstance(policy, list):
+        return all(match_policy(item, name, stat) for item in policy)
+    options = {}
+    if isinstance(policy, tuple):
+        policy, options = policy
+    if isinstance(policy, six.string_types):
+        policy = import_attribute(policy)
+    return bool(policy(name, stat, **options))
+
+
+def demote_files(storage, name='', batch_size=None, server_side=True,
+                 page_size=None, callback=None):
+    """
+    Queues the moves of the files in the given directory of the remote
+    storage and of the colder tiers (except the coldest) of the given
+    storage to the tiers whose policies they match, see
+    :meth:`~queued_storage.backends.QueuedStorage.demote`. The tiers are
+    listed page by page.
+
+    :param storage: the storage whose files to move
+    :type storage: :class:`~queued_storage.backends.QueuedStorage`
+    :param name: directory name (default: all files)
+    :type name: str
+    :param batch_size: the number of files per task (default see
+        :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_BATCH_SIZE`)
+    :type batch_size: int
+    :returns: the number of queued files
+    :rtype: int
+    """
+    batch_size = batch_size or settings.QUEUED_STORAGE_BATCH_SIZE
+    count = 0
+    for tier_storage in storage.tiers[1:-1]:
+        names = walk_files(tier_storage, name, page_size=page_size)
+        while True:
+            batch = list(itertools.islice(names, batch_size))
+            if not batch:
+                break
+            count += storage.demote(batch, batch_size=batch_size,
+                                    server_side=server_side,
+                                    callback=callback)
+    return count
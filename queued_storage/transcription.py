@@ -0,0 +1,188 @@
+"""
+Helpers to transcribe transferred audio files with the asynchronous
+(long running) recognition of the Google Cloud Speech API, see
+:class:`~queued_storage.tasks.Transcribe`.
+"""
+import re
+import time
+
+from collections import deque
+
+from .conf import settings
+from .utils import SAMPLE_RATE, get_nearest_substring
+
+#: The punctuation marks added by the automatic punctuation.
+PUNCTUATION = ',.?!;:'
+
+
+def get_language_code(name):
+    """
+    Returns the language code of the audio file with the given name, which
+    is expected to end with e.g. ``_lang_en-US.flac``, falling back to
+    :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_SPEECH_LANGUAGE`.
+
+    :param name: file name
+    :type name: str
+    :rtype: str
+    """
+    root = name.rsplit('/', 1)[-1].rsplit('.', 1)[0]
+    if '_lang_' in root:
+        return root.rsplit('_lang_', 1)[1]
+    return settings.QUEUED_STORAGE_SPEECH_LANGUAGE
+
+
+def get_recognition_config(name):
+    """
+    Returns the recognition config for the (16 kHz FLAC) audio file with
+    the given name.
+
+    :param name: file name
+    :type name: str
+    :rtype: dict
+    """
+    return {
+        'encoding': 'FLAC',
+        'sample_rate_hertz': int(SAMPLE_RATE),
+        'language_code': get_language_code(name),
+        'enable_automatic_punctuation': True,
+        'enable_word_time_offsets': True,
+    }
+
+
+def get_transcript(response):
+    """
+    Joins the most likely alternatives of all results of a recognition
+    response.
+    """
+    return ' '.join(result.alternatives[0].transcript
+                    for result in response.results if result.alternatives)
+
+
+def get_words(response):
+    """
+    Returns the recognized words of the most likely alternatives of all
+    results of a recognition response without punctuation, or ``None`` if
+    the response has no word level information.
+    """
+    words = []
+    for result in response.results:
+        if result.alternatives:
+            words.extend(info.word for info in
+                         getattr(result.alternatives[0], 'words', None) or [])
+    words = [word.strip(PUNCTUATION) for word in words]
+    return [word for word in words if word] or None
+
+
+def realign_punctuation(transcript, words=None, context=2):
+    """
+    Inserts the punctuation marks of the given transcript between the given
+    recognized words, where the ``context`` words around each mark match
+    best (see :func:`~queued_storage.utils.get_nearest_substring`). The
+    words of the transcript itself are used if none are given.
+
+    :param transcript: the punctuated transcript
+    :type transcript: str
+    :param words: the recognized words
+    :type words: list
+    :param context: the number of words on each side of a mark to match
+    :type context: int
+    :rtype: str
+    """
+    marks = re.escape(PUNCTUATION)
+    tokens = re.findall(r'[%s]|[^\s%s]+' % (marks, marks), transcript)
+    punctuated = [token for token in tokens if token not in PUNCTUATION]
+    if words is None:
+        words = punctuated
+    lowered = [word.lower() for word in words]
+    insertions, position = [], 0
+    for token in tokens:
+        if token not in PUNCTUATION:
+            position += 1
+            continue
+        left = [word.lower() for word in
+                punctuated[max(0, position - context):position]]
+        if not left or len(left) > len(lowered):
+            # Nothing to attach the mark to.
+            continue
+        right = [word.lower() for word in punctuated[
+            position:position + min(context, len(lowered) - len(left))]]
+        aligned = get_nearest_substring(list(lowered), left, right,
+                                        position - len(left), token)
+        index = len(lowered)
+        for i, word in enumerate(lowered):
+            if aligned[i] != word:
+                index = i
+                break
+        insertions.append((index, token))
+
+    aligned = list(words)
+    # From the end, so the earlier indexes stay valid.
+    for index, mark in reversed(sorted(insertions, key=lambda item: item[0])):
+        aligned.insert(index, mark)
+    text = ''
+    for token in aligned:
+        text += token if token in PUNCTUATION else ' ' + token
+    return text.strip()
+
+
+class RecognitionScheduler(object):
+    """
+    Starts long running recognition operations for a number of audio files
+    while keeping at most ``max_in_flight`` of them running at once, and
+    polls the running ones every ``poll_interval`` seconds.
+
+    :param client: speech client
+    :param max_in_flight: the maximum number of running operations
+    :type max_in_flight: int
+    :param poll_interval: the delay between polls in seconds
+    :type poll_interval: float
+    """
+    #: The function used to wait between polls.
+    sleep = staticmethod(time.sleep)
+
+    def __init__(self, client, max_in_flight=None, poll_interval=None):
+        self.client = client
+        if max_in_flight is None:
+            max_in_flight = settings.QUEUED_STORAGE_SPEECH_MAX_IN_FLIGHT
+        self.max_in_flight = max(1, max_in_flight)
+        if poll_interval is None:
+            poll_interval = settings.QUEUED_STORAGE_SPEECH_POLL_INTERVAL
+        self.poll_interval = poll_interval
+        #: Maps the keys of failed recognitions to their exceptions.
+        self.failed = {}
+
+    def start(self, config, uri):
+        return self.client.long_running_recognize(config=config,
+                                                  audio={'uri': uri})
+
+    def run(self, requests):
+        """
+        Recognizes the given ``(key, config, uri)`` requests and yields
+        ``(key, response)`` tuples as soon as the operations finish.
+        Failed requests are skipped and recorded in :attr:`failed`.
+        """
+        pending = deque(requests)
+        in_flight = []
+        while pending or in_flight:
+            while pending and len(in_flight) < self.max_in_flight:
+                key, config, uri = pending.popleft()
+                try:
+                    in_flight.append((key, self.start(config, uri)))
+                except Exception as e:
+                    self.failed[key] = e
+
+            running = []
+            for key, operation in in_flight:
+                if not operation.done():
+                    running.append((key, operation))
+                    continue
+                try:
+                    response = operation.result()
+                except Exception as e:
+                    self.failed[key] = e
+                else:
+                    yield key, response
+
+            if running and len(running) == len(in_flight):
+                self.sleep(self.poll_interval)
+            in_flight = running
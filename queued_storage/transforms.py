@@ -0,0 +1,583 @@
+"""
+Transforms are applied to the content of a file while it's streamed from
+the local to the remote storage by the
+:class:`~queued_storage.tasks.Transfer` task. A transform is a callable
+which takes an iterable of byte chunks and the file name and returns an
+iterable of the transformed chunks, e.g.::
+
+    def upper(chunks, name):
+        for chunk in chunks:
+            yield chunk.upper()
+
+Transforms are referenced by dotted path, either in the ``transforms``
+attribute of the task class or per storage with the ``transforms``
+parameter of :class:`~queued_storage.backends.QueuedStorage`. To pass
+options to a transform, use a ``(dotted path, options)`` pair, e.g.::
+
+    QueuedGCSStorage(transforms=[
+        'queued_storage.transforms.strip_exif',
+        ('queued_storage.transforms.pipe', {'args': ['gzip', '-c']}),
+        ('queued_storage.transforms.checksum', {'algorithm': 'sha256'}),
+    ])
+
+The transforms are chained lazily in the given order: the local file is
+read once, chunk by chunk, and each chunk passes through every transform
+right before it's uploaded.
+
+Only the remote storages listed in
+:attr:`~queued_storage.conf.settings.QUEUED_STORAGE_STREAMING_STORAGES`
+(the file system, Google Cloud Storage and ``boto3`` based Amazon S3
+storages by default) upload the transformed content as it's streamed.
+For the others, e.g. the ``boto`` based storage of
+:class:`~queued_storage.backends.QueuedS3BotoStorage`, which seeks to the
+end of the content for its size and checksum, it's spooled to a
+temporary file first, see :func:`~queued_storage.transforms.spool`.
+
+Local files are memory-mapped during the transfer, see
+:class:`~queued_storage.files.MappedFile`. Transforms decorated with
+:func:`~queued_storage.transforms.accepts_buffers` get the chunks as
+:class:`~python:memoryview` objects of the mapping (its
+:meth:`~queued_storage.files.MappedFile.buffers`), other transforms as
+:class:`~python:bytes`.
+"""
+import hashlib
+import io
+import itertools
+import logging
+import shutil
+import six
+import subprocess
+import tempfile
+import threading
+import wave
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import File
+from django.utils.http import urlquote
+
+try:
+    from shutil import which
+except ImportError:  # Python 2
+    from distutils.spawn import find_executable as which
+
+from .conf import settings
+from .utils import SAMPLE_RATE, import_attribute
+
+logger = logging.getLogger(__name__)
+
+
+def accepts_buffers(transform):
+    """
+    Marks the given transform as accepting chunks of any bytes-like type,
+    e.g. :class:`~python:memoryview`, instead of :class:`~python:bytes`
+    only.
+    """
+    transform.accepts_buffers = True
+    return transform
+
+
+class ChunkedIO(io.RawIOBase):
+    """
+    A read-only, non-seekable file object reading from an iterable of
+    bytes-like chunks, so upload clients stream it instead of rewinding it
+    or seeking to its end to get its size. Only seeking to the current
+    position is supported (e.g. ``seek(0)`` before reading, like many
+    upload clients do), see :class:`~queued_storage.transforms.ChunkedReader`.
+    """
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = memoryview(b'')
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        if whence == io.SEEK_END or offset != self._position:
+            raise io.UnsupportedOperation("Chunked files can't be rewound.")
+        return self._position
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        self._position += n
+        return n
+
+
+class ChunkedReader(io.BufferedReader):
+    """
+    A buffered :class:`~queued_storage.transforms.ChunkedIO`, which, unlike
+    :class:`~python:io.BufferedReader`, accepts seeking to the current
+    position although it isn't seekable.
+    """
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.tell()
+        if whence == io.SEEK_END or offset != self.tell():
+            raise io.UnsupportedOperation("Chunked files can't be rewound.")
+        return offset
+
+
+def apply_transforms(content, name, transforms):
+    """
+    Returns a :class:`~django:django.core.files.File` streaming the given
+    content through the transforms with the given dotted paths, or the
+    content itself if there are none.
+
+    :param content: the file to transform
+    :type content: :class:`~django:django.core.files.File`
+    :param name: file name
+    :type name: str
+    :param transforms: the transforms (or their dotted paths), optionally
+                       as ``(transform, options)`` pairs
+    :type transforms: list
+    :rtype: :class:`~django:django.core.files.File`
+    """
+    if not transforms:
+        return content
+    chunks = getattr(content, 'buffers', content.chunks)()
+    content_type = None
+    for transform in transforms:
+        options = {}
+        if isinstance(transform, (list, tuple)):
+            transform, options = transform
+        if isinstance(transform, six.string_types):
+            transform = import_attribute(transform)
+        if not getattr(transform, 'accepts_buffers', False):
+            chunks = six.moves.map(bytes, chunks)
+        chunks = transform(chunks, name, **options)
+        content_type = getattr(transform, 'content_type', content_type)
+    transformed = File(ChunkedReader(ChunkedIO(chunks)), name=name)
+    # The size is unknown until the chunks are exhausted.
+    transformed.size = None
+    if content_type:
+        # The name stays the same, see FlacTranscoder.
+        transformed.content_type = content_type
+    return transformed
+
+
+def streams_uploads(storage):
+    """
+    Returns whether the given storage uploads transformed content as it's
+    streamed, without rewinding it or asking for its size, see
+    :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_STREAMING_STORAGES`.
+
+    :param storage: storage backend instance
+    :type storage: :class:`~django:django.core.files.storage.Storage`
+    :rtype: bool
+    """
+    for import_path in settings.QUEUED_STORAGE_STREAMING_STORAGES:
+        try:
+            storage_class = import_attribute(import_path)
+        except ImproperlyConfigured:
+            # Not installed, so not used either.
+            continue
+        if isinstance(storage, storage_class):
+            return True
+    return False
+
+
+def spool(content, max_size=None):
+    """
+    Returns a seekable copy of the given (transformed) content with a known
+    size, kept in memory up to ``max_size`` bytes and in a temporary file
+    beyond, for remote storages which can't upload streams.
+
+    :param content: the content to spool
+    :type content: :class:`~django:django.core.files.File`
+    :param max_size: the maximum number of bytes kept in memory (default
+        see :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_SPOOL_MAX_SIZE`)
+    :type max_size: int
+    :rtype: :class:`~django:django.core.files.File`
+    """
+    spooled = tempfile.SpooledTemporaryFile(
+        max_size=max_size or settings.QUEUED_STORAGE_SPOOL_MAX_SIZE)
+    shutil.copyfileobj(content, spooled, 64 * 1024)
+    size = spooled.tell()
+    spooled.seek(0)
+    result = File(spooled, name=content.name)
+    result.size = size
+    content_type = getattr(content, 'content_type', None)
+    if content_type:
+        result.content_type = content_type
+    return result
+
+
+def get_checksum_key(name):
+    return '%s_checksum_%s' % (settings.QUEUED_STORAGE_CACHE_PREFIX,
+                               urlquote(name))
+
+
+def get_checksum(name):
+    """
+    Returns the checksum of the file with the given name as computed by
+    the :func:`~queued_storage.transforms.checksum` transform during its
+    transfer, e.g. ``'md5:9b4e...'``, or ``None``.
+
+    :param name: file name
+    :type name: str
+    :rtype: str
+    """
+    return cache.get(get_checksum_key(name))
+
+
+@accepts_buffers
+def measure(chunks, name, stats, algorithm='md5'):
+    """
+    Records the size and checksum of the content as it passes without
+    changing it in the ``size`` and ``checksum`` items of the given
+    dictionary.
+    """
+    digest = hashlib.new(algorithm)
+    size = 0
+    for chunk in chunks:
+        digest.update(chunk)
+        size += len(chunk)
+        yield chunk
+    stats['size'] = size
+    stats['checksum'] = '%s:%s' % (algorithm, digest.hexdigest())
+
+
+def measure_file(content, stats, algorithm='md5'):
+    """
+    Records the size and checksum of the given file like
+    :func:`~queued_storage.transforms.measure` and rewinds it. Memory-mapped
+    files are hashed without copying their content.
+
+    :param content: the file to measure
+    :type content: :class:`~django:django.core.files.File`
+    :param stats: the dictionary to record the ``size`` and ``checksum`` in
+    :type stats: dict
+    """
+    chunks = getattr(content, 'buffers', content.chunks)()
+    for _ in measure(chunks, content.name, stats, algorithm):
+        pass
+    content.seek(0)
+
+
+@accepts_buffers
+def checksum(chunks, name, algorithm='md5'):
+    """
+    Computes a checksum of the content as it passes without changing it,
+    see :func:`~queued_storage.transforms.get_checksum`.
+    """
+    stats = {}
+    for chunk in measure(chunks, name, stats, algorithm):
+        yield chunk
+    cache.set(get_checksum_key(name), stats['checksum'], None)
+
+
+@accepts_buffers
+def strip_exif(chunks, name):
+    """
+    Removes the EXIF (APP1) segments from JPEG images. Other files are
+    passed on untouched.
+    """
+    if not name.lower().endswith(('.jpg', '.jpeg')):
+        for chunk in chunks:
+            yield chunk
+        return
+
+    stream = io.BufferedReader(ChunkedIO(chunks))
+    header = stream.read(2)
+    yield header
+    if header == b'\xff\xd8':
+        while True:
+            marker = stream.read(2)
+            if len(marker) < 2 or marker[:1] != b'\xff' or marker == b'\xff\xda':
+                # Not a JPEG after all, or the start of the image data.
+                yield marker
+                break
+            length = stream.read(2)
+            if len(length) < 2:
+                # Truncated, so there's nothing left to strip.
+                yield marker + length
+                break
+            segment = stream.read(max(0, six.indexbytes(length, 0) * 256 +
+                                      six.indexbytes(length, 1) - 2))
+            if marker != b'\xff\xe1':
+                yield marker + length + segment
+    while True:
+        data = stream.read(64 * 1024)
+        if not data:
+            break
+        yield data
+
+
+@accepts_buffers
+def pipe(chunks, name, args, chunk_size=64 * 1024):
+    """
+    Streams the given chunks through the stdin and stdout of a
+    subprocess with the given arguments, e.g. ``['gzip', '-c']``. Neither
+    the input nor the output is ever held in memory completely.
+
+    :raises: :class:`~python:subprocess.CalledProcessError` if the
+             subprocess fails
+    """
+    stderr = tempfile.TemporaryFile()
+    process = subprocess.Popen(args, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=stderr)
+
+    def feed():
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+        except (IOError, OSError):
+            # The subprocess exited early, its return code tells why.
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except (IOError, OSError):
+                pass
+
+    feeder = threading.Thread(target=feed)
+    feeder.daemon = True
+    feeder.start()
+    try:
+        while True:
+            data = process.stdout.read(chunk_size)
+            if not data:
+                break
+            yield data
+        feeder.join()
+        if process.wait() != 0:
+            stderr.seek(0)
+            raise subprocess.CalledProcessError(process.returncode, args,
+                                                stderr.read())
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        stderr.close()
+
+
+def _crc_table(polynomial, width):
+    top, mask = 1 << (width - 1), (1 << width) - 1
+    table = []
+    for byte in range(256):
+        crc = byte << (width - 8)
+        for _ in range(8):
+            crc = ((crc << 1) ^ polynomial if crc & top else crc << 1) & mask
+        table.append(crc)
+    return table
+
+
+_CRC8_TABLE = _crc_table(0x07, 8)
+_CRC16_TABLE = _crc_table(0x8005, 16)
+
+
+def _crc8(data):
+    crc = 0
+    for byte in bytearray(data):
+        crc = _CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def _crc16(data):
+    crc = 0
+    for byte in bytearray(data):
+        crc = ((crc << 8) & 0xffff) ^ _CRC16_TABLE[(crc >> 8) ^ byte]
+    return crc
+
+
+def _utf8_number(number):
+    # The "UTF-8" coding of frame numbers, which allows up to 36 bits.
+    if number < 0x80:
+        return bytearray([number])
+    continuation = []
+    while True:
+        continuation.insert(0, 0x80 | (number & 0x3f))
+        number >>= 6
+        # The bits left for the number in the first byte.
+        bits = 6 - len(continuation)
+        if number < 1 << bits:
+            lead = (0xff << (bits + 1)) & 0xff
+            return bytearray([lead | number] + continuation)
+
+
+def encode_flac(pcm, sample_rate, channels, block_size=4096):
+    """
+    Encodes 16-bit signed little-endian PCM samples to FLAC without
+    compressing them (in verbatim subframes), as a fallback if neither
+    ``ffmpeg`` nor ``sox`` is installed. The total number of samples and
+    the MD5 signature are left unknown in the header, so the samples are
+    streamed.
+
+    :param pcm: byte chunks of interleaved samples
+    :type pcm: iterable
+    :param sample_rate: the sample rate in Hz
+    :type sample_rate: int
+    :param channels: the number of channels (1 to 8)
+    :type channels: int
+    :param block_size: the number of samples per channel in a frame
+    :type block_size: int
+    """
+    yield b'fLaC'
+    # The only metadata block, STREAMINFO.
+    yield bytes(bytearray([0x80, 0, 0, 34]))
+    info = (sample_rate << 44) | ((channels - 1) << 41) | (15 << 36)
+    yield bytes(bytearray([block_size >> 8, block_size & 0xff] * 2 +
+                          [0] * 6 +
+                          [(info >> shift) & 0xff
+                           for shift in range(56, -8, -8)] +
+                          [0] * 16))
+
+    frame_size = block_size * channels * 2
+    buffered = bytearray()
+    number = 0
+    pcm = iter(pcm)
+    while True:
+        chunk = next(pcm, None)
+        if chunk is not None:
+            buffered.extend(chunk)
+            if len(buffered) < frame_size:
+                continue
+        if not buffered:
+            return
+        size = min(len(buffered), frame_size)
+        size -= size % (channels * 2)
+        if not size:
+            raise ValueError("Incomplete sample at the end of the audio.")
+        block, buffered = buffered[:size], buffered[size:]
+        samples = size // (channels * 2)
+        # The block size and sample size (16 bits) are given in the frame
+        # header, the sample rate in STREAMINFO.
+        frame = bytearray([0xff, 0xf8, 0x70, ((channels - 1) << 4) | 0x08])
+        frame += _utf8_number(number)
+        frame += bytearray([(samples - 1) >> 8, (samples - 1) & 0xff])
+        frame.append(_crc8(frame))
+        for channel in range(channels):
+            frame.append(0x02)
+            subframe = bytearray(samples * 2)
+            # Big-endian instead of little-endian samples.
+            subframe[0::2] = block[channel * 2 + 1::channels * 2]
+            subframe[1::2] = block[channel * 2::channels * 2]
+            frame += subframe
+        crc = _crc16(frame)
+        frame += bytearray([crc >> 8, crc & 0xff])
+        yield bytes(frame)
+        number += 1
+
+
+class FlacTranscoder(object):
+    """
+    A transform which converts audio files (e.g. WebM/Opus, WAV or
+    headerless raw PCM) to mono FLAC with a sample rate of 16 kHz on the
+    fly, using ``ffmpeg`` or ``sox``.
+
+    If neither is installed, raw and WAV files with 16-bit samples in the
+    sample rate and number of channels of the output are encoded without
+    compression by :func:`~queued_storage.transforms.encode_flac`, and
+    files which already are FLAC are passed on untouched. Other files fail
+    the transfer.
+
+    The file keeps its name in the remote storage, e.g. ``.webm``, since
+    the name is how the storage finds it. Remote storages which take the
+    content type of the uploaded file into account (like the ``boto3``
+    based Amazon S3 storage) store it as ``audio/flac``, others guess it
+    from the name.
+    """
+    #: The sample rate of the FLAC output.
+    sample_rate = int(SAMPLE_RATE)
+
+    #: The number of channels of the FLAC output.
+    channels = 1
+
+    #: The sample format, rate and number of channels of ``.raw`` files.
+    raw_format = ('s16le', 16000, 1)
+
+    #: The content type of the output.
+    content_type = 'audio/flac'
+
+    accepts_buffers = True
+
+    def get_command(self, name):
+        """
+        Returns the command to transcode the file with the given name, or
+        ``None`` if neither ``ffmpeg`` nor ``sox`` is available.
+        """
+        is_raw = name.lower().endswith('.raw')
+        ffmpeg = which('ffmpeg')
+        if ffmpeg:
+            args = [ffmpeg, '-loglevel', 'error']
+            if is_raw:
+                sample_format, rate, channels = self.raw_format
+                args += ['-f', sample_format, '-ar', str(rate),
+                         '-ac', str(channels)]
+            return args + ['-i', 'pipe:0', '-ac', str(self.channels),
+                           '-ar', str(self.sample_rate), '-f', 'flac',
+                           'pipe:1']
+        sox = which('sox')
+        if sox:
+            if is_raw:
+                sample_format, rate, channels = self.raw_format
+                args = [sox, '-t', 'raw', '-e', 'signed',
+                        '-b', sample_format[1:3], '-r', str(rate),
+                        '-c', str(channels)]
+            else:
+                args = [sox, '-t', name.rsplit('.', 1)[-1].lower()]
+            return args + ['-', '-t', 'flac', '-r', str(self.sample_rate),
+                           '-c', str(self.channels), '-']
+        return None
+
+    def encode(self, chunks, name):
+        """
+        Encodes the raw or WAV file with the given name to FLAC without
+        ``ffmpeg`` or ``sox``.
+
+        :raises: :class:`~python:ValueError` if that's not possible
+        """
+        lowered = name.lower()
+        if lowered.endswith('.raw'):
+            sample_format, rate, channels = self.raw_format
+            width = 2 if sample_format == 's16le' else None
+            pcm = chunks
+        elif lowered.endswith('.wav'):
+            try:
+                reader = wave.open(ChunkedReader(ChunkedIO(chunks)), 'rb')
+            except (wave.Error, EOFError) as e:
+                raise ValueError("Unable to read '%s': %s" % (name, e))
+            rate, channels = reader.getframerate(), reader.getnchannels()
+            width = reader.getsampwidth()
+            pcm = iter(lambda: reader.readframes(64 * 1024), b'')
+        else:
+            raise ValueError("Neither ffmpeg nor sox is installed to "
+                             "transcode '%s' to FLAC." % name)
+        if (width, rate, channels) != (2, self.sample_rate, self.channels):
+            raise ValueError("Neither ffmpeg nor sox is installed to "
+                             "resample '%s' to %d Hz, %d channel(s)." %
+                             (name, self.sample_rate, self.channels))
+        return encode_flac(pcm, rate, channels)
+
+    def __call__(self, chunks, name):
+        command = self.get_command(name)
+        if command is not None:
+            return pipe(chunks, name, command)
+        chunks = iter(chunks)
+        first = next(chunks, b'')
+        chunks = itertools.chain([first], chunks)
+        if bytes(first[:4]) == b'fLaC':
+            return chunks
+        return self.encode(chunks, name)
+
+
+#: A :class:`~queued_storage.transforms.FlacTranscoder` instance to be used
+#: as ``'queued_storage.transforms.to_flac'``.
+to_flac = FlacTranscoder()
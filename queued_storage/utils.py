@@ -1,14 +1,21 @@
 import io
+import os
 import re
 import six
+import threading
 
+from collections import OrderedDict
 from django.core.exceptions import ImproperlyConfigured
+from functools import partial
 from fuzzywuzzy import fuzz
 from google.cloud import speech, storage
 from importlib import import_module
+from multiprocessing.pool import ThreadPool
 
 from string import punctuation
 
+from .conf import settings
+
 
 CLOUD_STORAGE_BUCKET = 'irene-ai'
 SAMPLE_RATE = "16000"
@@ -34,24 +41,260 @@ def import_attribute(import_path=None, options=None):
             'Module "%s" does not define a "%s" class.' % (module, classname))
 
 
-def upload_file_to_gcs(filename):
+# Storage backend instances shared by the tasks of a worker process, see
+# get_backend. Like the Cloud Storage client below they're dropped after
+# a fork.
+_backends_lock = threading.Lock()
+_backends_pid = None
+_backends = {}
+
+
+def get_backend(import_path, options=None):
+    """
+    Returns an instance of the storage backend with the given dotted import
+    path and options. Instances are shared within the current process, so
+    that the clients and connection pools of remote backends are reused
+    from one transfer to the next.
+    """
+    global _backends_pid, _backends
+    options = options or {}
+    key = (import_path, repr(sorted(options.items())))
+    pid = os.getpid()
+    with _backends_lock:
+        if _backends_pid != pid:
+            _backends = {}
+            _backends_pid = pid
+        try:
+            return _backends[key]
+        except KeyError:
+            backend = _backends[key] = import_attribute(import_path)(**options)
+            return backend
+
+
+def reset_backends():
+    """
+    Drops the storage backend instances shared by
+    :func:`~queued_storage.utils.get_backend`.
+    """
+    global _backends_pid, _backends
+    with _backends_lock:
+        _backends_pid, _backends = None, {}
+
+
+def get_stat_key(cache_key):
+    """
+    Returns the cache key of the metadata of the file with the given cache
+    key, see :meth:`~queued_storage.backends.QueuedStorage.stat`.
+    """
+    return '%s:stat' % cache_key
+
+
+def get_in_flight_key(cache_key):
+    """
+    Returns the cache key marking the transfer of the file with the given
+    cache key as queued, see
+    :meth:`~queued_storage.backends.QueuedStorage.transfer`.
+    """
+    return '%s:in_flight' % cache_key
+
+
+def get_deletion_key(cache_key):
+    """
+    Returns the cache key marking the remote file with the given cache key
+    as being deleted, which keeps its name taken until it's gone, see
+    :meth:`~queued_storage.backends.QueuedStorage.delete_many`.
+    """
+    return '%s:deleting' % cache_key
+
+
+def get_lease_key(cache_key):
+    """
+    Returns the cache key of the lease a worker holds on the file with the
+    given cache key while transferring it, see
+    :class:`~queued_storage.leases.Lease`.
+    """
+    return '%s:lease' % cache_key
+
+
+def get_migration_key(cache_key):
+    """
+    Returns the cache key recording whether the remote file with the given
+    cache key has been migrated from the previous remote storage, see
+    :mod:`~queued_storage.migration`.
+    """
+    return '%s:migrated' % cache_key
+
+
+class LRUIndex(object):
+    """
+    A thread-safe index of file sizes by name, ordered from the least to
+    the most recently used, which keeps track of how many bytes exceed the
+    given maximum size.
+
+    :param max_size: the maximum total size in bytes
+    :type max_size: int
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        #: The total size of the indexed files in bytes.
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def touch(self, name, size=None):
+        """
+        Marks the file with the given name as the most recently used one,
+        adding it with the given size if it's not indexed yet.
+
+        :returns: whether the file was indexed before
+        :rtype: bool
+        """
+        with self._lock:
+            known = name in self._entries
+            if known:
+                size = self._entries.pop(name)
+            elif size is None:
+                return False
+            else:
+                self.size += size
+            self._entries[name] = size
+            return known
+
+    def reset(self, entries):
+        """
+        Replaces the indexed files with the given ``(name, size)`` pairs,
+        from the least to the most recently used.
+        """
+        with self._lock:
+            self._entries = OrderedDict(entries)
+            self.size = sum(self._entries.values())
+
+    def discard(self, name):
+        """
+        Removes the file with the given name from the index.
+        """
+        with self._lock:
+            self.size -= self._entries.pop(name, 0)
+
+    def pop_excess(self, keep=None):
+        """
+        Removes the least recently used files from the index until the
+        total size doesn't exceed the maximum anymore and returns their
+        names. The file with the name given as ``keep`` is never removed.
+
+        :rtype: list
+        """
+        excess = []
+        with self._lock:
+            for name in list(self._entries):
+                if self.size <= self.max_size:
+                    break
+                if name == keep:
+                    continue
+                self.size -= self._entries.pop(name)
+                excess.append(name)
+        return excess
+
+
+# The Cloud Storage client and bucket handles are shared by all uploads
+# in a process, guarded by the pid so a forked (Celery prefork) worker
+# never reuses the HTTP session of its parent.
+_gcs_lock = threading.Lock()
+_gcs_pid = None
+_gcs_client = None
+_gcs_buckets = {}
+
+
+def get_gcs_client():
+    """
+    Returns the Cloud Storage client of the current process, creating it
+    lazily on first use and again after a fork.
+    """
+    global _gcs_pid, _gcs_client, _gcs_buckets
+    pid = os.getpid()
+    if _gcs_pid != pid:
+        with _gcs_lock:
+            if _gcs_pid != pid:
+                _gcs_buckets = {}
+                _gcs_client = storage.Client()
+                _gcs_pid = pid
+    return _gcs_client
+
+
+def get_gcs_bucket(bucket_name=None):
+    """
+    Returns a cached handle to the bucket with the given name. Unlike
+    ``Client.get_bucket`` this doesn't fetch the bucket metadata, so it
+    doesn't cost a round trip.
+    """
+    bucket_name = bucket_name or CLOUD_STORAGE_BUCKET
+    client = get_gcs_client()
+    try:
+        return _gcs_buckets[bucket_name]
+    except KeyError:
+        bucket = _gcs_buckets[bucket_name] = client.bucket(bucket_name)
+        return bucket
+
+
+def reset_gcs_client():
+    """
+    Drops the cached client and bucket handles, e.g. after changing
+    credentials.
+    """
+    global _gcs_pid, _gcs_client, _gcs_buckets
+    with _gcs_lock:
+        _gcs_pid, _gcs_client, _gcs_buckets = None, None, {}
+
+
+def gcs_uri(bucket_name, name):
     """
-    Uploads a file to a given Cloud Storage bucket and returns the public url
-    to the new object.
+    Returns the ``gs://`` URI of the object with the given name.
     """
+    uri = "gs://" + bucket_name + "/" + name
+    if isinstance(uri, six.binary_type):
+        uri = uri.decode('utf-8')
+    return uri
 
-    storage_client = storage.Client()
-    bucket = storage_client.get_bucket(CLOUD_STORAGE_BUCKET)
 
-    blob = bucket.blob(filename)
+def upload_file_to_gcs(filename, bucket_name=None, chunk_size=None):
+    """
+    Uploads a file to a given Cloud Storage bucket and returns the ``gs://``
+    URI of the new object. Files larger than a single request are uploaded
+    with a resumable upload in chunks of ``chunk_size`` bytes (default see
+    :attr:`~queued_storage.conf.settings.QUEUED_STORAGE_GCS_CHUNK_SIZE`).
+    """
+    bucket = get_gcs_bucket(bucket_name)
+    blob = bucket.blob(filename, chunk_size=(
+        chunk_size or settings.QUEUED_STORAGE_GCS_CHUNK_SIZE))
     blob.upload_from_filename(filename)
+    return gcs_uri(bucket.name, filename)
 
-    # url = blob.public_url
-    url = "gs://"+CLOUD_STORAGE_BUCKET+"/"+filename
 
-    if isinstance(url, six.binary_type):
-        url = url.decode('utf-8')
-    return url
+def upload_files_to_gcs(filenames, bucket_name=None, chunk_size=None,
+                        workers=None):
+    """
+    Uploads many files concurrently over the shared client and returns
+    their ``gs://`` URIs in the same order.
+    """
+    filenames = list(filenames)
+    if not filenames:
+        return []
+    # Create the client and bucket handle before spawning the threads.
+    get_gcs_bucket(bucket_name)
+    workers = workers or settings.QUEUED_STORAGE_GCS_UPLOAD_WORKERS
+    pool = ThreadPool(min(workers, len(filenames)))
+    try:
+        return pool.map(partial(upload_file_to_gcs, bucket_name=bucket_name,
+                                chunk_size=chunk_size), filenames)
+    finally:
+        pool.close()
+        pool.join()
 
 #
 # def convert_webm(webm_file_path):
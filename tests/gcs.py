@@ -0,0 +1,185 @@
+"""
+A tiny in-memory stand-in for the ``google.cloud.storage`` client, so the
+Cloud Storage code paths can be tested without network access or
+credentials.
+"""
+import datetime
+
+from django.utils import timezone
+
+
+class FakeBlob(object):
+    updated = datetime.datetime(2020, 1, 2, tzinfo=timezone.utc)
+    time_created = datetime.datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+    def __init__(self, name, bucket, chunk_size=None):
+        self.name = name
+        self.bucket = bucket
+        self.chunk_size = chunk_size
+
+    @property
+    def size(self):
+        return len(self.bucket.objects[self.name])
+
+    def upload_from_filename(self, filename, content_type=None, **kwargs):
+        with open(filename, 'rb') as fp:
+            self.upload_from_file(fp, content_type=content_type)
+
+    def upload_from_file(self, file_obj, rewind=False, size=None,
+                         content_type=None, **kwargs):
+        if rewind:
+            file_obj.seek(0)
+        self.bucket.client.uploads.append((self.name, self.chunk_size))
+        self.bucket.objects[self.name] = file_obj.read()
+
+    def download_as_bytes(self, start=None, end=None, **kwargs):
+        self.bucket.client.downloads.append((self.name, start, end))
+        content = self.bucket.objects[self.name]
+        return content[start or 0:None if end is None else end + 1]
+
+    def generate_signed_url(self, expiration=None, **kwargs):
+        signatures = self.bucket.client.signatures
+        signatures.append((self.name, expiration))
+        return 'https://signed/%s/%s?signature=%d' % (
+            self.bucket.name, self.name, len(signatures))
+
+
+class FakePage(list):
+    prefixes = ()
+
+
+class FakeIterator(object):
+
+    def __init__(self, pages):
+        self.pages = iter(pages)
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeBatch(object):
+    """
+    Collects the responses to the requests made in its context, sent once
+    when leaving it unless already sent with ``finish``.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.responses = []
+        self.sent = False
+
+    def __enter__(self):
+        self.client.batching = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.finish()
+        finally:
+            self.client.batching = None
+
+    def finish(self, raise_exception=True):
+        if self.sent:
+            raise AssertionError("batch sent twice")
+        self.sent = True
+        self.client.batches += 1
+        return list(self.responses)
+
+
+class FakeBucket(object):
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.objects = client.objects.setdefault(name, {})
+
+    def blob(self, name, chunk_size=None):
+        return FakeBlob(name, self, chunk_size=chunk_size)
+
+    def get_blob(self, name, chunk_size=None, **kwargs):
+        if name in self.objects:
+            return self.blob(name, chunk_size=chunk_size)
+        return None
+
+    def list_blobs(self, prefix='', delimiter=None, page_size=None, **kwargs):
+        names = sorted(name for name in self.objects if name.startswith(prefix))
+        blobs, prefixes = [], []
+        for name in names:
+            rest = name[len(prefix):]
+            if delimiter and delimiter in rest:
+                dir_prefix = prefix + rest.split(delimiter, 1)[0] + delimiter
+                if dir_prefix not in prefixes:
+                    prefixes.append(dir_prefix)
+            else:
+                blobs.append(self.blob(name))
+        page_size = page_size or 1000
+        pages = []
+        for start in range(0, max(len(blobs), 1), page_size):
+            page = FakePage(blobs[start:start + page_size])
+            page.prefixes = prefixes if not pages else []
+            pages.append(page)
+        self.client.listings.append((prefix, len(pages)))
+        return FakeIterator(pages)
+
+    def copy_blob(self, blob, destination_bucket, new_name=None, **kwargs):
+        self.client.copies.append((blob.name, destination_bucket.name,
+                                   new_name))
+        destination_bucket.objects[new_name or blob.name] = \
+            self.objects[blob.name]
+
+    def delete_blob(self, name, **kwargs):
+        self.objects.pop(name, None)
+
+    def delete_blobs(self, blobs, on_error=None, **kwargs):
+        self.client.deletes.append((list(blobs),
+                                    self.client.batching is not None))
+        for name in blobs:
+            if name in self.client.forbidden:
+                status = 403
+            elif self.objects.pop(name, None) is None:
+                status = 404
+            else:
+                status = 204
+            if self.client.batching:
+                self.client.batching.responses.append(FakeResponse(status))
+
+
+class FakeClient(object):
+    """
+    Keeps track of how often it was instantiated and which uploads and
+    downloads it handled; ``get_bucket`` isn't supported on purpose since
+    it would cost a metadata round trip.
+    """
+    instances = []
+    objects = {}
+    forbidden = set()
+
+    def __init__(self, *args, **kwargs):
+        self.uploads = []
+        self.downloads = []
+        self.deletes = []
+        self.copies = []
+        self.signatures = []
+        self.listings = []
+        self.batching = None
+        self.batches = 0
+        self.instances.append(self)
+
+    def bucket(self, name):
+        return FakeBucket(self, name)
+
+    def batch(self, raise_exception=True):
+        return FakeBatch(self)
+
+    def get_bucket(self, name):
+        raise AssertionError("get_bucket fetches the bucket metadata")
+
+    @classmethod
+    def reset(cls):
+        cls.instances = []
+        cls.objects = {}
+        cls.forbidden = set()
@@ -6,5 +6,12 @@ from queued_storage.fields import QueuedFileField
 class TestModel(models.Model):
     testfile = models.FileField(upload_to='test', null=True)
     remote = QueuedFileField(upload_to='test', null=True)
+    tracked = QueuedFileField(upload_to='test', null=True, track_state=True)
 
     retried = False
+
+
+class ProxyTestModel(TestModel):
+
+    class Meta:
+        proxy = True
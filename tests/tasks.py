@@ -1,4 +1,4 @@
-from queued_storage.tasks import Transfer
+from queued_storage.tasks import Transcribe, Transfer, TransferAndTranscribe
 from queued_storage.utils import import_attribute
 
 from .models import TestModel
@@ -30,3 +30,65 @@ class RetryingTask(Transfer):
         else:
             TestModel.retried = True
             return False
+
+
+class StubOperation(object):
+    """
+    A long running operation which is done after being polled twice.
+    """
+    def __init__(self, client, uri):
+        self.client = client
+        self.uri = uri
+        self.polls = 0
+
+    def done(self):
+        self.polls += 1
+        if self.polls < 2:
+            return False
+        self.client.in_flight.discard(self)
+        return True
+
+    def result(self):
+        if 'broken' in self.uri:
+            raise ValueError("Unable to decode '%s'" % self.uri)
+        words = [type('WordInfo', (), {'word': word})
+                 for word in ['hello', 'world']]
+        alternative = type('Alternative', (), {'transcript': 'hello ,world',
+                                               'words': words})
+        result = type('Result', (), {'alternatives': [alternative]})
+        return type('Response', (), {'results': [result]})
+
+
+class StubSpeechClient(object):
+    max_in_flight = 0
+    requests = []
+
+    def __init__(self):
+        self.in_flight = set()
+
+    def long_running_recognize(self, config, audio):
+        operation = StubOperation(self, audio['uri'])
+        self.in_flight.add(operation)
+        StubSpeechClient.requests.append((config, audio))
+        StubSpeechClient.max_in_flight = max(StubSpeechClient.max_in_flight,
+                                             len(self.in_flight))
+        return operation
+
+
+class StubTranscribe(Transcribe):
+    speech_client = 'tests.tasks.StubSpeechClient'
+    max_in_flight = 2
+    poll_interval = 0
+
+
+class TransferAndStubTranscribe(TransferAndTranscribe):
+    transcribe_task = 'tests.tasks.StubTranscribe'
+
+
+def upper(chunks, name):
+    for chunk in chunks:
+        yield chunk.upper()
+
+
+class UpperTransfer(Transfer):
+    transforms = ['tests.tasks.upper']
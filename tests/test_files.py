@@ -0,0 +1,266 @@
+import io
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.test import TestCase
+
+from queued_storage.backends import QueuedGCSStorage, QueuedStorage
+from queued_storage.files import (GCSRangeReader, LocalRangeReader,
+                                  MappedFile, StorageRangeReader, copy_file,
+                                  delete_files, get_range_reader,
+                                  iter_listdir, open_mapped)
+from queued_storage.transforms import accepts_buffers, apply_transforms
+
+from .gcs import FakeBlob, FakeClient
+
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
+
+class RangedFileTests(TestCase):
+
+    def setUp(self):
+        self.local_dir = tempfile.mkdtemp()
+        self.remote_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.local_dir)
+        self.addCleanup(shutil.rmtree, self.remote_dir)
+        self.content = bytes(bytearray(range(256))) * 4
+
+    def test_local_range(self):
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            delayed=True)
+        name = storage.save('data.bin', ContentFile(self.content))
+        self.assertIsInstance(get_range_reader(storage.local, name),
+                              LocalRangeReader)
+
+        with storage.open_range(name, 100, 200) as content:
+            self.assertEqual(content.read(10), self.content[100:110])
+            content.seek(-5, io.SEEK_END)
+            self.assertEqual(content.read(), self.content[195:200])
+            self.assertEqual(content.read(), b'')
+            content.seek(0)
+            self.assertEqual(content.read(), self.content[100:200])
+
+        with storage.open_range(name, 1000) as content:
+            self.assertEqual(content.size, 24)
+            self.assertEqual(content.read(), self.content[1000:])
+
+    def test_remote_fallback(self):
+        storage = FileSystemStorage(location=self.remote_dir)
+        name = storage.save('data.bin', ContentFile(self.content))
+        # Pretend the storage is remote.
+        with mock.patch.object(storage, 'path',
+                               side_effect=NotImplementedError):
+            reader = get_range_reader(storage, name)
+        self.assertIsInstance(reader, StorageRangeReader)
+        self.assertEqual(reader.size(), len(self.content))
+        self.assertEqual(reader.read(10, 20), self.content[10:20])
+        reader.close()
+
+    def test_gcs_range(self):
+        """
+        Make sure only the read bytes are downloaded, in requests of at
+        least the read-ahead size.
+        """
+        FakeClient.reset()
+        with mock.patch('storages.backends.gcloud.Client', FakeClient), \
+                mock.patch('storages.backends.gcloud.Blob', FakeBlob):
+            storage = QueuedGCSStorage(
+                local_options=dict(location=self.local_dir),
+                remote_options=dict(bucket_name='audio', location='media'),
+                delayed=True)
+            FakeClient.objects['audio'] = {'media/a.flac': self.content}
+            self.assertTrue(storage.using_remote('a.flac'))
+            self.assertIsInstance(get_range_reader(storage.remote, 'a.flac'),
+                                  GCSRangeReader)
+
+            with storage.open_range('a.flac', 4, read_ahead=64) as content:
+                self.assertEqual(content.read(4), self.content[4:8])
+                self.assertEqual(content.read(4), self.content[8:12])
+                content.seek(500)
+                self.assertEqual(content.read(10), self.content[504:514])
+
+        client = FakeClient.instances[-1]
+        self.assertEqual(client.downloads, [('media/a.flac', 4, 67),
+                                            ('media/a.flac', 504, 567)])
+
+
+class MappedFileTests(TestCase):
+
+    def setUp(self):
+        self.local_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.local_dir)
+        self.storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.local_dir),
+            delayed=True)
+
+    def test_mapped_chunks(self):
+        """
+        Make sure local files are mapped and chunked without copies.
+        """
+        name = self.storage.save('data.bin', ContentFile(b'xxxx\nxxxxx\n'))
+        with mock.patch.object(self.storage, 'get_storage',
+                               return_value=self.storage.local):
+            content = self.storage.open_mapped(name)
+        self.assertIsInstance(content, MappedFile)
+        self.assertEqual(content.size, 11)
+        buffers = list(content.buffers(chunk_size=4))
+        self.assertTrue(all(isinstance(buffer, memoryview)
+                            for buffer in buffers))
+        self.assertEqual(b''.join(buffers), b'xxxx\nxxxxx\n')
+        self.assertEqual(list(content.chunks(chunk_size=4)),
+                         [b'xxxx', b'\nxxx', b'xx\n'])
+        self.assertEqual(list(content), [b'xxxx\n', b'xxxxx\n'])
+        content.seek(9)
+        self.assertEqual(content.read(), b'x\n')
+        del buffers
+        content.close()
+        self.assertTrue(content.closed)
+
+        empty = open_mapped(self.storage.local,
+                            self.storage.save('empty.bin', ContentFile(b'')))
+        self.assertNotIsInstance(empty, MappedFile)
+        empty.close()
+
+    def test_buffer_transforms(self):
+        """
+        Make sure only transforms accepting buffers get memoryviews.
+        """
+        received = []
+
+        def plain(chunks, name):
+            for chunk in chunks:
+                received.append(type(chunk))
+                yield chunk
+
+        @accepts_buffers
+        def buffered(chunks, name):
+            return plain(chunks, name)
+
+        name = self.storage.save('data.bin', ContentFile(b'data'))
+        content = apply_transforms(open_mapped(self.storage.local, name),
+                                   name, [buffered, plain])
+        self.assertEqual(content.read(), b'data')
+        self.assertEqual(received, [memoryview, bytes])
+
+
+class DeleteFilesTests(TestCase):
+
+    def test_gcs_batch_delete(self):
+        FakeClient.reset()
+        with mock.patch('storages.backends.gcloud.Client', FakeClient):
+            storage = QueuedGCSStorage(
+                remote_options=dict(bucket_name='audio', location='media'))
+            FakeClient.objects['audio'] = dict(
+                ('media/%d.flac' % i, b'audio') for i in range(3))
+            failed = delete_files(storage.remote,
+                                  ['%d.flac' % i for i in range(3)],
+                                  batch_size=2)
+
+        self.assertEqual(failed, [])
+        self.assertEqual(FakeClient.objects['audio'], {})
+        self.assertEqual(FakeClient.instances[-1].deletes, [
+            (['media/0.flac', 'media/1.flac'], True),
+            (['media/2.flac'], True),
+        ])
+        self.assertEqual(FakeClient.instances[-1].batches, 2)
+
+    def test_gcs_batch_errors(self):
+        FakeClient.reset()
+        with mock.patch('storages.backends.gcloud.Client', FakeClient):
+            storage = QueuedGCSStorage(
+                remote_options=dict(bucket_name='audio', location='media'))
+            FakeClient.objects['audio'] = {'media/0.flac': b'audio',
+                                           'media/1.flac': b'audio'}
+            FakeClient.forbidden.add('media/1.flac')
+            failed = delete_files(storage.remote,
+                                  ['0.flac', '1.flac', '2.flac'])
+
+        # Missing files count as deleted, refused ones don't.
+        self.assertEqual(failed, ['1.flac'])
+        self.assertEqual(FakeClient.objects['audio'],
+                         {'media/1.flac': b'audio'})
+
+    def test_failed_deletes(self):
+        storage = mock.Mock(spec=['delete'])
+        storage.delete.side_effect = [None, IOError("gone fishing")]
+        self.assertEqual(delete_files(storage, ['a', 'b']), ['b'])
+
+    def test_failed_s3_deletes(self):
+        storage = mock.Mock(spec=['bucket', 'location'], location='media',
+                            bucket=mock.Mock(spec=['delete_objects']))
+        storage.bucket.delete_objects.side_effect = [
+            {'Errors': [{'Key': 'media/b'}]},
+            IOError("gone fishing"),
+        ]
+        self.assertEqual(delete_files(storage, ['a', 'b', 'c'],
+                                      batch_size=2), ['b', 'c'])
+
+
+class ListdirTests(TestCase):
+
+    def test_gcs_pages(self):
+        FakeClient.reset()
+        with mock.patch('storages.backends.gcloud.Client', FakeClient):
+            storage = QueuedGCSStorage(
+                remote_options=dict(bucket_name='audio', location='media'))
+            FakeClient.objects['audio'] = {
+                'media/audios/a.flac': b'',
+                'media/audios/b.flac': b'',
+                'media/audios/c.flac': b'',
+                'media/audios/old/d.flac': b'',
+                'media/texts/a.txt': b'',
+            }
+            pages = list(iter_listdir(storage.remote, 'audios', page_size=2))
+            self.assertEqual(pages, [(['old'], ['a.flac', 'b.flac']),
+                                     ([], ['c.flac'])])
+            self.assertEqual(list(iter_listdir(storage.remote, '')),
+                             [(['audios', 'texts'], [])])
+
+
+class CopyFileTests(TestCase):
+
+    def setUp(self):
+        self.source_dir = tempfile.mkdtemp()
+        self.target_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.source_dir)
+        shutil.rmtree(self.target_dir)
+
+    def test_gcs_server_side_copy(self):
+        FakeClient.reset()
+        with mock.patch('storages.backends.gcloud.Client', FakeClient):
+            storage = QueuedGCSStorage(
+                remote_options=dict(bucket_name='new', location='media'),
+                previous_remote='storages.backends.gcloud.GoogleCloudStorage',
+                previous_remote_options=dict(bucket_name='old'))
+            FakeClient.objects['old'] = {'a.flac': b'audio'}
+            self.assertTrue(copy_file(storage.previous_remote,
+                                      storage.remote, 'a.flac'))
+        self.assertEqual(FakeClient.objects['new'],
+                         {'media/a.flac': b'audio'})
+        client = storage.previous_remote.client
+        self.assertEqual(client.copies, [('a.flac', 'new', 'media/a.flac')])
+        self.assertEqual(client.downloads, [])
+
+    def test_streamed_copy(self):
+        source = FileSystemStorage(location=self.source_dir)
+        target = FileSystemStorage(location=self.target_dir)
+        source.save('dir/a.txt', ContentFile(b'new data'))
+        target.save('dir/a.txt', ContentFile(b'stale'))
+        self.assertFalse(copy_file(source, target, 'dir/a.txt'))
+        with target.open('dir/a.txt') as fp:
+            self.assertEqual(fp.read(), b'new data')
+        self.assertEqual(target.listdir('dir'), ([], ['a.txt']))
@@ -8,20 +8,49 @@ remote storage systems.
 import os
 import shutil
 import tempfile
+import time
 from os import path
 from datetime import datetime
 from packaging import version
 from packaging.specifiers import SpecifierSet
 
 import django
-from django.core.files.base import File
+import six
+from django.core.cache import cache
+from django.core.files.base import ContentFile, File
 from django.core.files.storage import FileSystemStorage, Storage
-from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
 
-from queued_storage.backends import QueuedStorage
+from queued_storage import utils
+from queued_storage.access import CountMinSketch
+from queued_storage.backends import (QueuedGCSStorage, QueuedStorage,
+                                     get_queued_storage)
 from queued_storage.conf import settings
+from queued_storage.executors import SyncExecutor
+from queued_storage.fields import prefetch_storage_locations
+from queued_storage.journal import drain_journal, get_journal
+from queued_storage.files import STAT_FIELDS
+from queued_storage.leases import Lease
+from queued_storage.migration import (migrate_files, verify_migration,
+                                      walk_files)
+from queued_storage.tiering import match_policy
+from queued_storage.signals import file_transferred, files_transferred
+from queued_storage.tasks import (SendTransferSignals, TransferBatch,
+                                  cache_file_stats)
+from queued_storage.transcription import (RecognitionScheduler,
+                                          realign_punctuation)
+from queued_storage.transforms import get_checksum, streams_uploads
+from queued_storage.utils import get_lease_key, get_stat_key
 
-from . import models
+from . import models, tasks
+from .gcs import FakeBlob, FakeClient
+
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
 
 DJANGO_VERSION = django.get_version()
 
@@ -32,6 +61,9 @@ class StorageTests(TestCase):
         self.old_celery_always_eager = getattr(
             settings, 'CELERY_ALWAYS_EAGER', False)
         settings.CELERY_ALWAYS_EAGER = True
+        # The storages of all tests share the cache prefix but not the
+        # directories.
+        cache.clear()
         self.local_dir = tempfile.mkdtemp()
         self.remote_dir = tempfile.mkdtemp()
         tmp_dir = tempfile.mkdtemp()
@@ -283,3 +315,1151 @@ class StorageTests(TestCase):
         self.assertTrue(result)
         self.assertTrue(path.isfile(path.join(self.remote_dir,
                                               obj.remote.name)))
+
+    def test_gcs_storage(self):
+        """
+        Make sure files are streamed to Cloud Storage in chunks over a
+        client that's shared between transfers.
+        """
+        FakeClient.reset()
+        utils.reset_backends()
+        self.addCleanup(utils.reset_backends)
+        with mock.patch('storages.backends.gcloud.Client', FakeClient), \
+                mock.patch('storages.backends.gcloud.Blob', FakeBlob):
+            storage = QueuedGCSStorage(
+                local_options=dict(location=self.local_dir),
+                remote_options=dict(bucket_name='audio'))
+            field = models.TestModel._meta.get_field('testfile')
+            self.addCleanup(setattr, field, 'storage', field.storage)
+            field.storage = storage
+
+            for i in range(2):
+                obj = models.TestModel()
+                obj.testfile.save(self.test_file_name, File(self.test_file))
+                self.assertTrue(obj.testfile.storage.result.get())
+
+        self.assertEqual(len(FakeClient.instances), 1)
+        client = FakeClient.instances[0]
+        self.assertEqual(
+            [chunk_size for name, chunk_size in client.uploads],
+            [settings.QUEUED_STORAGE_GCS_CHUNK_SIZE] * 2)
+        self.assertEqual(FakeClient.objects['audio'][obj.testfile.name], b'test')
+        self.assertEqual(storage.uri(obj.testfile.name),
+                         'gs://audio/%s' % obj.testfile.name)
+
+    def test_transfer_and_transcribe(self):
+        """
+        Make sure transferred audio files are transcribed to ``texts/``.
+        """
+        tasks.StubSpeechClient.requests = []
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            task='tests.tasks.TransferAndStubTranscribe')
+
+        name = storage.save('audios/answer_lang_de-DE.flac',
+                            ContentFile(b'fLaC audio'))
+        self.assertTrue(storage.result.get())
+
+        self.assertFalse(path.isfile(path.join(self.local_dir, name)))
+        with open(path.join(self.remote_dir, 'texts', 'answer_lang_de-DE.txt')) as text:
+            self.assertEqual(text.read(), 'hello, world')
+        config, audio = tasks.StubSpeechClient.requests[0]
+        self.assertEqual(config['language_code'], 'de-DE')
+        self.assertEqual(audio['uri'], storage.remote.url(name))
+
+        # Transcribing again replaces the transcript.
+        self.assertEqual(
+            tasks.StubTranscribe().run(
+                [name], storage.remote_path, storage.remote_options),
+            ['texts/answer_lang_de-DE.txt'])
+        self.assertEqual(os.listdir(path.join(self.remote_dir, 'texts')),
+                         ['answer_lang_de-DE.txt'])
+
+    def test_transfer_many_and_transcribe(self):
+        """
+        Make sure files transferred in batches are transcribed too, with
+        the executor of the storage, and Cloud Storage URIs include the
+        location of the remote storage.
+        """
+        tasks.StubSpeechClient.requests = []
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            task='tests.tasks.TransferAndStubTranscribe',
+            executor='queued_storage.executors.SyncExecutor', delayed=True)
+
+        names = [storage.save('audios/%s.flac' % i,
+                              ContentFile(b'fLaC audio'))
+                 for i in range(2)]
+        with mock.patch.object(tasks.StubTranscribe, 'delay') as delay:
+            self.assertEqual(storage.transfer_many(names), 2)
+        self.assertFalse(delay.called)
+        for i in range(2):
+            with open(path.join(self.remote_dir, 'texts', '%s.txt' % i)) as text:
+                self.assertEqual(text.read(), 'hello, world')
+
+        remote = mock.Mock(bucket_name='audio', location='media')
+        self.assertEqual(tasks.StubTranscribe().get_uri('audios/0.flac', remote),
+                         'gs://audio/media/audios/0.flac')
+
+    def test_realign_punctuation(self):
+        """
+        Make sure the punctuation of transcripts is moved to the recognized
+        words.
+        """
+        self.assertEqual(
+            realign_punctuation("Its fine, thanks. How are you?",
+                                ["it's", 'fine', 'thanks', 'how', 'are', 'you']),
+            "it's fine, thanks. how are you?")
+        self.assertEqual(realign_punctuation('hello ,world'), 'hello, world')
+
+    def test_transcribe_in_flight_limit(self):
+        """
+        Make sure no more than ``max_in_flight`` recognitions run at once
+        and failed ones are reported.
+        """
+        client = tasks.StubSpeechClient()
+        tasks.StubSpeechClient.max_in_flight = 0
+        scheduler = RecognitionScheduler(client, max_in_flight=2,
+                                         poll_interval=0)
+        requests = [(i, {}, 'gs://audio/%s.flac' % i) for i in range(4)]
+        requests.append((4, {}, 'gs://audio/broken.flac'))
+
+        keys = [key for key, response in scheduler.run(requests)]
+        self.assertEqual(sorted(keys), [0, 1, 2, 3])
+        self.assertEqual(list(scheduler.failed), [4])
+        self.assertEqual(tasks.StubSpeechClient.max_in_flight, 2)
+
+    def test_transfer_transforms(self):
+        """
+        Make sure the transforms of the task are applied during the transfer.
+        """
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            task='tests.tasks.UpperTransfer')
+
+        name = storage.save(self.test_file_name, File(self.test_file))
+        self.assertTrue(storage.result.get())
+        with open(path.join(self.local_dir, name)) as local_file:
+            self.assertEqual(local_file.read(), 'test')
+        with open(path.join(self.remote_dir, name)) as remote_file:
+            self.assertEqual(remote_file.read(), 'TEST')
+
+    def test_storage_transforms(self):
+        """
+        Make sure the transforms of the storage are applied after the ones
+        of the task.
+        """
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            task='tests.tasks.UpperTransfer',
+            transforms=[('queued_storage.transforms.pipe', {'args': ['rev']}),
+                        'queued_storage.transforms.checksum'])
+
+        name = storage.save(self.test_file_name, File(self.test_file))
+        self.assertTrue(storage.result.get())
+        with open(path.join(self.remote_dir, name)) as remote_file:
+            self.assertEqual(remote_file.read(), 'TSET')
+        self.assertEqual(get_checksum(name),
+                         'md5:8d42b1688666dbe7636e8fa64cd09ef5')
+
+    def test_transfer_queryset(self):
+        """
+        Make sure the distinct files of a queryset are transferred in batches.
+        """
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            delayed=True)
+        field = models.TestModel._meta.get_field('remote')
+        self.addCleanup(setattr, field, 'storage', field.storage)
+        field.storage = storage
+
+        names = [storage.save('test/%d.txt' % i, File(self.test_file))
+                 for i in range(5)]
+        for name in names + names[:2]:
+            models.TestModel.objects.create(remote=name)
+        models.TestModel.objects.create()
+
+        progress = []
+        queued = field.transfer_queryset(models.TestModel.objects.all(),
+                                         batch_size=2, progress=progress.append)
+        self.assertEqual(queued, 5)
+        self.assertEqual(progress, [2, 4, 5])
+        for name in names:
+            self.assertTrue(path.isfile(path.join(self.remote_dir, name)))
+            self.assertTrue(storage.using_remote(name))
+
+    def test_field_file_url_memoized(self):
+        """
+        Make sure the storage location and URL are resolved once per
+        field file, and with a single cache query when prefetched.
+        """
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir))
+        field = models.TestModel._meta.get_field('remote')
+        self.addCleanup(setattr, field, 'storage', field.storage)
+        field.storage = storage
+
+        for i in range(3):
+            obj = models.TestModel()
+            obj.remote.save('%d.txt' % i, File(self.test_file))
+
+        with mock.patch.object(storage, 'get_storage',
+                               wraps=storage.get_storage) as get_storage:
+            obj = models.TestModel.objects.get(remote='test/0.txt')
+            self.assertEqual(obj.remote.url, obj.remote.url)
+            self.assertEqual(get_storage.call_count, 1)
+            self.assertIs(obj.remote.get_storage(), storage.remote)
+
+            with mock.patch('django.core.cache.cache.get_many',
+                            wraps=cache.get_many) as get_many:
+                objs = prefetch_storage_locations(
+                    models.TestModel.objects.order_by('remote'), 'remote')
+                self.assertEqual([o.remote.url for o in objs],
+                                 ['test/0.txt', 'test/1.txt', 'test/2.txt'])
+            self.assertEqual(get_many.call_count, 1)
+            self.assertEqual(get_storage.call_count, 1)
+
+    def test_tracked_transfer_state(self):
+        """
+        Make sure the companion state columns are updated by the transfer
+        task and trusted afterwards.
+        """
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            delayed=True)
+        field = models.TestModel._meta.get_field('tracked')
+        self.addCleanup(setattr, field, 'storage', field.storage)
+        field.storage = storage
+        self.assertEqual(storage.state_fields, ['tests.TestModel.tracked'])
+        self.assertTrue(models.TestModel._meta.get_field('tracked_state').db_index)
+        self.assertNotIn('track_state', field.deconstruct()[3])
+
+        obj = models.TestModel()
+        obj.tracked.save(self.test_file_name, File(self.test_file))
+        self.assertEqual(obj.tracked_state, 'local')
+        self.assertTrue(obj.tracked.transfer().get())
+
+        obj = models.TestModel.objects.get(tracked_state='remote')
+        self.assertIsNotNone(obj.tracked_transferred_at)
+        with mock.patch.object(storage, 'get_storage') as get_storage:
+            self.assertIs(obj.tracked.get_storage(), storage.remote)
+        self.assertFalse(get_storage.called)
+
+    def test_tracked_transfer_state_after_save(self):
+        """
+        Make sure storages which aren't delayed queue the transfer of
+        tracked files once the object is saved, so its state is updated.
+        """
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir))
+        field = models.TestModel._meta.get_field('tracked')
+        self.addCleanup(setattr, field, 'storage', field.storage)
+        field.storage = storage
+
+        with mock.patch('django.db.transaction.on_commit') as on_commit:
+            obj = models.TestModel()
+            obj.tracked.save(self.test_file_name, File(self.test_file))
+            self.assertTrue(storage.using_local(obj.tracked.name))
+            self.assertEqual(on_commit.call_count, 1)
+            # Committed.
+            on_commit.call_args[0][0]()
+        self.assertTrue(storage.result.get())
+        obj = models.TestModel.objects.get(pk=obj.pk)
+        self.assertEqual(obj.tracked_state, 'remote')
+        self.assertTrue(storage.using_remote(obj.tracked.name))
+
+        with mock.patch('django.db.transaction.on_commit',
+                        lambda func, using=None: func()):
+            obj = models.TestModel(tracked=File(self.test_file,
+                                                name=self.test_file_name))
+            obj.save()
+        obj = models.TestModel.objects.get(pk=obj.pk)
+        self.assertEqual(obj.tracked_state, 'remote')
+
+        # Also when saved through a proxy model.
+        with mock.patch('django.db.transaction.on_commit',
+                        lambda func, using=None: func()):
+            obj = models.ProxyTestModel(tracked=File(self.test_file,
+                                                     name=self.test_file_name))
+            obj.save()
+        obj = models.TestModel.objects.get(pk=obj.pk)
+        self.assertEqual(obj.tracked_state, 'remote')
+
+    def test_tracked_clean_names(self):
+        """
+        Make sure the state of objects is updated when the transfer task
+        transfers their files with a clean name, and local files are
+        found by their state.
+        """
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            task='queued_storage.tasks.TransferAndDelete',
+            delayed=True)
+        field = models.TestModel._meta.get_field('tracked')
+        self.addCleanup(setattr, field, 'storage', field.storage)
+        field.storage = storage
+        clean_name = 'test/interview_7_candidate_5_question_8_lang_en-US'
+        storage.local.save(clean_name, File(self.test_file))
+        obj = models.TestModel.objects.create(tracked=clean_name + '_x',
+                                              tracked_state='local')
+        with mock.patch.object(storage, 'get_storage') as get_storage:
+            self.assertIs(obj.tracked.get_storage(), storage.local)
+        self.assertFalse(get_storage.called)
+
+        self.assertTrue(obj.tracked.transfer().get())
+        self.assertTrue(storage.remote.exists(clean_name))
+        obj = models.TestModel.objects.get(pk=obj.pk)
+        self.assertEqual(obj.tracked_state, 'remote')
+
+    def test_batched_signals(self):
+        """
+        Make sure batch transfers send a single files_transferred signal,
+        from a separate task if a signal queue is set.
+        """
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            delayed=True)
+        names = [storage.save('%d.txt' % i, File(self.test_file))
+                 for i in range(3)]
+
+        received, batches = [], []
+
+        def file_receiver(sender, name, **kwargs):
+            received.append(name)
+
+        def files_receiver(sender, names, local, remote, **kwargs):
+            batches.append(names)
+            self.assertIs(sender, tasks.Transfer)
+            self.assertEqual(remote.location, self.remote_dir)
+
+        file_transferred.connect(file_receiver)
+        files_transferred.connect(files_receiver)
+        self.addCleanup(file_transferred.disconnect, file_receiver)
+        self.addCleanup(files_transferred.disconnect, files_receiver)
+
+        storage.transfer_many(names)
+        self.assertEqual(received, names)
+        self.assertEqual(batches, [names])
+
+        with override_settings(QUEUED_STORAGE_SIGNAL_QUEUE='signals'), \
+                mock.patch.object(SendTransferSignals, 'apply_async',
+                                  wraps=SendTransferSignals.apply_async) as apply_async:
+            storage.transfer(names[0]).get()
+        self.assertEqual(apply_async.call_args[1]['queue'], 'signals')
+        self.assertEqual(batches, [names, names[:1]])
+
+    def test_transfer_signal_payload(self):
+        """
+        Make sure the transfer signals provide the size, checksum, content
+        type, duration and remote URL, and the instance and field if the
+        transfer was started from a field file.
+        """
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir,
+                                base_url='/remote/'),
+            delayed=True)
+        field = models.TestModel._meta.get_field('tracked')
+        self.addCleanup(setattr, field, 'storage', field.storage)
+        field.storage = storage
+
+        received, details = [], []
+
+        def file_receiver(sender, name, **kwargs):
+            received.append(kwargs)
+
+        def files_receiver(sender, names, **kwargs):
+            details.append(kwargs['details'])
+
+        file_transferred.connect(file_receiver)
+        files_transferred.connect(files_receiver)
+        self.addCleanup(file_transferred.disconnect, file_receiver)
+        self.addCleanup(files_transferred.disconnect, files_receiver)
+
+        obj = models.TestModel()
+        obj.tracked.save(self.test_file_name, File(self.test_file))
+        self.assertTrue(obj.tracked.transfer().get())
+
+        payload = received[0]
+        self.assertEqual(payload['size'], 4)
+        self.assertEqual(payload['checksum'],
+                         'md5:098f6bcd4621d373cade4e832627b4f6')
+        self.assertEqual(payload['content_type'], 'text/plain')
+        self.assertEqual(payload['url'], '/remote/' + obj.tracked.name)
+        self.assertGreaterEqual(payload['elapsed'], 0)
+        self.assertIs(payload['field'], field)
+        self.assertEqual(payload['instance'].pk, obj.pk)
+        self.assertNotIn('origin', details[0][obj.tracked.name])
+        self.assertEqual(details[0][obj.tracked.name]['size'], 4)
+
+        storage.transfer(obj.tracked.name).get()
+        self.assertIsNone(received[1]['instance'])
+        self.assertIsNone(received[1]['field'])
+
+    def test_transfer_rewindable(self):
+        """
+        Make sure files are uploaded as they are without transforms, so
+        the remote storage can seek to their end and rewind them.
+        """
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            delayed=True)
+        name = storage.save(self.test_file_name, File(self.test_file))
+
+        sizes = []
+        remote_save = FileSystemStorage._save
+
+        def save(remote, name, content):
+            content.seek(0, os.SEEK_END)
+            sizes.append(content.tell())
+            content.seek(0)
+            return remote_save(remote, name, content)
+
+        with mock.patch.object(FileSystemStorage, '_save', autospec=True,
+                               side_effect=save):
+            self.assertTrue(storage.transfer(name).get())
+        self.assertEqual(sizes, [4])
+        with open(path.join(self.remote_dir, name)) as remote_file:
+            self.assertEqual(remote_file.read(), 'test')
+
+    def test_transfer_spooled(self):
+        """
+        Make sure transformed files are spooled for remote storages which
+        seek to their end, and streamed to the others.
+        """
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            transforms=['queued_storage.transforms.checksum'],
+            delayed=True)
+        name = storage.save(self.test_file_name, File(self.test_file))
+        self.assertTrue(streams_uploads(storage.remote))
+
+        sizes = []
+        remote_save = FileSystemStorage._save
+
+        def save(remote, name, content):
+            sizes.append(content.size)
+            content.seek(0, os.SEEK_END)
+            content.seek(0)
+            return remote_save(remote, name, content)
+
+        with self.settings(QUEUED_STORAGE_STREAMING_STORAGES=[]), \
+                mock.patch.object(FileSystemStorage, '_save', autospec=True,
+                                  side_effect=save):
+            self.assertFalse(streams_uploads(storage.remote))
+            self.assertTrue(storage.transfer(name).get())
+        self.assertEqual(sizes, [4])
+        with open(path.join(self.remote_dir, name)) as remote_file:
+            self.assertEqual(remote_file.read(), 'test')
+
+    def test_local_cache(self):
+        """
+        Make sure transferred files are read from local copies, which are
+        downloaded on demand and evicted when exceeding the cache size.
+        """
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            task='queued_storage.tasks.TransferAndDelete',
+            local_cache_size=10)
+        names = [storage.save('%d.txt' % i, File(self.test_file))
+                 for i in range(3)]
+        for name in names:
+            self.assertFalse(storage.local.exists(name))
+
+        with mock.patch.object(storage.remote, 'open',
+                               wraps=storage.remote.open) as remote_open:
+            for name in names[:2]:
+                with storage.open(name) as content:
+                    self.assertEqual(content.read(), b'test')
+                with storage.open(name) as content:
+                    self.assertEqual(content.read(), b'test')
+        self.assertEqual(remote_open.call_count, 2)
+        self.assertTrue(storage.local.exists(names[0]))
+        self.assertTrue(storage.using_remote(names[0]))
+
+        # The first file is the least recently read one.
+        storage.open(names[2]).close()
+        self.assertFalse(storage.local.exists(names[0]))
+        self.assertTrue(storage.local.exists(names[1]))
+        self.assertEqual(storage.local_cache.size, 8)
+
+        # Another process only counts its own copies.
+        os.utime(path.join(self.local_dir, names[1]), (1, 1))
+        other = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            local_cache_size=10)
+        with mock.patch('os.walk') as walk:
+            other.open(names[0]).close()
+        self.assertFalse(walk.called)
+        self.assertEqual(other.local_cache.size, 4)
+        self.assertTrue(storage.local.exists(names[1]))
+
+        # The copies of all processes are counted in the background.
+        field = models.TestModel._meta.get_field('remote')
+        self.addCleanup(setattr, field, 'storage', field.storage)
+        field.storage = other
+        call_command('evict_local_copies', 'tests.TestModel.remote',
+                     stdout=six.StringIO())
+        self.assertEqual(other.local_cache.size, 8)
+        self.assertFalse(storage.local.exists(names[1]))
+        self.assertTrue(storage.local.exists(names[0]))
+        self.assertTrue(storage.local.exists(names[2]))
+
+        storage.delete(names[2])
+        self.assertFalse(storage.local.exists(names[2]))
+        self.assertFalse(storage.remote.exists(names[2]))
+        self.assertNotIn(names[2], storage.local_cache)
+
+    def test_delete_many(self):
+        """
+        Make sure both copies of the files are deleted, the remote ones
+        optionally by a task, and the cache keys removed.
+        """
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir))
+        names = [storage.save('%d.txt' % i, File(self.test_file))
+                 for i in range(4)]
+        keys = [storage.get_cache_key(name) for name in names]
+        for name in names:
+            self.assertTrue(storage.using_remote(name))
+            self.assertTrue(storage.local.exists(name))
+
+        self.assertIsNone(storage.delete_many(names[:2]))
+        for name in names[:2]:
+            self.assertFalse(storage.local.exists(name))
+            self.assertFalse(storage.remote.exists(name))
+        self.assertEqual(cache.get_many(keys[:2]), {})
+
+        with mock.patch.object(storage.delete_task, 'delay') as delay:
+            storage.delete_many(names[2:], deferred=True)
+        self.assertFalse(storage.local.exists(names[2]))
+        self.assertTrue(storage.remote.exists(names[2]))
+        self.assertFalse(storage.exists(names[2]))
+        args = delay.call_args[0]
+        self.assertEqual(args[0], [[name, storage.get_cache_key(name)]
+                                   for name in names[2:]])
+
+        # Their names are taken until they're deleted remotely.
+        self.assertFalse(storage.reserve_name(names[2]))
+        new_name = storage.save(names[3], File(self.test_file))
+        self.assertNotEqual(new_name, names[3])
+
+        self.assertEqual(storage.delete_task.delay(*args).get(), 2)
+        self.assertFalse(storage.remote.exists(names[3]))
+        self.assertEqual(cache.get_many(keys[2:]), {})
+        self.assertTrue(storage.remote.exists(new_name))
+        self.assertTrue(storage.reserve_name(names[2]))
+
+    def test_get_available_name(self):
+        """
+        Make sure names are reserved and the remote storage is asked at
+        most once per name, and only if the cache doesn't know it.
+        """
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            delayed=True)
+        storage.remote.save('taken.txt', File(self.test_file))
+
+        with mock.patch.object(storage.remote, 'exists',
+                               wraps=storage.remote.exists) as exists:
+            name = storage.get_available_name('taken.txt')
+            self.assertTrue(name.startswith('taken_'))
+            self.assertTrue(name.endswith('.txt'))
+            self.assertEqual(exists.call_count, 1)
+
+            # Reserved for the file being saved.
+            self.assertNotEqual(storage.get_available_name(name), name)
+            self.assertNotEqual(storage.get_available_name('taken.txt'),
+                                'taken.txt')
+            self.assertEqual(exists.call_count, 1)
+
+            saved_name = storage.save('free.txt', File(self.test_file))
+            self.assertEqual(saved_name, 'free.txt')
+            self.assertEqual(exists.call_count, 2)
+            self.assertNotEqual(storage.save('free.txt', File(self.test_file)),
+                                'free.txt')
+            self.assertEqual(exists.call_count, 2)
+
+        self.assertEqual(
+            len(storage.get_available_name('x' * 20 + '.txt', max_length=20)),
+            20)
+
+    def test_listdir(self):
+        """
+        Make sure local and remote listings are merged and cached until a
+        file is saved or deleted.
+        """
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            delayed=True)
+        storage.save('docs/local.txt', File(self.test_file))
+        storage.remote.save('docs/remote.txt', File(self.test_file))
+        storage.remote.save('docs/archive/old.txt', File(self.test_file))
+
+        with mock.patch.object(storage.remote, 'listdir',
+                               wraps=storage.remote.listdir) as listdir:
+            self.assertEqual(storage.listdir('docs'),
+                             (['archive'], ['local.txt', 'remote.txt']))
+            self.assertEqual(storage.listdir('docs/'),
+                             (['archive'], ['local.txt', 'remote.txt']))
+            self.assertEqual(listdir.call_count, 1)
+
+            storage.save('docs/new/new.txt', File(self.test_file))
+            self.assertEqual(storage.listdir('docs')[0], ['archive', 'new'])
+            storage.delete('docs/local.txt')
+            self.assertEqual(storage.listdir('docs')[1], ['remote.txt'])
+            self.assertEqual(listdir.call_count, 3)
+
+        self.assertEqual(list(storage.iterdir('missing')), [])
+
+    def test_stat_cache(self):
+        """
+        Make sure the metadata of remote files is cached by the transfer
+        task and looked up at once for many files.
+        """
+        FakeClient.reset()
+        with mock.patch('storages.backends.gcloud.Client', FakeClient), \
+                mock.patch('storages.backends.gcloud.Blob', FakeBlob):
+            storage = QueuedGCSStorage(
+                local_options=dict(location=self.local_dir),
+                remote_options=dict(bucket_name='audio'),
+                task='queued_storage.tasks.TransferAndDelete')
+            names = [storage.save('%d.flac' % i, File(self.test_file))
+                     for i in range(3)]
+            local_name = storage.local.save('local.flac', File(self.test_file))
+            cache.set(storage.get_cache_key(local_name), False)
+            cache.delete(get_stat_key(storage.get_cache_key(names[2])))
+
+            with mock.patch.object(storage.remote.bucket, 'get_blob',
+                                   wraps=storage.remote.bucket.get_blob) as get_blob:
+                stats = storage.stat_many(names + [local_name])
+                self.assertEqual(storage.size(names[0]), 4)
+                self.assertEqual(storage.get_modified_time(names[1]),
+                                 timezone.make_naive(FakeBlob.updated))
+                self.assertEqual(storage.get_created_time(names[2]),
+                                 timezone.make_naive(FakeBlob.time_created))
+            # Only the file whose metadata wasn't cached.
+            self.assertEqual(get_blob.call_count, 1)
+            self.assertEqual(stats[names[2]]['size'], 4)
+            self.assertIsNone(stats[names[2]]['accessed_time'])
+            self.assertEqual(stats[local_name]['size'], 4)
+            self.assertIsNotNone(stats[local_name]['accessed_time'])
+
+            storage.delete(names[0])
+            self.assertIsNone(
+                cache.get(get_stat_key(storage.get_cache_key(names[0]))))
+
+    def test_stat_fields(self):
+        """
+        Make sure remote storages without metadata requests are only asked
+        for the values which are needed.
+        """
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            task='queued_storage.tasks.TransferAndDelete')
+        name = storage.save('test.txt', File(self.test_file))
+        cache.delete(get_stat_key(storage.get_cache_key(name)))
+        remote = storage.remote
+        with mock.patch.object(remote, 'path',
+                               side_effect=NotImplementedError), \
+                mock.patch.object(remote, 'size', return_value=4) as size, \
+                mock.patch.object(remote, 'get_modified_time',
+                                  return_value=FakeBlob.updated) as modified, \
+                mock.patch.object(remote, 'get_created_time',
+                                  return_value=FakeBlob.time_created) as created:
+            self.assertEqual(storage.size(name), 4)
+            self.assertEqual(storage.size(name), 4)
+            self.assertEqual((size.call_count, modified.call_count,
+                              created.call_count), (1, 0, 0))
+            storage.get_modified_time(name)
+            self.assertEqual((size.call_count, modified.call_count,
+                              created.call_count), (1, 1, 0))
+            stat = storage.stat(name)
+            self.assertEqual((size.call_count, modified.call_count,
+                              created.call_count), (1, 1, 1))
+        self.assertEqual(sorted(stat), sorted(STAT_FIELDS))
+
+        # The transfer task records what it measured, and asks for nothing.
+        remote = mock.Mock(spec=['path', 'size', 'get_modified_time'])
+        remote.path.side_effect = NotImplementedError
+        cache_file_stats(remote, {'key': name},
+                         {'key': {'size': 4, 'checksum': 'md5:abc',
+                                  'elapsed': 0.1}})
+        self.assertFalse(remote.size.called)
+        self.assertFalse(remote.get_modified_time.called)
+        self.assertEqual(cache.get(get_stat_key('key')),
+                         {'size': 4, 'checksum': 'md5:abc'})
+
+    def test_journal(self):
+        """
+        Make sure saving only records the transfers in the journal, and
+        draining it queues them in batches.
+        """
+        journal_path = path.join(self.local_dir, 'journal.sqlite3')
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=path.join(self.local_dir, 'files')),
+            remote_options=dict(location=self.remote_dir),
+            journal=journal_path)
+        with mock.patch.object(storage.task, 'delay') as delay:
+            names = [storage.save('%d.txt' % i, File(self.test_file))
+                     for i in range(3)]
+        self.assertFalse(delay.called)
+        self.assertEqual(len(get_journal(journal_path)), 3)
+        self.assertFalse(storage.remote.exists(names[0]))
+
+        with mock.patch.object(TransferBatch, 'delay',
+                               side_effect=IOError("broker down")):
+            self.assertRaises(IOError, drain_journal, journal_path)
+        self.assertEqual(len(get_journal(journal_path)), 3)
+
+        # Transfers queued meanwhile aren't queued twice.
+        in_flight_key = utils.get_in_flight_key(storage.get_cache_key(names[2]))
+        cache.set(in_flight_key, True)
+        with mock.patch.object(TransferBatch, 'delay',
+                               wraps=TransferBatch.delay) as delay:
+            call_command('drain_transfer_journal', journal=journal_path,
+                         batch_size=2, stdout=six.StringIO())
+        self.assertEqual(delay.call_count, 1)
+        self.assertEqual(len(get_journal(journal_path)), 0)
+        for name in names[:2]:
+            self.assertTrue(storage.remote.exists(name))
+            self.assertTrue(storage.using_remote(name))
+        self.assertFalse(storage.remote.exists(names[2]))
+        cache.delete(in_flight_key)
+
+    def test_executors(self):
+        """
+        Make sure transfers can run without Celery, right away or in a
+        pool of threads.
+        """
+        settings.CELERY_ALWAYS_EAGER = False
+        for executor in ['queued_storage.executors.SyncExecutor',
+                         'queued_storage.executors.ThreadPoolExecutor']:
+            storage = QueuedStorage(
+                local='django.core.files.storage.FileSystemStorage',
+                remote='django.core.files.storage.FileSystemStorage',
+                local_options=dict(location=self.local_dir),
+                remote_options=dict(location=self.remote_dir),
+                executor=executor)
+            self.assertIs(storage.executor, utils.get_backend(executor))
+            with mock.patch.object(tasks.Transfer, 'delay') as delay:
+                name = storage.save('single.txt', File(self.test_file))
+                self.assertTrue(storage.result.get(timeout=10))
+                names = [storage.local.save('%d.txt' % i, File(self.test_file))
+                         for i in range(4)]
+                results = []
+                storage.transfer_many(names, batch_size=1,
+                                      callback=lambda result, batch:
+                                      results.append(result))
+                self.assertEqual([result.get(timeout=10) for result in results],
+                                 [1] * 4)
+            self.assertFalse(delay.called)
+            for name in names + [name]:
+                self.assertTrue(storage.remote.exists(name))
+                self.assertTrue(storage.using_remote(name))
+            if hasattr(storage.executor, 'join'):
+                storage.executor.join()
+            storage.delete_many(names + [name])
+
+        self.assertRaises(ValueError, SyncExecutor().submit(
+            tasks.NoneReturningTask, ['missing', 'key',
+                                      'django.core.files.storage.FileSystemStorage',
+                                      'django.core.files.storage.FileSystemStorage',
+                                      {}, {}]).get)
+
+    def test_transfer_coalesced(self):
+        """
+        Make sure a file isn't queued again while its transfer is queued.
+        """
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            delayed=True)
+        names = [storage.save('%d.txt' % i, File(self.test_file))
+                 for i in range(3)]
+
+        # Files whose task couldn't be queued aren't marked.
+        with mock.patch.object(storage.task, 'delay',
+                               side_effect=IOError("broker down")):
+            self.assertRaises(IOError, storage.transfer, names[0])
+        with mock.patch.object(storage.batch_task, 'delay',
+                               side_effect=IOError("broker down")):
+            self.assertRaises(IOError, storage.transfer_many, names)
+
+        with mock.patch.object(storage.task, 'delay') as delay:
+            self.assertIsNotNone(storage.transfer(names[0]))
+            self.assertIsNone(storage.transfer(names[0]))
+        self.assertEqual(delay.call_count, 1)
+
+        with mock.patch.object(storage.batch_task, 'delay') as delay:
+            self.assertEqual(storage.transfer_many(names), 2)
+            self.assertEqual(storage.transfer_many(names), 0)
+        self.assertEqual(delay.call_count, 1)
+        self.assertEqual(delay.call_args[0][0],
+                         [[name, storage.get_cache_key(name)]
+                          for name in names[1:]])
+        self.assertFalse(storage.using_remote(names[0]))
+
+        # Lost tasks only hold up the file until the mark expires.
+        cache.delete_many([utils.get_in_flight_key(storage.get_cache_key(name))
+                           for name in names])
+        self.assertEqual(storage.transfer_many(names), 3)
+        for name in names:
+            self.assertTrue(storage.using_remote(name))
+        # Transferred files may be queued again.
+        self.assertTrue(storage.transfer(names[0]).get())
+
+    def test_lease(self):
+        """
+        Make sure a lease is exclusive, renewed while held and removed by
+        its holder only.
+        """
+        lease = Lease('test-lease', timeout=0.3)
+        with lease:
+            self.assertTrue(lease.acquired)
+            self.assertFalse(Lease('test-lease').acquire())
+            time.sleep(0.5)
+            # Renewed by the heartbeat.
+            self.assertEqual(cache.get('test-lease'), lease.token)
+        self.assertIsNone(cache.get('test-lease'))
+
+        with Lease('test-lease') as lease:
+            cache.set('test-lease', 'someone else')
+            self.assertFalse(lease.renew())
+        self.assertEqual(cache.get('test-lease'), 'someone else')
+
+    def test_transfer_leased(self):
+        """
+        Make sure files leased by another worker are skipped.
+        """
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            delayed=True)
+        names = [storage.save('%d.txt' % i, File(self.test_file))
+                 for i in range(2)]
+        cache_key = storage.get_cache_key(names[0])
+        with Lease(get_lease_key(cache_key)):
+            self.assertEqual(storage.transfer_many(names), 2)
+            self.assertFalse(storage.remote.exists(names[0]))
+            self.assertTrue(storage.remote.exists(names[1]))
+            # The in-flight mark is removed by the lease holder.
+            cache.delete(utils.get_in_flight_key(cache_key))
+            self.assertIsNone(storage.transfer(names[0]).get())
+            cache.delete(utils.get_in_flight_key(cache_key))
+        self.assertTrue(storage.transfer(names[0]).get())
+        self.assertTrue(storage.remote.exists(names[0]))
+
+    def test_migration(self):
+        """
+        Make sure files are read from the previous remote storage until
+        they've been migrated, and migrations can be resumed.
+        """
+        previous_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, previous_dir)
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            previous_remote='django.core.files.storage.FileSystemStorage',
+            previous_remote_options=dict(location=previous_dir))
+        names = ['a-b.txt', 'a/1.txt', 'a/2.txt', 'b.txt', 'c/d/3.txt']
+        for name in reversed(names):
+            storage.previous_remote.save(name, File(self.test_file))
+        self.assertEqual(list(walk_files(storage.previous_remote)), names)
+        self.assertEqual(list(walk_files(storage.previous_remote,
+                                         after='a/1.txt')), names[2:])
+        self.assertEqual(list(walk_files(storage.previous_remote, 'a')),
+                         names[1:3])
+
+        self.assertIs(storage.get_storage('b.txt'), storage.previous_remote)
+        self.assertTrue(storage.using_remote('b.txt'))
+        self.assertTrue(storage.exists('b.txt'))
+        new_name = storage.save('new.txt', File(self.test_file))
+        self.assertIs(storage.get_storage(new_name), storage.remote)
+        self.assertEqual(storage.listdir(''), (['a', 'c'],
+                                               ['a-b.txt', 'b.txt',
+                                                'new.txt']))
+
+        # Interrupted while queuing the third batch.
+        checkpoint = path.join(self.local_dir, 'checkpoint.txt')
+        with mock.patch.object(storage.migrate_task, 'delay',
+                               side_effect=[None, None, IOError]) as delay:
+            self.assertRaises(IOError, migrate_files, storage, batch_size=1,
+                              checkpoint=checkpoint)
+        self.assertEqual(delay.call_args_list[1][0][0],
+                         [['a/1.txt', storage.get_cache_key('a/1.txt')]])
+        with open(checkpoint) as fp:
+            self.assertEqual(fp.read(), 'a/1.txt')
+
+        field = models.TestModel._meta.get_field('remote')
+        field.storage = storage
+        self.assertIs(get_queued_storage('tests.TestModel.remote'), storage)
+        self.assertRaisesMessage(
+            ValueError, "The model 'tests.TestModel' has no file field 'id'.",
+            get_queued_storage, 'tests.TestModel.id')
+        self.assertRaises(CommandError, call_command, 'migrate_remote_files',
+                          'tests.TestModel.missing')
+        call_command('migrate_remote_files', 'tests.TestModel.remote',
+                     checkpoint=checkpoint, batch_size=2,
+                     stdout=six.StringIO())
+        for name in names[2:]:
+            self.assertTrue(storage.remote.exists(name))
+            self.assertIs(storage.get_storage(name), storage.remote)
+        for name in names[:2]:
+            self.assertFalse(storage.remote.exists(name))
+            self.assertIs(storage.get_storage(name), storage.previous_remote)
+        with open(checkpoint) as fp:
+            self.assertEqual(fp.read(), 'c/d/3.txt')
+        self.assertEqual(migrate_files(storage, checkpoint=checkpoint), 0)
+
+        # The first two files were queued but never migrated.
+        stdout = six.StringIO()
+        call_command('migrate_remote_files', 'tests.TestModel.remote',
+                     verify=True, stdout=stdout)
+        self.assertIn("Queued the migration of 2 files again",
+                      stdout.getvalue())
+        for name in names[:2]:
+            self.assertTrue(storage.remote.exists(name))
+        with mock.patch.object(storage.remote, 'exists') as exists:
+            self.assertEqual(verify_migration(storage), 0)
+        self.assertFalse(exists.called)
+
+        self.assertEqual(migrate_files(storage, 'a'), 2)
+        self.assertIs(storage.get_storage('a/1.txt'), storage.remote)
+        storage.delete('a/1.txt')
+        self.assertFalse(storage.previous_remote.exists('a/1.txt'))
+        self.assertFalse(storage.exists('a/1.txt'))
+
+        storage.delete_many(['a/2.txt', 'b.txt'])
+        for name in ['a/2.txt', 'b.txt']:
+            self.assertFalse(storage.remote.exists(name))
+            self.assertFalse(storage.previous_remote.exists(name))
+            self.assertFalse(storage.exists(name))
+
+    def test_tiers(self):
+        """
+        Make sure files are moved to the coldest tier whose policy they
+        match, and found there.
+        """
+        warm_dir, cold_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, warm_dir)
+        self.addCleanup(shutil.rmtree, cold_dir)
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            tiers=[
+                ('django.core.files.storage.FileSystemStorage',
+                 dict(location=warm_dir),
+                 ('queued_storage.tiering.older_than', {'days': 30})),
+                ('django.core.files.storage.FileSystemStorage',
+                 dict(location=cold_dir),
+                 [('queued_storage.tiering.older_than', {'days': 365}),
+                  ('queued_storage.tiering.larger_than', {'size': 4})]),
+            ])
+        ages = {'new.txt': 0, 'old.txt': 60, 'ancient.txt': 400,
+                'small.txt': 400}
+        for name, age in ages.items():
+            content = b'tiny' if name == 'small.txt' else b'content'
+            storage.save(name, ContentFile(content))
+            mtime = time.time() - age * 24 * 60 * 60
+            os.utime(storage.remote.path(name), (mtime, mtime))
+            cache.delete(get_stat_key(storage.get_cache_key(name)))
+        self.assertEqual(storage.demote(['new.txt']), 0)
+
+        field = models.TestModel._meta.get_field('remote')
+        field.storage = storage
+        call_command('demote_files', 'tests.TestModel.remote', batch_size=2,
+                     stdout=six.StringIO())
+        expected = {'new.txt': 1, 'old.txt': 2, 'ancient.txt': 3,
+                    'small.txt': 2}
+        for name, tier in expected.items():
+            self.assertEqual(cache.get(storage.get_cache_key(name)), tier)
+            self.assertIs(storage.get_storage(name), storage.tiers[tier])
+            self.assertTrue(storage.using_remote(name))
+            for other in range(1, len(storage.tiers)):
+                self.assertEqual(storage.tiers[other].exists(name),
+                                 other == tier)
+        with storage.open('ancient.txt') as fp:
+            self.assertEqual(fp.read(), b'content')
+        self.assertEqual(storage.listdir('')[1], sorted(ages))
+
+        cache.clear()
+        self.assertIs(storage.get_storage('ancient.txt'), storage.tiers[3])
+        self.assertEqual(cache.get(storage.get_cache_key('ancient.txt')), 3)
+
+        # Names of demoted files aren't reused.
+        storage.local.delete('ancient.txt')
+        cache.clear()
+        self.assertFalse(storage.reserve_name('ancient.txt'))
+        self.assertEqual(cache.get(storage.get_cache_key('ancient.txt')), 3)
+
+        # Nor is the state column trusted for them.
+        tracked = models.TestModel._meta.get_field('tracked')
+        self.addCleanup(setattr, tracked, 'storage', tracked.storage)
+        tracked.storage = storage
+        instance = models.TestModel(tracked='ancient.txt',
+                                    tracked_state='remote')
+        self.assertIs(instance.tracked.get_storage(), storage.tiers[3])
+
+        storage.delete_many(['ancient.txt'])
+        self.assertFalse(storage.tiers[3].exists('ancient.txt'))
+        self.assertFalse(storage.exists('ancient.txt'))
+
+    def test_access_counts(self):
+        """
+        Make sure sampled accesses are counted, flushed to the cache and
+        used to warm the local copies.
+        """
+        sketch = CountMinSketch(width=4, depth=2)
+        for key in ['a'] * 5 + ['b', 'c', 'd', 'e']:
+            sketch.add(key)
+        self.assertGreaterEqual(sketch.estimate('a'), 5)
+        self.assertGreaterEqual(sketch.estimate('e'), 1)
+
+        storage = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            task='queued_storage.tasks.TransferAndDelete',
+            access_sample_rate=1)
+        names = [storage.save('%d.txt' % i, File(self.test_file))
+                 for i in range(3)]
+        for _ in range(3):
+            storage.open(names[2]).close()
+        storage.url(names[1])
+        self.assertEqual(storage.hot_files(), [])
+        storage.access_tracker.flush()
+        self.assertEqual(storage.hot_files(), [(names[2], 3), (names[1], 1)])
+        storage.open(names[1]).close()
+        storage.access_tracker.flush()
+        self.assertEqual(storage.access_tracker.get_count(names[1]), 2)
+        self.assertEqual(storage.access_tracker.get_count(names[0]), 0)
+        self.assertEqual(storage.hot_files(1), [(names[2], 3)])
+
+        storage.access_tracker.sample_rate = 0.5
+        with mock.patch('random.random', return_value=0.9):
+            storage.open(names[0]).close()
+        self.assertEqual(storage.access_tracker._candidates, {})
+
+        cached = QueuedStorage(
+            local='django.core.files.storage.FileSystemStorage',
+            remote='django.core.files.storage.FileSystemStorage',
+            local_options=dict(location=self.local_dir),
+            remote_options=dict(location=self.remote_dir),
+            local_cache_size=4, access_sample_rate=0.1)
+        self.assertEqual(cached.warm(), 1)
+        self.assertTrue(cached.local.exists(names[2]))
+        self.assertFalse(cached.local.exists(names[1]))
+
+        self.assertTrue(match_policy(
+            ('queued_storage.tiering.rarely_accessed', {'count': 2}),
+            names[0], {'access_count': 1}))
+        self.assertFalse(match_policy(
+            'queued_storage.tiering.rarely_accessed', names[0], {}))
+
+    def test_signed_url_cache(self):
+        """
+        Make sure signed URLs of remote files are reused until shortly
+        before they expire, across storage instances.
+        """
+        FakeClient.reset()
+        with mock.patch('storages.backends.gcloud.Client', FakeClient):
+            storage = QueuedGCSStorage(
+                local_options=dict(location=self.local_dir),
+                remote_options=dict(bucket_name='audio'))
+            other = QueuedGCSStorage(
+                local_options=dict(location=self.local_dir),
+                remote_options=dict(bucket_name='audio'))
+            FakeClient.objects['audio'] = {'a.flac': b'audio'}
+            cache.set(storage.get_cache_key('a.flac'), True)
+            url = storage.url('a.flac')
+            self.assertEqual(url, 'https://signed/audio/a.flac?signature=1')
+            self.assertEqual(storage.url('a.flac'), url)
+            self.assertEqual(other.url('a.flac'), url)
+            signatures = storage.remote.client.signatures
+            self.assertEqual(len(signatures), 1)
+
+            expires = time.time() + 24 * 60 * 60
+            with mock.patch('time.time', return_value=expires - 200):
+                self.assertNotEqual(storage.url('a.flac'), url)
+            self.assertEqual(len(signatures), 2)
+
+            uncached = QueuedGCSStorage(
+                local_options=dict(location=self.local_dir),
+                remote_options=dict(bucket_name='audio'), url_cache_size=0)
+            uncached.url('a.flac')
+            uncached.url('a.flac')
+            self.assertEqual(len(uncached.remote.client.signatures), 2)
+
+            name = storage.local.save('b.flac', File(self.test_file))
+            cache.set(storage.get_cache_key(name), False)
+            self.assertEqual(storage.url(name), storage.local.url(name))
+            self.assertIsNone(cache.get(storage.get_url_key(name,
+                                                            storage.local)))
@@ -0,0 +1,137 @@
+import io
+import struct
+import subprocess
+import wave
+
+import six
+from django.core.files.base import ContentFile
+from django.test import TestCase
+
+from queued_storage import transforms
+
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
+
+class TransformTests(TestCase):
+
+    def test_pipe(self):
+        """
+        Make sure chunks are streamed through the subprocess.
+        """
+        chunks = transforms.pipe(iter([b'abc'] * 1000), 'abc', ['tr', 'a-z', 'A-Z'],
+                                 chunk_size=7)
+        self.assertEqual(b''.join(chunks), b'ABC' * 1000)
+
+    def test_pipe_failure(self):
+        chunks = transforms.pipe([b'abc'], 'abc', ['sh', '-c', 'cat >/dev/null; exit 3'])
+        self.assertRaises(subprocess.CalledProcessError, list, chunks)
+
+    def test_apply_transforms(self):
+        content = ContentFile(b'audio' * 100000)
+        self.assertIs(transforms.apply_transforms(content, 'a.raw', []), content)
+        transformed = transforms.apply_transforms(
+            content, 'a.raw', ['tests.tasks.upper', 'tests.tasks.upper'])
+        self.assertIsNone(transformed.size)
+        self.assertFalse(transformed.file.seekable())
+        self.assertEqual(transformed.file.seek(0), 0)
+        self.assertEqual(b''.join(transformed.chunks()), b'AUDIO' * 100000)
+        self.assertRaises(io.UnsupportedOperation, transformed.seek, 0)
+
+    def test_transform_options(self):
+        content = ContentFile(b'abc')
+        transformed = transforms.apply_transforms(content, 'a.txt', [
+            ('queued_storage.transforms.pipe', {'args': ['tr', 'a-z', 'A-Z']}),
+            ['queued_storage.transforms.checksum', {'algorithm': 'sha1'}],
+        ])
+        self.assertEqual(transformed.read(), b'ABC')
+        self.assertEqual(transforms.get_checksum('a.txt'),
+                         'sha1:3c01bdbb26f358bab27f267924aa2c9a03fcfdb8')
+
+    def test_strip_exif(self):
+        exif = b'\xff\xe1\x00\x08Exif\x00\x00'
+        quantization = b'\xff\xdb\x00\x04\x01\x02'
+        data = b'\xff\xda' + b'\x00' * 100000 + b'\xff\xd9'
+        image = b'\xff\xd8' + exif + quantization + data
+        chunks = [image[i:i + 5] for i in range(0, len(image), 5)]
+        stripped = b''.join(transforms.strip_exif(chunks, 'photo.JPG'))
+        self.assertEqual(stripped, b'\xff\xd8' + quantization + data)
+        self.assertEqual(b''.join(transforms.strip_exif([image], 'photo.png')),
+                         image)
+
+    def test_strip_exif_truncated(self):
+        for image in [b'\xff\xd8\xff\xe1', b'\xff\xd8\xff\xe1\x00']:
+            self.assertEqual(b''.join(transforms.strip_exif([image],
+                                                            'photo.jpg')),
+                             image)
+
+    def test_flac_command(self):
+        transcoder = transforms.FlacTranscoder()
+        with mock.patch.object(transforms, 'which', lambda name: '/bin/' + name):
+            command = transcoder.get_command('audios/answer.raw')
+        self.assertEqual(command[:9], ['/bin/ffmpeg', '-loglevel', 'error',
+                                       '-f', 's16le', '-ar', '16000', '-ac', '1'])
+        self.assertEqual(command[-7:], ['-ac', '1', '-ar', '16000',
+                                        '-f', 'flac', 'pipe:1'])
+
+        def which(name):
+            return '/bin/sox' if name == 'sox' else None
+
+        with mock.patch.object(transforms, 'which', which):
+            command = transcoder.get_command('audios/answer.webm')
+        self.assertEqual(command, ['/bin/sox', '-t', 'webm', '-', '-t', 'flac',
+                                   '-r', '16000', '-c', '1', '-'])
+
+    def test_flac_fallback(self):
+        """
+        Make sure files are passed on untouched without ffmpeg and sox.
+        """
+        with mock.patch.object(transforms, 'which', lambda name: None):
+            chunks = transforms.to_flac([b'fLaC', b'data'], 'answer.flac')
+            self.assertEqual(list(chunks), [b'fLaC', b'data'])
+            self.assertRaises(ValueError, transforms.to_flac, [b'\x1aE'],
+                              'answer.webm')
+
+            samples = [(i * 37) % 65536 - 32768 for i in range(5000)]
+            pcm = struct.pack('<5000h', *samples)
+            wav = io.BytesIO()
+            writer = wave.open(wav, 'wb')
+            writer.setnchannels(1)
+            writer.setsampwidth(2)
+            writer.setframerate(16000)
+            writer.writeframes(pcm)
+            writer.close()
+            encoded = b''.join(transforms.to_flac([pcm[:999], pcm[999:]],
+                                                  'answer.raw'))
+            self.assertEqual(b''.join(transforms.to_flac([wav.getvalue()],
+                                                         'answer.wav')),
+                             encoded)
+            content = transforms.apply_transforms(
+                ContentFile(pcm), 'answer.raw',
+                ['queued_storage.transforms.to_flac'])
+            self.assertEqual(content.content_type, 'audio/flac')
+
+        # STREAMINFO: 16 kHz, mono, 16 bits per sample.
+        self.assertEqual(encoded[:8], b'fLaC\x80\x00\x00\x22')
+        self.assertEqual(encoded[18:21], b'\x03\xe8\x00')
+        self.assertEqual(six.indexbytes(encoded, 21) >> 4, 0xf)
+        # Two frames of verbatim big-endian samples with valid CRCs.
+        decoded, position = [], 42
+        while position < len(encoded):
+            # Sync code, block size, channels and sample size, frame
+            # number, block size and CRC-8.
+            header_size = 8
+            header = encoded[position:position + header_size]
+            self.assertEqual(header[:4], b'\xff\xf8\x70\x08')
+            self.assertEqual(transforms._crc8(header[:-1]),
+                             six.indexbytes(header, 7))
+            count = struct.unpack('>H', header[5:7])[0] + 1
+            end = position + header_size + 1 + count * 2
+            decoded.extend(struct.unpack('>%dh' % count,
+                                         encoded[position + header_size + 1:end]))
+            self.assertEqual(transforms._crc16(encoded[position:end]),
+                             struct.unpack('>H', encoded[end:end + 2])[0])
+            position = end + 2
+        self.assertEqual(decoded, samples)
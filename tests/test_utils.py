@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+from os import path
+
+from django.test import TestCase
+
+from queued_storage import utils
+
+from .gcs import FakeClient
+
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
+
+class GCSUploadTests(TestCase):
+
+    def setUp(self):
+        FakeClient.reset()
+        utils.reset_gcs_client()
+        patcher = mock.patch.object(utils.storage, 'Client', FakeClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(utils.reset_gcs_client)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def make_file(self, name, content=b'audio'):
+        file_path = path.join(self.tmp_dir, name)
+        with open(file_path, 'wb') as fp:
+            fp.write(content)
+        return file_path
+
+    def test_client_is_shared(self):
+        """
+        Make sure all uploads share one client and bucket handle.
+        """
+        first = utils.upload_file_to_gcs(self.make_file('a.flac'))
+        second = utils.upload_file_to_gcs(self.make_file('b.flac'))
+        self.assertEqual(len(FakeClient.instances), 1)
+        self.assertTrue(first.startswith('gs://%s/' % utils.CLOUD_STORAGE_BUCKET))
+        self.assertTrue(second.endswith('b.flac'))
+        self.assertIs(utils.get_gcs_bucket(), utils.get_gcs_bucket())
+
+    def test_client_recreated_after_fork(self):
+        utils.get_gcs_client()
+        with mock.patch.object(os, 'getpid', return_value=-1):
+            utils.get_gcs_client()
+        self.assertEqual(len(FakeClient.instances), 2)
+
+    def test_resumable_chunk_size(self):
+        utils.upload_file_to_gcs(self.make_file('a.flac'), chunk_size=256 * 1024)
+        client = utils.get_gcs_client()
+        self.assertEqual(client.uploads[0][1], 256 * 1024)
+
+    def test_batch_upload(self):
+        """
+        Make sure a batch upload returns the URIs in order.
+        """
+        filenames = [self.make_file('%d.flac' % i, b'%d' % i) for i in range(10)]
+        uris = utils.upload_files_to_gcs(filenames, bucket_name='batch', workers=4)
+        self.assertEqual(uris, ['gs://batch/%s' % name for name in filenames])
+        self.assertEqual(len(FakeClient.instances), 1)
+        self.assertEqual(FakeClient.objects['batch'][filenames[3]], b'3')
+        self.assertEqual(utils.upload_files_to_gcs([]), [])